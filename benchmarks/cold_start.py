@@ -0,0 +1,78 @@
+"""
+Cold-start benchmark: time to import the bot module and to serve
+/check from an on-disk outages snapshot.
+
+    python benchmarks/cold_start.py --lines 5000 --output results.json
+"""
+import common  # isort: skip  # puts bot/ on sys.path
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from matcher import OutageIndex
+from snapshot import (outages_fingerprint, read_snapshot_file,
+                      write_snapshot_file)
+
+IMPORT_SCRIPT = (
+    "import time; started = time.perf_counter(); import bot; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def time_import(runs):
+    """Seconds to import bot.py in a fresh interpreter, without a database."""
+    env = {**os.environ, "RETRY_PERIOD": "60", "DB_HOST": "", "TOKEN_PROD": ""}
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            cwd=common.BOT_DIR, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return common.summary(samples)
+
+
+def time_warm_start(path, address, runs):
+    """Seconds from reading the snapshot file to answering one /check."""
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        _, outages = read_snapshot_file(path)
+        index = OutageIndex(outages)
+        index.render(index.find(address))
+        samples.append(time.perf_counter() - started)
+    return common.summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dates", type=int, default=10)
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    outages = common.synthetic_outages(args.dates, args.lines)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "outages.json")
+        write_snapshot_file(path, outages, outages_fingerprint(outages))
+        results = {
+            "meta": common.metadata(
+                dates=args.dates, lines=args.lines, runs=args.runs
+            ),
+            "benchmarks": {
+                "startup.import": time_import(args.runs),
+                "startup.warm_from_file": time_warm_start(
+                    path, common.street_name(3), args.runs
+                ),
+            },
+        }
+    common.write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
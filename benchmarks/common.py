@@ -0,0 +1,138 @@
+"""Synthetic datasets, timing and result files shared by the benchmarks."""
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_DIR = os.path.join(ROOT, "bot")
+if BOT_DIR not in sys.path:
+    sys.path.insert(0, BOT_DIR)
+os.environ.setdefault("RETRY_PERIOD", "60")
+
+SYLLABLES = ("ба", "ра", "ка", "ти", "ша", "мо", "ле", "ну")
+
+PRESETS = {
+    "small": {"dates": 10, "lines": 2_000, "users": 10_000},
+    "medium": {"dates": 30, "lines": 5_000, "users": 100_000},
+    "large": {"dates": 60, "lines": 10_000, "users": 1_000_000},
+}
+
+
+def street_name(number):
+    """Unique street names of equal length, none a substring of another."""
+    syllables = []
+    for _ in range(5):
+        number, digit = divmod(number, len(SYLLABLES))
+        syllables.append(SYLLABLES[digit])
+    return "".join(syllables).capitalize() + "яна"
+
+
+def synthetic_outages(dates, lines, streets=None, seed=1):
+    """{date: [line, ...]} with `lines` lines spread over `dates` dates."""
+    rng = random.Random(seed)
+    streets = streets or max(1, lines // 2)
+    outages = {}
+    for number in range(lines):
+        date = f"{number % dates + 1} декабря текущего года:"
+        first = rng.randint(1, 80)
+        if number % 5 == 4:
+            line = f"село {street_name(rng.randrange(streets))}"
+        else:
+            line = (
+                f"дома {first}-{first + rng.randint(0, 20)} "
+                f"по ул. {street_name(rng.randrange(streets))}"
+            )
+        outages.setdefault(date, []).append(line)
+    return outages
+
+
+def synthetic_page(outages):
+    """HTML of the outages site for a {date: [line, ...]} dict."""
+    paragraphs = []
+    for date, lines in outages.items():
+        paragraphs.append(f"<p>{date}</p>")
+        paragraphs.extend(f"<p>{line},</p>" for line in lines)
+    return (
+        "<html><body><div class='content'>"
+        + "".join(paragraphs)
+        + "</div></body></html>"
+    )
+
+
+def synthetic_subscriptions(users, streets, addresses_per_user=2, seed=2):
+    """
+    {user_id: {"last_msg_hash": None, "addresses": [...]}} where users
+    follow random streets, a third of them with a house number, and some
+    streets do not exist in the outages at all.
+    """
+    rng = random.Random(seed)
+    user_data = {}
+    for user_id in range(1, users + 1):
+        addresses = []
+        for _ in range(addresses_per_user):
+            street = street_name(rng.randrange(streets * 2))
+            if rng.random() < 0.3:
+                street = f"{street} {rng.randint(1, 100)}"
+            addresses.append(street)
+        user_data[user_id] = {"last_msg_hash": None, "addresses": addresses}
+    return user_data
+
+
+def summary(samples):
+    return {
+        "runs": len(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "min": min(samples),
+        "max": max(samples),
+    }
+
+
+def measure(func, runs=5, warmup=1):
+    """Run func warmup + runs times and summarize the timed runs."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return summary(samples)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(**params):
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+    }
+
+
+def write_results(path, results):
+    """Print results as JSON and write them to path when given."""
+    payload = json.dumps(results, indent=2, ensure_ascii=False)
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(payload + "\n")
+    print(payload)
@@ -0,0 +1,53 @@
+"""
+Compare two benchmark result files and flag regressions.
+
+    python benchmarks/compare.py base.json head.json --threshold 1.2
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def compare(base, head, threshold):
+    """Return [(name, base median, head median, ratio, regressed), ...]."""
+    rows = []
+    for name, result in head["benchmarks"].items():
+        if name not in base["benchmarks"]:
+            continue
+        before = base["benchmarks"][name]["median"]
+        after = result["median"]
+        ratio = after / before if before else float("inf")
+        rows.append((name, before, after, ratio, ratio > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument(
+        "--threshold", type=float, default=1.2,
+        help="head/base median ratio above which a benchmark regressed"
+    )
+    args = parser.parse_args()
+
+    base = load(args.base)
+    head = load(args.head)
+    if base["meta"]["params"] != head["meta"]["params"]:
+        print("Warning: results were produced with different parameters")
+
+    print(f"{'benchmark':<28}{'base':>12}{'head':>12}{'ratio':>8}")
+    rows = compare(base, head, args.threshold)
+    for name, before, after, ratio, regressed in rows:
+        mark = "  REGRESSED" if regressed else ""
+        print(f"{name:<28}{before:>12.4f}{after:>12.4f}{ratio:>8.2f}{mark}")
+    sys.exit(1 if any(row[-1] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
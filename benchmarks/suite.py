@@ -0,0 +1,195 @@
+"""
+Benchmarks of the parser, the matching done by main()/my()/check() and a
+full broadcast cycle against stubbed Telegram and database layers.
+
+    python benchmarks/suite.py --preset small --output results/HEAD.json
+    python benchmarks/compare.py results/base.json results/HEAD.json
+"""
+import common  # isort: skip  # puts bot/ on sys.path
+import argparse
+import logging
+import random
+from contextlib import nullcontext
+from parser import Parser
+
+import requests_mock
+from broadcast import affected_users, changed_messages
+from db import HashBatchWriter
+from matcher import OutageIndex
+from sender import SendQueue
+
+URL = "https://outages.test/"
+SAMPLE_USERS = 1_000
+
+
+class FakeConnection:
+    encoding = "UTF8"
+
+
+class FakeCursor:
+    """Enough of a psycopg2 cursor for execute_values to build its SQL."""
+
+    connection = FakeConnection()
+
+    def __init__(self):
+        self.statements = 0
+
+    def mogrify(self, template, args):
+        return (template % tuple(repr(arg) for arg in args)).encode()
+
+    def execute(self, query, params=None):
+        self.statements += 1
+
+
+def bench_parser(outages, runs, engine):
+    page = common.synthetic_page(outages)
+    parser = Parser(engine=engine)
+    parser.url = URL
+    with requests_mock.Mocker() as mock:
+        mock.get(URL, text=page)
+        result = common.measure(parser.parse_website, runs)
+    result["bytes"] = len(page.encode("utf-8"))
+    return result
+
+
+def bench_match_all(outages, user_data, runs):
+    """The match stage of main(): every subscription against the page."""
+    user_addresses = {
+        user_id: data["addresses"] for user_id, data in user_data.items()
+    }
+    return common.measure(
+        lambda: OutageIndex(outages).match_subscribers(user_addresses), runs
+    )
+
+
+def bench_my(outages, user_data, runs):
+    """/my for a sample of users against the cached index."""
+    index = OutageIndex(outages)
+    sample = random.Random(3).sample(
+        list(user_data), min(SAMPLE_USERS, len(user_data))
+    )
+
+    def run():
+        for user_id in sample:
+            index.render(index.positions_for(user_data[user_id]["addresses"]))
+
+    result = common.measure(run, runs)
+    result["requests"] = len(sample)
+    return result
+
+
+def bench_check(outages, user_data, runs):
+    """/check of a sample of addresses, each on a fresh index."""
+    addresses = [
+        data["addresses"][0]
+        for data in list(user_data.values())[:SAMPLE_USERS]
+    ]
+
+    def run():
+        index = OutageIndex(outages)
+        for address in addresses:
+            index.render(index.find(address))
+
+    result = common.measure(run, runs)
+    result["requests"] = len(addresses)
+    return result
+
+
+def bench_cycle(outages, user_data, runs, after_restart=False):
+    """
+    One background cycle: affected users, changed messages, delivery
+    through SendQueue to a no-op Telegram and batched hash updates into a
+    fake cursor. Either one line of the page changed, or the bot just
+    restarted and checks every user.
+    """
+    last_outages = None
+    if not after_restart:
+        last_outages = dict(outages)
+        changed_date = next(iter(last_outages))
+        last_outages[changed_date] = last_outages[changed_date][1:]
+    counts = {"sent": 0, "statements": 0}
+
+    def send(user_id, text):
+        counts["sent"] += 1
+
+    def run():
+        cursor = FakeCursor()
+
+        def get_cursor():
+            return nullcontext(cursor)
+
+        send_queue = SendQueue(
+            send, workers=4, rate=10**9, per_chat_interval=0
+        )
+        send_queue.start()
+        writer = HashBatchWriter(get_cursor, batch_size=500)
+        index = OutageIndex(outages)
+        affected = affected_users(user_data, last_outages, outages)
+        users = {
+            user_id: data for user_id, data in user_data.items()
+            if user_id in affected
+        }
+        for user_id, message, message_hash in changed_messages(index, users):
+            send_queue.submit(
+                user_id, message,
+                on_delivered=lambda uid, h=message_hash: writer.add(uid, h)
+            )
+        send_queue.join()
+        writer.flush()
+        counts["statements"] += cursor.statements
+
+    result = common.measure(run, runs)
+    result["messages"] = counts["sent"] // (runs + 1)
+    return result
+
+
+BENCHMARKS = {
+    "parser.html_parser": lambda o, u, r: bench_parser(o, r, "html.parser"),
+    "parser.lxml": lambda o, u, r: bench_parser(o, r, "lxml"),
+    "matcher.match_all": bench_match_all,
+    "matcher.my": bench_my,
+    "matcher.check": bench_check,
+    "broadcast.cycle_changed": bench_cycle,
+    "broadcast.cycle_restart": lambda o, u, r: bench_cycle(
+        o, u, r, after_restart=True
+    ),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--preset", choices=common.PRESETS, default="small")
+    parser.add_argument("--dates", type=int)
+    parser.add_argument("--lines", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--only", action="append", choices=BENCHMARKS,
+        help="run only these benchmarks, may be repeated"
+    )
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    params = {
+        key: getattr(args, key) or value
+        for key, value in common.PRESETS[args.preset].items()
+    }
+    outages = common.synthetic_outages(params["dates"], params["lines"])
+    user_data = common.synthetic_subscriptions(
+        params["users"], params["lines"] // 2
+    )
+
+    results = {
+        "meta": common.metadata(preset=args.preset, runs=args.runs, **params),
+        "benchmarks": {},
+    }
+    for name in args.only or BENCHMARKS:
+        results["benchmarks"][name] = BENCHMARKS[name](
+            outages, user_data, args.runs
+        )
+    common.write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,564 @@
+import asyncio
+import logging
+import os
+import time
+import weakref
+
+import aiohttp
+import asyncpg
+import texts
+from broadcast import (affected_users, changed_messages, group_by_signature,
+                       grouping_stats)
+from db import STATEMENTS, block_users, migrate, update_message_hashes
+from dotenv import load_dotenv
+from history import load_latest, save_snapshot
+from logging_config import SAMPLED
+from matcher import OutageIndex
+from message_cache import MessageCache
+from metrics import (BROADCAST_GROUPS, CYCLE_INTERVAL, NOTIFICATIONS,
+                     SEND_SECONDS)
+from normalization import normalize_address
+from sender import TokenBucket, is_permanent
+from snapshot import (outages_fingerprint, read_snapshot_file,
+                      write_snapshot_file)
+from sources import SourceRegistry, load_sources
+from subscriptions import SubscriptionStore
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException, RequestTimeout
+
+load_dotenv()
+
+DB_HOST = os.getenv("DB_HOST")
+
+DB_NAME = os.getenv("POSTGRES_DB")
+DB_USER = os.getenv("POSTGRES_USER")
+DB_PASSWORD = os.getenv("POSTGRES_PASSWORD")
+
+TOKEN = os.getenv("TOKEN_PROD")
+RETRY_PERIOD = int(os.getenv("RETRY_PERIOD") or 60)
+SEND_CONCURRENCY = int(os.getenv("SEND_WORKERS") or 4)
+SEND_RATE = float(os.getenv("SEND_RATE") or 30)
+SEND_RETRIES = 3
+HASH_BATCH_SIZE = int(os.getenv("HASH_BATCH_SIZE") or 500)
+SUBSCRIPTIONS_RECONCILE_PERIOD = int(
+    os.getenv("SUBSCRIPTIONS_RECONCILE_PERIOD") or 600
+)
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX") or 10)
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH")
+SOURCE_WAIT = float(os.getenv("SOURCE_WAIT") or 10)
+
+
+def statement(name):
+    """Query of one of db.STATEMENTS, its $n parameters suit asyncpg."""
+    return STATEMENTS[name][1]
+
+
+class AsyncRuntime:
+    """
+    Runs the same commands and background job as bot.py on a single event
+    loop: AsyncTeleBot for updates, an asyncpg pool for the handlers'
+    queries and an aiohttp session for fetching the outages page. Schema,
+    snapshot and batch writes reuse the psycopg2 helpers of bot.py through
+    get_cursor in a worker thread. Updates of one chat are handled one at
+    a time, in arrival order.
+    """
+
+    def __init__(self, token, get_cursor):
+        self.bot = AsyncTeleBot(token)
+        self.get_cursor = get_cursor
+        self.db_pool = None
+        self.chat_locks = weakref.WeakValueDictionary()
+        self.subscriptions = SubscriptionStore()
+        self.outages = {}
+        self.index = OutageIndex(self.outages)
+        self.message_cache = MessageCache.from_env()
+        self.pending_users = set()
+        self.stored_outages = None
+        self.stored_fingerprint = None
+        self.bucket = TokenBucket(SEND_RATE)
+        self.send_semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+
+        self.bot.register_message_handler(
+            self.in_order(self.start), commands=["start", "info"]
+        )
+        self.bot.register_message_handler(
+            self.in_order(self.add), commands=["add"]
+        )
+        self.bot.register_message_handler(
+            self.in_order(self.delete), commands=["delete"]
+        )
+        self.bot.register_message_handler(
+            self.in_order(self.show), commands=["show"]
+        )
+        self.bot.register_message_handler(
+            self.in_order(self.my), commands=["my"]
+        )
+        self.bot.register_message_handler(
+            self.in_order(self.check), commands=["check"]
+        )
+        self.bot.register_message_handler(self.in_order(self.msg))
+        self.bot.register_my_chat_member_handler(
+            self.in_order(self.handle_user_status)
+        )
+
+    def chat_lock(self, chat_id):
+        lock = self.chat_locks.get(chat_id)
+        if lock is None:
+            lock = self.chat_locks[chat_id] = asyncio.Lock()
+        return lock
+
+    def in_order(self, handler):
+        """Run handler for one update of a chat at a time."""
+        async def ordered(update):
+            async with self.chat_lock(update.chat.id):
+                await handler(update)
+        return ordered
+
+    async def in_transaction(self, func, *args):
+        """Run a psycopg2 helper shared with bot.py in a worker thread."""
+        def run():
+            with self.get_cursor() as cur:
+                return func(cur, *args)
+        return await asyncio.to_thread(run)
+
+    async def start(self, message):
+        user_id = message.chat.id
+        try:
+            if message.text.startswith("/start"):
+                logging.info(
+                    f"Sending /start message to user {user_id}", extra=SAMPLED
+                )
+                result = await self.db_pool.execute(
+                    statement("add_user"),
+                    user_id, message.from_user.username
+                )
+                if result == "INSERT 0 1":
+                    logging.info(f"User {user_id} activated the bot")
+                self.subscriptions.add_user(user_id)
+
+            if message.text.startswith("/info"):
+                logging.info(
+                    f"Sending /info message to user {user_id}", extra=SAMPLED
+                )
+
+            await self.bot.send_message(user_id, texts.INFO_MESSAGE)
+        except Exception as error:
+            logging.error(f"Error: {error}")
+            await self.bot.send_message(user_id, texts.ERROR_MESSAGE)
+
+    async def add(self, message):
+        user_id = message.chat.id
+        logging.info(
+            f"Sending /add message to user {user_id}", extra=SAMPLED
+        )
+
+        if message.text == "/add":
+            await self.bot.send_message(user_id, texts.ADD_USAGE_MESSAGE)
+            return
+
+        address = message.text.replace("/add ", "")
+        normalized = normalize_address(address)
+        try:
+            added = False
+            async with self.db_pool.acquire() as conn:
+                async with conn.transaction():
+                    exists = await conn.fetchval(
+                        statement("address_exists"), user_id, normalized
+                    )
+                    if exists:
+                        bot_msg = texts.address_exists_message(address)
+                    else:
+                        await conn.execute(
+                            statement("add_address"),
+                            user_id, address, normalized
+                        )
+                        added = True
+                        bot_msg = texts.address_added_message(address)
+                        logging.info(
+                            f"User {user_id} added address {address}"
+                        )
+            if added:
+                self.subscriptions.add(user_id, address)
+                self.pending_users.add(user_id)
+            await self.bot.send_message(user_id, bot_msg)
+        except Exception as error:
+            logging.error(f"Error: {error}")
+            await self.bot.send_message(user_id, texts.ERROR_MESSAGE)
+
+    async def delete(self, message):
+        user_id = message.chat.id
+        logging.info(
+            f"Sending /delete message to user {user_id}", extra=SAMPLED
+        )
+
+        if message.text == "/delete":
+            await self.bot.send_message(user_id, texts.DELETE_USAGE_MESSAGE)
+            return
+
+        address = message.text.replace("/delete ", "")
+        try:
+            deleted = await self.db_pool.fetch(
+                statement("delete_address"),
+                user_id, normalize_address(address)
+            )
+            if deleted:
+                bot_msg = texts.address_deleted_message(address)
+                logging.info(f"User {user_id} deleted address {address}")
+                for row in deleted:
+                    self.subscriptions.remove(user_id, row["address"])
+                self.pending_users.add(user_id)
+            else:
+                bot_msg = texts.NOT_ADDED_MESSAGE
+            await self.bot.send_message(user_id, bot_msg)
+        except Exception as error:
+            logging.error(f"Error: {error}")
+            await self.bot.send_message(user_id, texts.ERROR_MESSAGE)
+
+    async def show(self, message):
+        user_id = message.chat.id
+        logging.info(
+            f"Sending /show message to user {user_id}", extra=SAMPLED
+        )
+
+        try:
+            addresses = self.subscriptions.get_addresses(user_id)
+            await self.bot.send_message(
+                user_id, texts.addresses_message(addresses)
+            )
+        except Exception as error:
+            logging.error(f"Error: {error}")
+            await self.bot.send_message(user_id, texts.ERROR_MESSAGE)
+
+    async def my(self, message):
+        user_id = message.chat.id
+        logging.info(
+            f"Sending /my message to user {user_id}", extra=SAMPLED
+        )
+
+        try:
+            addresses = self.subscriptions.get_addresses(user_id)
+
+            if not self.outages:
+                logging.warning("No data fetched or empty site")
+                await self.bot.send_message(user_id, texts.NO_DATA_MESSAGE)
+                return
+
+            rendered = self.message_cache.get(self.index, addresses)
+            new_message = rendered.message
+            new_message_hash = rendered.message_hash
+
+            if new_message_hash != self.subscriptions.get_hash(user_id):
+                await self.db_pool.execute(
+                    statement("set_message_hash"), new_message_hash, user_id
+                )
+                self.subscriptions.set_hash(user_id, new_message_hash)
+                logging.info(
+                    f"Updated last message for user {user_id}", extra=SAMPLED
+                )
+            await self.bot.send_message(user_id, new_message)
+        except Exception as error:
+            logging.error(f"Error: {error}")
+            await self.bot.send_message(user_id, texts.ERROR_MESSAGE)
+
+    async def check(self, message):
+        user_id = message.chat.id
+        logging.info(
+            f"Sending /check message to user {user_id}", extra=SAMPLED
+        )
+
+        if message.text == "/check":
+            await self.bot.send_message(user_id, texts.CHECK_USAGE_MESSAGE)
+            return
+
+        user_address = message.text.replace("/check ", "")
+        try:
+            if not self.outages:
+                logging.warning("No data fetched or empty site")
+                await self.bot.send_message(user_id, texts.NO_DATA_MESSAGE)
+                return
+
+            rendered = self.message_cache.get(self.index, [user_address])
+            await self.bot.send_message(user_id, rendered.message)
+        except Exception as error:
+            logging.error(f"Error: {error}")
+            await self.bot.send_message(user_id, texts.ERROR_MESSAGE)
+
+    async def msg(self, message):
+        user_id = message.chat.id
+        logging.info(
+            f"Sending general message to user {user_id}", extra=SAMPLED
+        )
+        try:
+            await self.bot.send_message(user_id, texts.HELP_MESSAGE)
+        except Exception as error:
+            logging.error(f"Error: {error}")
+
+    async def handle_user_status(self, update):
+        new_status = update.new_chat_member.status
+        user_id = update.chat.id
+        try:
+            if new_status == "kicked":
+                logging.warning(f"User {user_id} has blocked the bot")
+                await self.block_user(user_id)
+            elif (new_status == "member"
+                  and update.old_chat_member.status == "kicked"):
+                logging.info(
+                    f"User {user_id} has unblocked and restarted the bot"
+                )
+                await self.db_pool.execute(statement("unblock_user"), user_id)
+                self.subscriptions.set_blocked(user_id, False)
+                self.pending_users.add(user_id)
+        except Exception as error:
+            logging.error(f"Error: {error}")
+
+    async def load_subscriptions(self):
+        await self.in_transaction(self.subscriptions.load)
+
+    async def warm_outages(self):
+        """Serve the latest stored snapshot until the first fetch."""
+        latest = await self.in_transaction(load_latest)
+        if latest is None:
+            self.warm_from_file()
+            return
+        snapshot_id, self.stored_fingerprint, self.outages = latest
+        self.index = OutageIndex(self.outages)
+        self.stored_outages = self.outages
+        logging.info(f"Loaded outages snapshot {snapshot_id}")
+
+    def warm_from_file(self):
+        if not SNAPSHOT_PATH:
+            return
+        snapshot = read_snapshot_file(SNAPSHOT_PATH)
+        if snapshot is not None:
+            self.outages = snapshot[1]
+            self.index = OutageIndex(self.outages)
+            logging.info(f"Loaded outages snapshot from {SNAPSHOT_PATH}")
+
+    async def store_outages(self, outages, fingerprint):
+        """Record a snapshot version, writing only the changed rows."""
+        try:
+            await self.in_transaction(
+                save_snapshot, self.stored_outages, outages, fingerprint
+            )
+        except Exception as error:
+            logging.error(f"Error storing outages snapshot: {error}")
+            return
+        self.stored_outages = outages
+        self.stored_fingerprint = fingerprint
+
+    async def block_user(self, user_id):
+        await self.in_transaction(block_users, [user_id])
+        self.subscriptions.set_blocked(user_id, True)
+
+    async def deliver(self, user_id, text):
+        """
+        Send one broadcast message, return whether Telegram accepted it,
+        or None when the user blocked the bot or the chat is gone.
+        """
+        async with self.send_semaphore:
+            for attempt in range(SEND_RETRIES + 1):
+                wait = self.bucket.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    with SEND_SECONDS.time():
+                        await self.bot.send_message(user_id, text)
+                    NOTIFICATIONS.inc(result="sent")
+                    return True
+                except ApiTelegramException as error:
+                    if is_permanent(error):
+                        NOTIFICATIONS.inc(result="blocked")
+                        logging.warning(
+                            f"User {user_id} is unreachable: {error}"
+                        )
+                        await self.block_user(user_id)
+                        return None
+                    if (error.error_code != 429 and error.error_code < 500
+                            or attempt == SEND_RETRIES):
+                        NOTIFICATIONS.inc(result="failed")
+                        logging.error(
+                            f"Error sending message to user {user_id}: "
+                            f"{error}"
+                        )
+                        return False
+                    if error.error_code == 429:
+                        self.bucket.pause(error.result_json.get(
+                            "parameters", {}
+                        ).get("retry_after", 1))
+                    else:
+                        self.bucket.pause(2 ** attempt)
+                except (aiohttp.ClientError, asyncio.TimeoutError,
+                        RequestTimeout) as error:
+                    if attempt == SEND_RETRIES:
+                        NOTIFICATIONS.inc(result="failed")
+                        logging.error(
+                            f"Error sending message to user {user_id}: "
+                            f"{error}"
+                        )
+                        return False
+                    self.bucket.pause(2 ** attempt)
+                except Exception as error:
+                    NOTIFICATIONS.inc(result="failed")
+                    logging.error(
+                        f"Error sending message to user {user_id}: {error}"
+                    )
+                    return False
+        return False
+
+    async def broadcast(self, changed):
+        """
+        Send [(user_id, message, message_hash), ...] concurrently and store
+        the hashes of the delivered ones; users whose message failed are
+        checked again next cycle. Returns [(user_id, message_hash), ...]
+        of the delivered messages.
+        """
+        results = await asyncio.gather(*(
+            self.deliver(user_id, text) for user_id, text, _ in changed
+        ), return_exceptions=True)
+
+        delivered = []
+        for (user_id, _, message_hash), ok in zip(changed, results):
+            if isinstance(ok, Exception):
+                logging.error(f"Error delivering to user {user_id}: {ok}")
+                self.pending_users.add(user_id)
+            elif ok:
+                delivered.append((user_id, message_hash))
+            elif ok is False:
+                self.pending_users.add(user_id)
+        await self.save_hashes(delivered)
+        return delivered
+
+    async def save_hashes(self, rows):
+        if not rows:
+            return
+        await self.in_transaction(
+            update_message_hashes, rows, HASH_BATCH_SIZE
+        )
+        for user_id, message_hash in rows:
+            self.subscriptions.set_hash(user_id, message_hash)
+        logging.info(f"Updated last message for {len(rows)} users")
+
+    async def background_job(self):
+        logging.info("Starting background job")
+        sources = SourceRegistry(load_sources())
+        last_outages = None
+        last_fingerprint = None
+        last_reconcile = time.monotonic()
+
+        async with aiohttp.ClientSession() as session:
+            cycle_started = None
+            while True:
+                pending = set()
+                if cycle_started is not None:
+                    CYCLE_INTERVAL.observe(time.monotonic() - cycle_started)
+                cycle_started = time.monotonic()
+                try:
+                    if (time.monotonic() - last_reconcile
+                            >= SUBSCRIPTIONS_RECONCILE_PERIOD):
+                        await self.load_subscriptions()
+                        last_reconcile = time.monotonic()
+
+                    logging.info("Fetching data from website")
+                    outages = await sources.poll_async(
+                        session, timeout=SOURCE_WAIT
+                    )
+                    logging.info(f"Fetch stats: {sources.stats()}")
+
+                    if not outages:
+                        logging.warning("No data fetched or empty site")
+                        continue
+
+                    fingerprint = outages_fingerprint(outages)
+                    pending, self.pending_users = self.pending_users, set()
+
+                    if fingerprint == last_fingerprint and not pending:
+                        logging.info(
+                            "Outages page unchanged, skipping users check"
+                        )
+                        continue
+
+                    if fingerprint != last_fingerprint:
+                        self.outages = outages
+                        self.index = OutageIndex(outages, version=fingerprint)
+                        logging.info("Outages dict updated successfully")
+                        if SNAPSHOT_PATH:
+                            try:
+                                await asyncio.to_thread(
+                                    write_snapshot_file,
+                                    SNAPSHOT_PATH, outages, fingerprint
+                                )
+                            except OSError as error:
+                                logging.error(
+                                    f"Error writing outages snapshot: {error}"
+                                )
+
+                    if fingerprint != self.stored_fingerprint:
+                        await self.store_outages(outages, fingerprint)
+
+                    user_data = self.subscriptions.active()
+                    affected = (
+                        affected_users(user_data, last_outages, outages)
+                        if fingerprint != last_fingerprint else set()
+                    )
+                    user_data = {
+                        user_id: data for user_id, data in user_data.items()
+                        if user_id in affected or user_id in pending
+                    }
+                    groups = group_by_signature(user_data)
+                    changed = await asyncio.to_thread(
+                        lambda: list(changed_messages(
+                            self.index, user_data, self.message_cache, groups
+                        ))
+                    )
+                    grouping = grouping_stats(groups)
+                    BROADCAST_GROUPS.set(grouping["groups"])
+                    NOTIFICATIONS.inc(
+                        len(user_data) - len(changed), result="skipped"
+                    )
+                    delivered = await self.broadcast(changed)
+                    logging.info(
+                        f"Cycle summary: checked {len(user_data)} users, "
+                        f"{len(changed)} messages changed, "
+                        f"{len(delivered)} sent, "
+                        f"{len(changed) - len(delivered)} failed; "
+                        f"groups {grouping}"
+                    )
+
+                    last_outages = outages
+                    last_fingerprint = fingerprint
+
+                except Exception as error:
+                    self.pending_users |= pending
+                    logging.error(f"Background job error: {error}")
+
+                finally:
+                    await asyncio.sleep(
+                        min(RETRY_PERIOD, sources.seconds_until_due())
+                    )
+
+    async def run(self):
+        self.db_pool = await asyncpg.create_pool(
+            min_size=1,
+            max_size=DB_POOL_MAX,
+            database=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST
+        )
+        logging.info("Connection pool created succesfully")
+        await self.in_transaction(migrate)
+        await self.load_subscriptions()
+        await self.warm_outages()
+
+        job = asyncio.create_task(self.background_job())
+        try:
+            logging.info("Starting bot polling")
+            await self.bot.infinity_polling()
+        finally:
+            job.cancel()
+            await self.db_pool.close()
+            await self.bot.close_session()
+
+
+def run(get_cursor):
+    asyncio.run(AsyncRuntime(TOKEN, get_cursor).run())
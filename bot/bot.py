@@ -1,17 +1,44 @@
+import atexit
 import logging
 import os
 import sys
 import threading
 import time
 from contextlib import contextmanager
-from parser import Parser
+from functools import partial
 
 import logging_config
+import psycopg2
+import server_matching
+import texts
+from broadcast import (affected_users, changed_messages, group_by_signature,
+                       grouping_stats, rendered_messages)
+from db import (HashBatchWriter, LazyPool, block_users, execute_prepared,
+                migrate)
 from dotenv import load_dotenv
-from exceptions import MissingEnvironmentVariableException
-from psycopg2 import pool
+from exceptions import (MissingEnvironmentVariableException,
+                        UnsupportedConfigurationException)
+from history import load_latest, save_snapshot
+from logging_config import SAMPLED
+from matcher import OutageIndex
+from message_cache import MessageCache
+from metrics import (BROADCAST_GROUPS, CYCLE_INTERVAL, DB_POOL_IN_USE,
+                     DB_POOL_OPEN, DB_POOL_SIZE, DB_SECONDS,
+                     HANDLER_QUEUE_DEPTH, NOTIFICATIONS, OUTAGE_DATES,
+                     OUTAGE_LINES, READY, SEND_QUEUE_DEPTH, STARTUP_SECONDS,
+                     SUBSCRIBERS, MetricsServer, profiler)
+from normalization import normalize_address
+from outbox import OutboxSender, enqueue_messages
+from sender import SendQueue, is_permanent
+from sharding import ShardWorker, enqueue_broadcast
+from snapshot import (outages_fingerprint, read_snapshot_file,
+                      write_snapshot_file)
+from sources import SourceRegistry, load_sources
+from subscriptions import SubscriptionStore
 from telebot import TeleBot
-from utils import check_env_vars, generate_last_message_hash
+from utils import check_env_vars
+from webhook import WebhookServer
+from workers import KeyedDispatcher
 
 load_dotenv()
 
@@ -22,407 +49,682 @@ DB_USER = os.getenv("POSTGRES_USER")
 DB_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 
 TOKEN = os.getenv("TOKEN_PROD")
-RETRY_PERIOD = int(os.getenv("RETRY_PERIOD"))
-
-logger = logging_config.setup_logging()
-
-bot = TeleBot(token=TOKEN)
+RETRY_PERIOD = int(os.getenv("RETRY_PERIOD") or 60)
+SEND_WORKERS = int(os.getenv("SEND_WORKERS") or 4)
+SEND_RATE = float(os.getenv("SEND_RATE") or 30)
+HASH_BATCH_SIZE = int(os.getenv("HASH_BATCH_SIZE") or 500)
+SUBSCRIPTIONS_RECONCILE_PERIOD = int(
+    os.getenv("SUBSCRIPTIONS_RECONCILE_PERIOD") or 600
+)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN") or 1)
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX") or 10)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT") or 30)
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER") or 30)
+HANDLER_WORKERS = int(
+    os.getenv("HANDLER_WORKERS") or max(1, DB_POOL_MAX - 2)
+)
+HANDLER_QUEUE_SIZE = int(os.getenv("HANDLER_QUEUE_SIZE") or 1000)
+RUNTIME = os.getenv("RUNTIME") or "threaded"
+METRICS_HOST = os.getenv("METRICS_HOST") or "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
+INGESTION_MODE = os.getenv("INGESTION_MODE") or "polling"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST") or "0.0.0.0"
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or 8443)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or "/"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH")
+SOURCE_WAIT = float(os.getenv("SOURCE_WAIT") or 10)
+ROLE = os.getenv("ROLE") or "all"
+SHARDS = int(os.getenv("SHARDS") or 4)
+MATCHING = os.getenv("MATCHING") or "python"
+DELIVERY = os.getenv("DELIVERY") or "queue"
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE") or 100)
+
+
+class DispatchingTeleBot(TeleBot):
+    """TeleBot running handlers on a KeyedDispatcher, in order per chat."""
+
+    def __init__(self, token, dispatcher):
+        super().__init__(token=token, threaded=False)
+        self.dispatcher = dispatcher
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            self.submit_update(update)
+
+    def submit_update(self, update, block=True):
+        """Queue an update, raising queue.Full when full and not block."""
+        self.dispatcher.submit(
+            update_chat_id(update),
+            super().process_new_updates,
+            [update],
+            block=block
+        )
+
+
+def update_chat_id(update):
+    for kind in ("message", "edited_message", "my_chat_member"):
+        event = getattr(update, kind, None)
+        if event is not None:
+            return event.chat.id
+    return update.update_id
+
+
+dispatcher = KeyedDispatcher(
+    workers=HANDLER_WORKERS, max_depth=HANDLER_QUEUE_SIZE
+)
+HANDLER_QUEUE_DEPTH.set_function(lambda: dispatcher.stats()["queue_depth"])
+DB_POOL_SIZE.set(DB_POOL_MAX)
+bot = None
 
 cached_outages = {}
+cached_index = OutageIndex(cached_outages)
+message_cache = MessageCache.from_env()
 outages_lock = threading.Lock()
 
-try:
-    db_pool = pool.ThreadedConnectionPool(
-        minconn=1,
-        maxconn=10,
-        database=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST
-    )
-    if db_pool:
-        logging.info("Connection pool created succesfully")
-except Exception as error:
-    logging.critical(f"Error creating a connection pool: {error}")
-    sys.exit(1)
+subscriptions = SubscriptionStore()
+
+pending_users = set()
+pending_users_lock = threading.Lock()
+
+ready = threading.Event()
+READY.set_function(ready.is_set)
+
+db_pool = LazyPool(
+    minconn=DB_POOL_MIN,
+    maxconn=DB_POOL_MAX,
+    timeout=DB_POOL_TIMEOUT,
+    check_after=DB_POOL_CHECK_AFTER,
+    database=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    host=DB_HOST
+)
+DB_POOL_IN_USE.set_function(lambda: db_pool.in_use)
+DB_POOL_OPEN.set_function(lambda: db_pool.size)
 
 
 @contextmanager
 def get_db_cursor():
     conn = db_pool.getconn()
     try:
-        yield conn.cursor()
-        conn.commit()
+        with DB_SECONDS.time():
+            yield conn.cursor()
+            conn.commit()
     except Exception as error:
         logging.error(f"Database error: {error}")
-        conn.rollback()
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
         raise error
     finally:
         db_pool.putconn(conn)
 
 
-@bot.message_handler(commands=["start", "info"])
 def start(message):
     user_id = message.chat.id
-    bot_msg = ("После добавления адреса бот будет работать в фоновом режиме "
-               "и отправит вам сообщение, если по вашему адресу будет "
-               "запланировано отключение.\n\n"
-
-               "Рекомендации:\n"
-               "- при добавлении или проверке адреса указывайте его "
-               "без дополнительных слов и номера дома. "
-               "Например: /add Тиграняна\n"
-               "- при добавлении села или другого "
-               "небольшого населенного пункта указывайте "
-               "только название этого населенного пункта. "
-               "Например: /add Шенаван\n\n"
-
-               "Доступные команды:\n"
-               "/add - добавить адрес. В формате: /add Тиграняна\n"
-               "/delete - удалить адрес.  В формате: /delete Тиграняна\n"
-               "/check - проверить адрес. В формате: /check Тиграняна\n"
-               "/show - показать ваши добавленные адреса\n"
-               "/my - проверить отключения по вашим адресам\n"
-               "/info - информация об этом боте"
-               )
 
     try:
         if message.text.startswith("/start"):
             username = message.from_user.username
-            logging.info(f"Sending /start message to user {user_id}")
+            logging.info(
+                f"Sending /start message to user {user_id}", extra=SAMPLED
+            )
             with get_db_cursor() as cur:
-                cur.execute(
-                    """INSERT INTO light_bot.users (user_id, username)
-                    VALUES (%s, %s)
-                    ON CONFLICT ON CONSTRAINT user_id_unique DO NOTHING;""",
-                    (user_id, username)
-                )
+                execute_prepared(cur, "add_user", (user_id, username))
                 if cur.rowcount == 1:
                     logging.info(f"User {user_id} activated the bot")
+            subscriptions.add_user(user_id)
 
         if message.text.startswith("/info"):
-            logging.info(f"Sending /info message to user {user_id}")
+            logging.info(
+                f"Sending /info message to user {user_id}", extra=SAMPLED
+            )
 
-        bot.send_message(user_id, bot_msg)
+        bot.send_message(user_id, texts.INFO_MESSAGE)
     except Exception as error:
         logging.error(f"Error: {error}")
-        bot.send_message(user_id, "Ошибка. Попробуйте снова")
+        bot.send_message(user_id, texts.ERROR_MESSAGE)
 
 
-@bot.message_handler(commands=["add"])
 def add(message):
     user_id = message.chat.id
-    logging.info(f"Sending /add message to user {user_id}")
+    logging.info(
+        f"Sending /add message to user {user_id}", extra=SAMPLED
+    )
 
     if message.text == "/add":
-        bot.send_message(user_id, "Укажите адрес, например: /add Бабаяна")
+        bot.send_message(user_id, texts.ADD_USAGE_MESSAGE)
         return
 
     address = message.text.replace("/add ", "")
+    normalized = normalize_address(address)
     try:
+        added = False
         with get_db_cursor() as cur:
-            cur.execute(
-                """SELECT EXISTS
-                (SELECT 1 FROM light_bot.addresses
-                WHERE user_id = %s AND address = %s);""",
-                (user_id, address)
-            )
+            execute_prepared(cur, "address_exists", (user_id, normalized))
             if cur.fetchone()[0]:
-                bot_msg = f"Адрес {address} уже добавлен"
+                bot_msg = texts.address_exists_message(address)
             else:
-                cur.execute(
-                    """INSERT INTO light_bot.addresses (user_id, address)
-                    VALUES (%s, %s);""",
-                    (user_id, address)
+                execute_prepared(
+                    cur, "add_address", (user_id, address, normalized)
                 )
-                bot_msg = f"Добавлен адрес: {address}"
+                added = True
+                bot_msg = texts.address_added_message(address)
                 logging.info(f"User {user_id} added address {address}")
+        if added:
+            subscriptions.add(user_id, address)
+            mark_user_pending(user_id)
         bot.send_message(user_id, bot_msg)
     except Exception as error:
         logging.error(f"Error: {error}")
-        bot.send_message(user_id, "Ошибка. Попробуйте снова")
+        bot.send_message(user_id, texts.ERROR_MESSAGE)
 
 
-@bot.message_handler(commands=["delete"])
 def delete(message):
     user_id = message.chat.id
-    logging.info(f"Sending /delete message to user {user_id}")
+    logging.info(
+        f"Sending /delete message to user {user_id}", extra=SAMPLED
+    )
 
     if message.text == "/delete":
-        bot.send_message(user_id, "Укажите адрес, например: /delete Бабаяна")
+        bot.send_message(user_id, texts.DELETE_USAGE_MESSAGE)
         return
 
     address = message.text.replace("/delete ", "")
     try:
         with get_db_cursor() as cur:
-            cur.execute(
-                """DELETE FROM light_bot.addresses
-                WHERE user_id = %s and address = %s
-                RETURNING id;""",
-                (user_id, address)
+            execute_prepared(
+                cur, "delete_address", (user_id, normalize_address(address))
             )
-            if cur.fetchall():
-                bot_msg = f"Удален адрес: {address}"
-                logging.info(f"User {user_id} deleted address {address}")
-            else:
-                bot_msg = "Этот адрес не был вами добавлен"
+            deleted = [row[0] for row in cur.fetchall()]
+        if deleted:
+            bot_msg = texts.address_deleted_message(address)
+            logging.info(f"User {user_id} deleted address {address}")
+            for stored in deleted:
+                subscriptions.remove(user_id, stored)
+            mark_user_pending(user_id)
+        else:
+            bot_msg = texts.NOT_ADDED_MESSAGE
         bot.send_message(user_id, bot_msg)
     except Exception as error:
         logging.error(f"Error: {error}")
-        bot.send_message(user_id, "Ошибка. Попробуйте снова")
+        bot.send_message(user_id, texts.ERROR_MESSAGE)
 
 
-@bot.message_handler(commands=["show"])
 def show(message):
     user_id = message.chat.id
-    logging.info(f"Sending /show message to user {user_id}")
+    logging.info(
+        f"Sending /show message to user {user_id}", extra=SAMPLED
+    )
 
     try:
-        with get_db_cursor() as cur:
-            cur.execute(
-                """SELECT address FROM light_bot.addresses
-                WHERE user_id = %s;""",
-                (user_id,)
-            )
-            addresses = [address[0] for address in cur.fetchall()]
-            if addresses:
-                bot_msg = "Добавленные адреса:\n\n" + "\n".join(addresses)
-            else:
-                bot_msg = "Вы не добавили ни один адрес"
-        bot.send_message(user_id, bot_msg)
+        addresses = subscriptions.get_addresses(user_id)
+        bot.send_message(user_id, texts.addresses_message(addresses))
     except Exception as error:
         logging.error(f"Error: {error}")
-        bot.send_message(user_id, "Ошибка. Попробуйте снова")
+        bot.send_message(user_id, texts.ERROR_MESSAGE)
 
 
-@bot.message_handler(commands=["my"])
 def my(message):
     user_id = message.chat.id
-    logging.info(f"Sending /my message to user {user_id}")
+    logging.info(
+        f"Sending /my message to user {user_id}", extra=SAMPLED
+    )
 
     try:
-        with get_db_cursor() as cur:
-            cur.execute(
-                """SELECT address FROM light_bot.addresses
-                WHERE user_id = %s;""",
-                (user_id,)
-            )
-            addresses = [address[0] for address in cur.fetchall()]
+        addresses = subscriptions.get_addresses(user_id)
 
-            with outages_lock:
-                outages = cached_outages.copy()
+        with outages_lock:
+            outages = cached_outages
+            index = cached_index
 
-            if not outages:
-                logging.warning("No data fetched or empty site")
-                bot.send_message(
-                    user_id,
-                    "Данные об отключениях недоступны, попробуйте позже"
-                )
-                return
-
-            messages_for_user = []
-
-            for date, addresses_list in outages.items():
-                for addr in addresses_list:
-                    for user_addr in addresses:
-                        if user_addr.lower() in addr.lower():
-                            msg = f"{date}\n\n{addr}"
-                            if msg not in messages_for_user:
-                                messages_for_user.append(msg)
-
-            if not messages_for_user:
-                new_message = (
-                    "Нет информации об отключениях электроэнергии "
-                    "по вашим адресам в ближайшие дни"
-                )
+        if not outages:
+            logging.warning("No data fetched or empty site")
+            bot.send_message(user_id, texts.NO_DATA_MESSAGE)
+            return
 
-            else:
-                new_message = "\n\n".join(messages_for_user)
+        rendered = message_cache.get(index, addresses)
+        new_message = rendered.message
+        new_message_hash = rendered.message_hash
 
-            new_message_hash = generate_last_message_hash(new_message)
-            cur.execute(
-                """SELECT last_message_hash FROM light_bot.users
-                WHERE user_id = %s;""",
-                (user_id,)
-            )
-            last_msg_hash = cur.fetchone()[0]
-
-            if new_message_hash != last_msg_hash:
-                cur.execute(
-                    """UPDATE light_bot.users
-                    SET last_message_hash = %s
-                    WHERE user_id = %s;""",
-                    (new_message_hash, user_id)
+        if new_message_hash != subscriptions.get_hash(user_id):
+            with get_db_cursor() as cur:
+                execute_prepared(
+                    cur, "set_message_hash", (new_message_hash, user_id)
                 )
-                logging.info(f"Updated last message for user {user_id}")
+            subscriptions.set_hash(user_id, new_message_hash)
+            logging.info(
+                f"Updated last message for user {user_id}", extra=SAMPLED
+            )
         bot.send_message(user_id, new_message)
     except Exception as error:
         logging.error(f"Error: {error}")
-        bot.send_message(user_id, "Ошибка. Попробуйте снова")
+        bot.send_message(user_id, texts.ERROR_MESSAGE)
 
 
-@bot.message_handler(commands=["check"])
 def check(message):
     user_id = message.chat.id
-    logging.info(f"Sending /check message to user {user_id}")
+    logging.info(
+        f"Sending /check message to user {user_id}", extra=SAMPLED
+    )
 
     if message.text == "/check":
-        bot.send_message(user_id, "Добавьте адрес вместе с командой")
+        bot.send_message(user_id, texts.CHECK_USAGE_MESSAGE)
         return
 
     user_address = message.text.replace("/check ", "")
     try:
         with outages_lock:
-            outages = cached_outages.copy()
+            outages = cached_outages
+            index = cached_index
 
         if not outages:
             logging.warning("No data fetched or empty site")
-            bot.send_message(
-                user_id,
-                "Данные об отключениях недоступны, попробуйте позже"
-            )
+            bot.send_message(user_id, texts.NO_DATA_MESSAGE)
             return
 
-        messages_for_user = []
-
-        for date, addresses_list in outages.items():
-            for addr in addresses_list:
-                if user_address.lower() in addr.lower():
-                    msg = f"{date}\n\n{addr}"
-                    if msg not in messages_for_user:
-                        messages_for_user.append(msg)
-
-            if not messages_for_user:
-                message = (
-                    "Нет информации об отключениях электроэнергии "
-                    "по вашим адресам в ближайшие дни"
-                )
-
-            else:
-                message = "\n\n".join(messages_for_user)
-
-        bot.send_message(user_id, message)
+        bot.send_message(
+            user_id, message_cache.get(index, [user_address]).message
+        )
     except Exception as error:
         logging.error(f"Error: {error}")
-        bot.send_message(user_id, "Ошибка. Попробуйте снова")
+        bot.send_message(user_id, texts.ERROR_MESSAGE)
 
 
-@bot.message_handler()
 def msg(message):
     user_id = message.chat.id
-    logging.info(f"Sending general message to user {user_id}")
+    logging.info(
+        f"Sending general message to user {user_id}", extra=SAMPLED
+    )
     try:
-        bot.send_message(user_id, "Список доступных команд: /info")
+        bot.send_message(user_id, texts.HELP_MESSAGE)
     except Exception as error:
         logging.error(f"Error: {error}")
 
 
-def main():
+def mark_user_pending(user_id):
+    """Re-evaluate the user on the next cycle even if the page is unchanged."""
+    with pending_users_lock:
+        pending_users.add(user_id)
+
+
+def block_user(user_id):
+    with get_db_cursor() as cur:
+        block_users(cur, [user_id])
+    subscriptions.set_blocked(user_id, True)
+
+
+def send_failed(user_id, error):
+    """Retry the user next cycle, unless Telegram will never accept it."""
+    if is_permanent(error):
+        block_user(user_id)
+    else:
+        mark_user_pending(user_id)
+
+
+def take_pending_users():
+    global pending_users
+    with pending_users_lock:
+        users, pending_users = pending_users, set()
+    return users
+
+
+def set_cached_outages(outages, index=None):
+    global cached_outages, cached_index
+    index = index or OutageIndex(outages)
+    with outages_lock:
+        cached_outages = outages
+        cached_index = index
+    OUTAGE_DATES.set(len(outages))
+    OUTAGE_LINES.set(len(index.entries))
+    ready.set()
+    return index
+
+
+def warm_outages():
+    """
+    Serve the latest stored snapshot until the first fetch finishes,
+    falling back to the SNAPSHOT_PATH file when the database has none.
+    Returns the database snapshot (snapshot_id, fingerprint, outages)
+    or None.
+    """
+    try:
+        with get_db_cursor() as cur:
+            latest = load_latest(cur)
+    except Exception as error:
+        logging.error(f"Error loading outages snapshot: {error}")
+        latest = None
+
+    if latest is not None:
+        snapshot_id, _, outages = latest
+        set_cached_outages(outages)
+        logging.info(f"Loaded outages snapshot {snapshot_id}")
+    elif SNAPSHOT_PATH:
+        snapshot = read_snapshot_file(SNAPSHOT_PATH)
+        if snapshot is not None:
+            set_cached_outages(snapshot[1])
+            logging.info(f"Loaded outages snapshot from {SNAPSHOT_PATH}")
+    return latest
+
+
+def create_bot():
+    telebot = DispatchingTeleBot(TOKEN, dispatcher)
+    telebot.register_message_handler(start, commands=["start", "info"])
+    telebot.register_message_handler(add, commands=["add"])
+    telebot.register_message_handler(delete, commands=["delete"])
+    telebot.register_message_handler(show, commands=["show"])
+    telebot.register_message_handler(my, commands=["my"])
+    telebot.register_message_handler(check, commands=["check"])
+    telebot.register_message_handler(msg)
+    telebot.register_my_chat_member_handler(handle_user_status)
+    return telebot
+
+
+def configure():
+    logging_config.setup_logging()
+    if not check_env_vars():
+        raise MissingEnvironmentVariableException(
+            "Missing required environment variable")
+
+
+def async_unsupported():
+    """Settings RUNTIME=async does not implement, set to other values."""
+    unsupported = {
+        "ROLE": ROLE != "all",
+        "DELIVERY": DELIVERY != "queue",
+        "MATCHING": MATCHING != "python",
+        "INGESTION_MODE": INGESTION_MODE != "polling",
+        "METRICS_PORT": bool(METRICS_PORT),
+    }
+    return [name for name, is_set in unsupported.items() if is_set]
+
+
+def create_app():
+    """
+    Prepare the threaded runtime: logging, schema, subscriptions, the
+    warmed outages cache and the handler workers. Nothing touches the
+    database or the network before this is called.
+    Returns the stored snapshot the background job starts from.
+    """
+    global bot
+    started = time.perf_counter()
+    configure()
+    bot = create_bot()
+    with get_db_cursor() as cur:
+        migrate(cur)
+        if MATCHING == "server":
+            server_matching.migrate(cur)
+        subscriptions.load(cur)
+    latest = warm_outages()
+
+    dispatcher.start()
+    profiler.install_signal_handler()
+    if METRICS_PORT:
+        MetricsServer(METRICS_HOST, METRICS_PORT, ready=ready).start()
+        logging.info(f"Serving metrics on {METRICS_HOST}:{METRICS_PORT}")
+
+    elapsed = time.perf_counter() - started
+    STARTUP_SECONDS.set(elapsed)
+    logging.info(
+        f"Startup took {elapsed:.3f}s, "
+        f"{'ready' if ready.is_set() else 'waiting for the first fetch'}"
+    )
+    return latest
+
+
+def store_outages(stored_outages, outages, fingerprint):
+    """Persist a changed parse, return the snapshot id or None."""
+    try:
+        with profiler.stage("db"), get_db_cursor() as cur:
+            return save_snapshot(cur, stored_outages, outages, fingerprint)
+    except Exception as error:
+        logging.error(f"Error storing outages snapshot: {error}")
+        return None
+
+
+def publish_snapshot(snapshot_id, previous_snapshot_id):
+    """Hand a stored snapshot over to the shard workers."""
+    with profiler.stage("db"), get_db_cursor() as cur:
+        enqueue_broadcast(cur, snapshot_id, previous_snapshot_id, SHARDS)
+
+
+def match_in_database(index, user_data, everyone):
+    """MATCHING=server: changed messages of user_data computed by Postgres."""
+    if not user_data:
+        return []
+    with get_db_cursor() as cur:
+        return server_matching.changed_messages_in_db(
+            cur, index, None if everyone else user_data
+        )
+
+
+def create_outbox_sender(send):
+    return OutboxSender(
+        get_db_cursor,
+        send,
+        on_delivered=subscriptions.set_hash,
+        on_blocked=partial(subscriptions.set_blocked, blocked=True),
+        on_exhausted=mark_user_pending,
+        send_workers=SEND_WORKERS,
+        rate=SEND_RATE,
+        batch_size=OUTBOX_BATCH_SIZE
+    )
+
+
+def run_sender():
+    """ROLE=sender: only drain the outbox, next to a DELIVERY=outbox bot."""
+    configure()
+    with get_db_cursor() as cur:
+        migrate(cur)
+    if METRICS_PORT:
+        MetricsServer(METRICS_HOST, METRICS_PORT).start()
+    create_outbox_sender(TeleBot(TOKEN, threaded=False).send_message).run()
+
+
+def run_worker():
+    """ROLE=worker: notify users of the shards claimed from the job table."""
+    configure()
+    with get_db_cursor() as cur:
+        migrate(cur)
+    if METRICS_PORT:
+        MetricsServer(METRICS_HOST, METRICS_PORT).start()
+    ShardWorker(
+        get_db_cursor,
+        TeleBot(TOKEN, threaded=False).send_message,
+        send_workers=SEND_WORKERS,
+        rate=SEND_RATE,
+        batch_size=HASH_BATCH_SIZE
+    ).run()
+
+
+def main(latest=None):
     logging.info("Starting background job")
-    parser = Parser()
-    global cached_outages
+    sources = SourceRegistry(load_sources())
+    send_queue = SendQueue(
+        bot.send_message, workers=SEND_WORKERS, rate=SEND_RATE
+    )
+    send_queue.start()
+    SEND_QUEUE_DEPTH.set_function(send_queue.queue.qsize)
+    hash_writer = HashBatchWriter(get_db_cursor, batch_size=HASH_BATCH_SIZE)
+    if DELIVERY == "outbox":
+        create_outbox_sender(bot.send_message).start()
+    last_reconcile = time.monotonic()
+    last_outages = None
+    last_fingerprint = None
+    stored_id, stored_fingerprint, stored_outages = (
+        latest or (None, None, None)
+    )
+    published_id = None
 
+    def delivered(user_id, message_hash):
+        subscriptions.set_hash(user_id, message_hash)
+        hash_writer.add(user_id, message_hash)
+
+    cycle_started = None
     while True:
+        pending = set()
+        if cycle_started is not None:
+            CYCLE_INTERVAL.observe(time.monotonic() - cycle_started)
+        cycle_started = time.monotonic()
+        profiler.begin()
         try:
+            if (time.monotonic() - last_reconcile
+                    >= SUBSCRIPTIONS_RECONCILE_PERIOD):
+                with profiler.stage("db"), get_db_cursor() as cur:
+                    subscriptions.load(cur)
+                last_reconcile = time.monotonic()
+
             logging.info("Fetching data from website")
-            outages = parser.parse_website()
+            with profiler.stage("fetch"):
+                outages = sources.poll(timeout=SOURCE_WAIT)
+            logging.info(f"Fetch stats: {sources.stats()}")
 
             if not outages:
                 logging.warning("No data fetched or empty site")
-                time.sleep(RETRY_PERIOD)
                 continue
 
-            with outages_lock:
-                cached_outages = outages
-            logging.info("Outages dict updated successfully")
-
-            with get_db_cursor() as cur:
-                cur.execute(
-                    """SELECT u.user_id, u.last_message_hash, a.address
-                    FROM light_bot.users u
-                    JOIN light_bot.addresses a ON u.user_id = a.user_id
-                    WHERE u.blocked_at IS NULL"""
-                )
-                users = cur.fetchall()
-
-            user_data = {}
-
-            for row in users:
-                uid, last_msg_hash, address = row
-                if uid not in user_data:
-                    user_data[uid] = {
-                        "last_msg_hash": last_msg_hash,
-                        "addresses": []
-                    }
-                user_data[uid]["addresses"].append(address)
-
-            for user_id, data in user_data.items():
-                try:
-                    logging.info(f"Checking user {user_id} addresses")
-                    user_addresses = data["addresses"]
-                    last_message_hash = data["last_msg_hash"]
-
-                    messages_for_user = []
-
-                    for date, addresses_list in outages.items():
-                        for addr in addresses_list:
-                            for user_addr in user_addresses:
-                                if user_addr.lower() in addr.lower():
-                                    msg = f"{date}\n\n{addr}"
-                                    if msg not in messages_for_user:
-                                        messages_for_user.append(msg)
-
-                    if not messages_for_user:
-                        new_message = (
-                            "Нет информации об отключениях электроэнергии "
-                            "по вашим адресам в ближайшие дни"
-                        )
+            fingerprint = outages_fingerprint(outages)
+            pending = take_pending_users()
 
-                    else:
-                        new_message = "\n\n".join(messages_for_user)
-
-                    new_message_hash = generate_last_message_hash(new_message)
+            if fingerprint == last_fingerprint and not pending:
+                logging.info("Outages page unchanged, skipping users check")
+                continue
 
-                    if new_message_hash != last_message_hash:
-                        logging.info(
-                            f"Starting sending main message to user {user_id}"
+            if fingerprint == last_fingerprint:
+                index = cached_index
+            else:
+                with profiler.stage("index"):
+                    index = OutageIndex(outages, version=fingerprint)
+                set_cached_outages(outages, index)
+                logging.info("Outages dict updated successfully")
+                if SNAPSHOT_PATH:
+                    try:
+                        write_snapshot_file(
+                            SNAPSHOT_PATH, outages, fingerprint
                         )
-                        with get_db_cursor() as cur:
-                            cur.execute(
-                                """UPDATE light_bot.users
-                                SET last_message_hash = %s
-                                WHERE user_id = %s;""",
-                                (new_message_hash, user_id)
-                            )
-                        logging.info(
-                            f"Updated last message for user {user_id}"
+                    except OSError as error:
+                        logging.error(
+                            f"Error writing outages snapshot: {error}"
                         )
-                        bot.send_message(user_id, new_message)
-                except Exception as error:
-                    logging.error(
-                        f"Error sending message to user {user_id}: {error}"
+
+            if fingerprint != stored_fingerprint:
+                snapshot_id = store_outages(
+                    stored_outages, outages, fingerprint
+                )
+                if snapshot_id is not None:
+                    stored_id = snapshot_id
+                    stored_outages = outages
+                    stored_fingerprint = fingerprint
+
+            sharded = ROLE == "leader" and fingerprint != last_fingerprint
+            if sharded:
+                if fingerprint != stored_fingerprint:
+                    raise RuntimeError(
+                        "Snapshot not stored, broadcast postponed"
+                    )
+                publish_snapshot(stored_id, published_id)
+                published_id = stored_id
+
+            with profiler.stage("match"):
+                user_data = subscriptions.active()
+                subscribers = len(user_data)
+                SUBSCRIBERS.set(subscribers)
+                affected = (
+                    affected_users(user_data, last_outages, outages)
+                    if fingerprint != last_fingerprint and not sharded
+                    else set()
+                )
+                user_data = {
+                    user_id: data for user_id, data in user_data.items()
+                    if user_id in affected or user_id in pending
+                }
+                if MATCHING == "server":
+                    changed = match_in_database(
+                        index, user_data, len(user_data) == subscribers
                     )
+                    grouping = {"users": len(user_data), "matching": "server"}
+                else:
+                    # Outbox senders may run in other processes, so the
+                    # in-memory hashes can be stale: let the database
+                    # compare every rendered message with the stored hash.
+                    select = (
+                        rendered_messages if DELIVERY == "outbox"
+                        else changed_messages
+                    )
+                    groups = group_by_signature(user_data)
+                    changed = list(select(
+                        index, user_data, message_cache, groups
+                    ))
+                    grouping = grouping_stats(groups)
+                    BROADCAST_GROUPS.set(grouping["groups"])
+
+            if DELIVERY == "outbox":
+                with profiler.stage("db"), get_db_cursor() as cur:
+                    queued = enqueue_messages(cur, user_data, changed)
+                NOTIFICATIONS.inc(len(user_data) - queued, result="skipped")
+                logging.info(
+                    f"Cycle summary: checked {len(user_data)} users, "
+                    f"{queued} messages queued; "
+                    f"groups {grouping}, "
+                    f"message cache {message_cache.stats()}, "
+                    f"handlers {dispatcher.stats()}"
+                )
+                last_outages = outages
+                last_fingerprint = fingerprint
+                continue
+
+            NOTIFICATIONS.inc(len(user_data) - len(changed), result="skipped")
+            sent_before = send_queue.stats()
+            for user_id, new_message, new_message_hash in changed:
+                send_queue.submit(
+                    user_id,
+                    new_message,
+                    on_delivered=partial(
+                        delivered, message_hash=new_message_hash
+                    ),
+                    on_failed=send_failed
+                )
+
+            with profiler.stage("send"):
+                send_queue.join()
+            with profiler.stage("db"):
+                hash_writer.flush()
+            sent_after = send_queue.stats()
+            logging.info(
+                f"Cycle summary: checked {len(user_data)} users, "
+                f"{len(changed)} messages changed, "
+                f"{sent_after['sent'] - sent_before['sent']} sent, "
+                f"{sent_after['failed'] - sent_before['failed']} failed; "
+                f"groups {grouping}, "
+                f"send queue {sent_after}, "
+                f"message cache {message_cache.stats()}, "
+                f"handlers {dispatcher.stats()}"
+            )
+
+            last_outages = outages
+            last_fingerprint = fingerprint
 
         except Exception as error:
+            for user_id in pending:
+                mark_user_pending(user_id)
             logging.error(f"Background job error: {error}")
 
         finally:
-            time.sleep(RETRY_PERIOD)
+            profiler.end()
+            time.sleep(min(RETRY_PERIOD, sources.seconds_until_due()))
 
 
-@bot.my_chat_member_handler()
 def handle_user_status(update):
     new_status = update.new_chat_member.status
     user_id = update.chat.id
     try:
         if new_status == "kicked":
             logging.warning(f"User {user_id} has blocked the bot")
-            with get_db_cursor() as cur:
-                cur.execute("""UPDATE light_bot.users
-                            SET blocked_at = NOW()
-                            WHERE user_id = %s;""",
-                            (user_id,)
-                            )
+            block_user(user_id)
         elif new_status == "member":
             old_status = update.old_chat_member.status
             if old_status == "kicked":
@@ -430,24 +732,57 @@ def handle_user_status(update):
                     f"User {user_id} has unblocked and restarted the bot"
                 )
                 with get_db_cursor() as cur:
-                    cur.execute("""UPDATE light_bot.users
-                                SET blocked_at = NULL
-                                WHERE user_id = %s;""",
-                                (user_id,)
-                                )
+                    execute_prepared(cur, "unblock_user", (user_id,))
+                subscriptions.set_blocked(user_id, False)
+                mark_user_pending(user_id)
     except Exception as error:
         logging.error(f"Error: {error}")
 
 
 if __name__ == "__main__":
+    atexit.register(db_pool.closeall)
+
+    if RUNTIME == "async":
+        configure()
+        unsupported = async_unsupported()
+        if unsupported:
+            raise UnsupportedConfigurationException(
+                f"RUNTIME=async does not support {', '.join(unsupported)}"
+            )
+        import async_runtime
 
-    if not check_env_vars():
-        raise MissingEnvironmentVariableException(
-            "Missing required environment variable")
+        logging.info("Starting asyncio runtime")
+        async_runtime.run(get_db_cursor)
+        sys.exit(0)
+
+    if ROLE == "worker":
+        run_worker()
+        sys.exit(0)
+
+    if ROLE == "sender":
+        run_sender()
+        sys.exit(0)
+
+    latest = create_app()
 
-    thread = threading.Thread(target=main)
+    thread = threading.Thread(target=main, args=(latest,))
     thread.daemon = True
     thread.start()
 
-    logging.info("Starting bot polling")
-    bot.infinity_polling()
+    if INGESTION_MODE == "webhook":
+        server = WebhookServer(
+            partial(bot.submit_update, block=False),
+            host=WEBHOOK_HOST,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET
+        )
+        server.start()
+        if WEBHOOK_URL:
+            bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        logging.info(f"Receiving updates on {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+        thread.join()
+    else:
+        logging.info("Starting bot polling")
+        bot.remove_webhook()
+        bot.infinity_polling()
@@ -0,0 +1,82 @@
+from matcher import OutageIndex, address_signature
+from message_cache import MessageCache
+from snapshot import changed_lines, diff_outages
+
+
+def affected_users(user_data, last_outages, outages):
+    """Return ids of users whose matched lines may differ between parses."""
+    if last_outages is None:
+        return set(user_data)
+
+    diff = diff_outages(last_outages, outages)
+    if not diff:
+        if list(last_outages.items()) == list(outages.items()):
+            return set()
+        # Same lines in a different order: every message may
+        # have been reordered, so check everyone.
+        return set(user_data)
+    return users_affected_by(user_data, diff)
+
+
+def users_affected_by(user_data, diff):
+    """Return ids of users subscribed to a line added or removed in diff."""
+    changes = OutageIndex(changed_lines(diff))
+    matches = changes.match_subscribers({
+        user_id: data["addresses"] for user_id, data in user_data.items()
+    })
+    return {user_id for user_id, positions in matches.items() if positions}
+
+
+def group_by_signature(user_data):
+    """
+    Group users tracking the same addresses:
+    { address signature: [user_id, ...], ...}
+    """
+    groups = {}
+    for user_id, data in user_data.items():
+        groups.setdefault(
+            address_signature(data["addresses"]), []
+        ).append(user_id)
+    return groups
+
+
+def grouping_stats(groups):
+    users = sum(map(len, groups.values()))
+    return {
+        "users": users,
+        "groups": len(groups),
+        "collapsed": users - len(groups),
+        "largest": max(map(len, groups.values()), default=0),
+    }
+
+
+def rendered_messages(index, user_data, cache=None, groups=None):
+    """
+    Yields (user_id, message, message_hash) for every user. Matching,
+    rendering and hashing run once per group of group_by_signature(),
+    through cache when given.
+    """
+    if cache is None:
+        cache = MessageCache()
+    if groups is None:
+        groups = group_by_signature(user_data)
+    rendered = cache.get_groups(index, {
+        signature: user_data[user_ids[0]]["addresses"]
+        for signature, user_ids in groups.items()
+    })
+    for signature, user_ids in groups.items():
+        message = rendered[signature]
+        for user_id in user_ids:
+            yield user_id, message.message, message.message_hash
+
+
+def changed_messages(index, user_data, cache=None, groups=None):
+    """
+    rendered_messages() of the users whose message differs from the
+    stored last_msg_hash.
+    """
+    for user_id, message, message_hash in rendered_messages(
+        index, user_data, cache, groups
+    ):
+        if message_hash != user_data[user_id]["last_msg_hash"]:
+            yield user_id, message, message_hash
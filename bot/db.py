@@ -0,0 +1,367 @@
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+
+import psycopg2
+from metrics import DB_POOL_WAIT
+from normalization import normalize_address
+from psycopg2 import pool
+from psycopg2.extras import execute_values
+
+MIGRATIONS = (
+    """ALTER TABLE light_bot.addresses
+    ADD COLUMN IF NOT EXISTS address_normalized varchar(255);""",
+    """CREATE INDEX IF NOT EXISTS idx_addresses_normalized
+    ON light_bot.addresses(user_id, address_normalized);""",
+    """CREATE TABLE IF NOT EXISTS light_bot.outage_snapshots (
+    id integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    fingerprint char(32) NOT NULL,
+    created_at timestamptz DEFAULT now() NOT NULL);""",
+    """CREATE TABLE IF NOT EXISTS light_bot.outages (
+    id integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    outage_date varchar(255) NOT NULL,
+    line text NOT NULL,
+    position integer NOT NULL,
+    first_snapshot_id integer NOT NULL
+        REFERENCES light_bot.outage_snapshots(id) ON DELETE CASCADE,
+    removed_snapshot_id integer
+        REFERENCES light_bot.outage_snapshots(id) ON DELETE SET NULL);""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS idx_outages_current
+    ON light_bot.outages(outage_date, line)
+    WHERE removed_snapshot_id IS NULL;""",
+    """CREATE INDEX IF NOT EXISTS idx_outages_snapshots
+    ON light_bot.outages(first_snapshot_id, removed_snapshot_id);""",
+    """CREATE TABLE IF NOT EXISTS light_bot.broadcast_jobs (
+    id integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    snapshot_id integer NOT NULL
+        REFERENCES light_bot.outage_snapshots(id) ON DELETE CASCADE,
+    previous_snapshot_id integer
+        REFERENCES light_bot.outage_snapshots(id) ON DELETE SET NULL,
+    shard integer NOT NULL,
+    shards integer NOT NULL,
+    attempts integer DEFAULT 0 NOT NULL,
+    run_after timestamptz DEFAULT now() NOT NULL,
+    created_at timestamptz DEFAULT now() NOT NULL,
+    finished_at timestamptz,
+    worker varchar(255),
+    messages integer);""",
+    """CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_pending
+    ON light_bot.broadcast_jobs(id)
+    WHERE finished_at IS NULL;""",
+    """CREATE TABLE IF NOT EXISTS light_bot.outbox (
+    id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    user_id bigint NOT NULL
+        REFERENCES light_bot.users(user_id) ON DELETE CASCADE,
+    message text NOT NULL,
+    message_hash char(32) NOT NULL,
+    attempts integer DEFAULT 0 NOT NULL,
+    next_attempt_at timestamptz DEFAULT now() NOT NULL,
+    created_at timestamptz DEFAULT now() NOT NULL,
+    delivered_at timestamptz);""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_pending_user
+    ON light_bot.outbox(user_id)
+    WHERE delivered_at IS NULL;""",
+    """CREATE INDEX IF NOT EXISTS idx_outbox_pending
+    ON light_bot.outbox(id)
+    WHERE delivered_at IS NULL;""",
+)
+
+
+def migrate(cur):
+    """
+    Bring an existing database up to init_db.sql and fill in the
+    normalized form of addresses stored before it existed.
+    """
+    for statement in MIGRATIONS:
+        cur.execute(statement)
+    cur.execute(
+        """SELECT id, address FROM light_bot.addresses
+        WHERE address_normalized IS NULL;"""
+    )
+    rows = [(row_id, normalize_address(address))
+            for row_id, address in cur.fetchall()]
+    if rows:
+        execute_values(
+            cur,
+            """UPDATE light_bot.addresses AS a
+            SET address_normalized = v.address_normalized
+            FROM (VALUES %s) AS v (id, address_normalized)
+            WHERE a.id = v.id;""",
+            rows,
+            template="(%s::integer, %s::varchar)"
+        )
+        logging.info(f"Normalized {len(rows)} stored addresses")
+
+
+class PoolTimeout(pool.PoolError):
+    """No connection became free within the pool timeout."""
+
+
+class LazyPool:
+    """
+    Connection pool opening connections on demand, so modules using the
+    database can be imported without one. getconn() waits up to timeout
+    for a free connection once maxconn are open. A connection idle for
+    more than check_after seconds is checked with SELECT 1 and replaced
+    if the server dropped it; broken connections are discarded on return.
+    Idle connections beyond minconn are closed after max_idle seconds.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=30, check_after=30,
+                 max_idle=600, connect=psycopg2.connect,
+                 clock=time.monotonic, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_idle = max_idle
+        self.connect = connect
+        self.clock = clock
+        self.connect_kwargs = connect_kwargs
+        self.idle = deque()
+        self.size = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.condition = threading.Condition()
+
+    @property
+    def opened(self):
+        return self.size > 0
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = self.clock()
+        with self.condition:
+            self.waiting += 1
+            try:
+                conn, idle_since = self._acquire(started + timeout)
+            finally:
+                self.waiting -= 1
+        DB_POOL_WAIT.observe(self.clock() - started)
+
+        try:
+            if conn is None:
+                conn = self._open()
+            elif conn.closed or (
+                self.clock() - idle_since > self.check_after
+                and not self._alive(conn)
+            ):
+                self._close(conn)
+                self.reconnects += 1
+                logging.warning("Replacing a dead database connection")
+                conn = self._open()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.in_use -= 1
+                self.condition.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        with self.condition:
+            self.in_use -= 1
+            if close or conn.closed:
+                self.size -= 1
+                self._close(conn)
+            else:
+                self.idle.append((conn, self.clock()))
+                self._prune()
+            self.condition.notify()
+
+    def closeall(self):
+        with self.condition:
+            while self.idle:
+                conn, _ = self.idle.popleft()
+                self.size -= 1
+                self._close(conn)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "idle": len(self.idle),
+                "waiting": self.waiting,
+                "timeouts": self.timeouts,
+                "reconnects": self.reconnects,
+            }
+
+    def _acquire(self, deadline):
+        """Take an idle connection or a slot for a new one (None)."""
+        while True:
+            if self.idle:
+                self.in_use += 1
+                return self.idle.pop()
+            if self.size < self.maxconn:
+                self.size += 1
+                self.in_use += 1
+                return None, None
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                self.timeouts += 1
+                raise PoolTimeout(
+                    f"No database connection free after {self.timeout}s"
+                )
+            self.condition.wait(remaining)
+
+    def _open(self):
+        conn = self.connect(**self.connect_kwargs)
+        logging.info("Opened a database connection")
+        return conn
+
+    def _prune(self):
+        now = self.clock()
+        while (len(self.idle) > self.minconn
+               and now - self.idle[0][1] > self.max_idle):
+            conn, _ = self.idle.popleft()
+            self.size -= 1
+            self._close(conn)
+
+    @staticmethod
+    def _alive(conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+STATEMENTS = {
+    "add_user": (
+        "bigint, varchar",
+        """INSERT INTO light_bot.users (user_id, username)
+        VALUES ($1, $2)
+        ON CONFLICT ON CONSTRAINT user_id_unique DO NOTHING""",
+    ),
+    "address_exists": (
+        "bigint, varchar",
+        """SELECT EXISTS
+        (SELECT 1 FROM light_bot.addresses
+        WHERE user_id = $1 AND address_normalized = $2)""",
+    ),
+    "add_address": (
+        "bigint, varchar, varchar",
+        """INSERT INTO light_bot.addresses
+        (user_id, address, address_normalized)
+        VALUES ($1, $2, $3)""",
+    ),
+    "delete_address": (
+        "bigint, varchar",
+        """DELETE FROM light_bot.addresses
+        WHERE user_id = $1 and address_normalized = $2
+        RETURNING address""",
+    ),
+    "set_message_hash": (
+        "char(32), bigint",
+        """UPDATE light_bot.users
+        SET last_message_hash = $1
+        WHERE user_id = $2""",
+    ),
+    "unblock_user": (
+        "bigint",
+        """UPDATE light_bot.users
+        SET blocked_at = NULL
+        WHERE user_id = $1""",
+    ),
+}
+
+_prepared = weakref.WeakKeyDictionary()
+
+
+def execute_prepared(cur, name, params):
+    """
+    Execute one of STATEMENTS, preparing it on the cursor's connection
+    the first time, so the server parses and plans it once per connection.
+    """
+    names = _prepared.setdefault(cur.connection, set())
+    if name not in names:
+        types, query = STATEMENTS[name]
+        cur.execute(f"PREPARE {name} ({types}) AS {query};")
+        names.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders});", params)
+
+
+def block_users(cur, user_ids):
+    """Stop notifying users Telegram reported as permanently unreachable."""
+    cur.execute(
+        """UPDATE light_bot.users
+        SET blocked_at = NOW()
+        WHERE user_id = ANY(%s) AND blocked_at IS NULL;""",
+        (list(user_ids),)
+    )
+
+
+def update_message_hashes(cur, rows, page_size=500):
+    """
+    Write [(user_id, message_hash), ...] in a few UPDATE statements with
+    one VALUES row per distinct hash, shared by the users it was sent to.
+    """
+    users_by_hash = {}
+    for user_id, message_hash in rows:
+        users_by_hash.setdefault(message_hash, []).append(user_id)
+    execute_values(
+        cur,
+        """UPDATE light_bot.users AS u
+        SET last_message_hash = v.message_hash
+        FROM (VALUES %s) AS v (message_hash, user_ids)
+        WHERE u.user_id = ANY(v.user_ids);""",
+        list(users_by_hash.items()),
+        template="(%s::char(32), %s::bigint[])",
+        page_size=page_size
+    )
+
+
+class HashBatchWriter:
+    """
+    Buffers hashes of delivered messages and flushes them in batches.
+    Rows of a failed flush stay buffered and are retried on the next one.
+    """
+
+    def __init__(self, get_cursor, batch_size=500):
+        self.get_cursor = get_cursor
+        self.batch_size = batch_size
+        self.rows = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flushed = 0
+
+    def add(self, user_id, message_hash):
+        with self.lock:
+            self.rows[user_id] = message_hash
+            full = len(self.rows) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                rows, self.rows = self.rows, {}
+            if not rows:
+                return
+            try:
+                with self.get_cursor() as cur:
+                    update_message_hashes(
+                        cur, list(rows.items()), self.batch_size
+                    )
+            except Exception as error:
+                logging.error(f"Error flushing message hashes: {error}")
+                with self.lock:
+                    self.rows = {**rows, **self.rows}
+                return
+            self.flushed += len(rows)
+            logging.info(f"Updated last message for {len(rows)} users")
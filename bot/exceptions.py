@@ -1,2 +1,6 @@
 class MissingEnvironmentVariableException(Exception):
     """Missing required environment variable."""
+
+
+class UnsupportedConfigurationException(Exception):
+    """Environment variables select modes that cannot run together."""
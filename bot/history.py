@@ -0,0 +1,129 @@
+import logging
+
+from normalization import OutageLine
+from psycopg2.extras import execute_values
+
+LATEST_SNAPSHOT_QUERY = """SELECT id, fingerprint
+FROM light_bot.outage_snapshots
+ORDER BY id DESC
+LIMIT 1;"""
+
+CURRENT_OUTAGES_QUERY = """SELECT outage_date, line
+FROM light_bot.outages
+WHERE removed_snapshot_id IS NULL
+ORDER BY position;"""
+
+SNAPSHOT_DIFF_QUERY = """SELECT outage_date, line,
+first_snapshot_id > %(old)s AS added
+FROM light_bot.outages
+WHERE (first_snapshot_id > %(old)s AND first_snapshot_id <= %(new)s
+       AND (removed_snapshot_id IS NULL OR removed_snapshot_id > %(new)s))
+   OR (first_snapshot_id <= %(old)s
+       AND removed_snapshot_id > %(old)s AND removed_snapshot_id <= %(new)s)
+ORDER BY position;"""
+
+
+def line_positions(outages):
+    """Return {(date, line): position} of the first occurrence of lines."""
+    positions = {}
+    for date, lines in outages.items():
+        for line in lines:
+            positions.setdefault((date, str(line)), len(positions))
+    return positions
+
+
+def snapshot_changes(stored, outages):
+    """
+    Rows to write when the stored snapshot is replaced by outages:
+    ([(date, line, position), ...] new or moved, [(date, line), ...] removed)
+    """
+    old = line_positions(stored or {})
+    new = line_positions(outages)
+    upserts = [
+        (date, line, position)
+        for (date, line), position in new.items()
+        if old.get((date, line)) != position
+    ]
+    removed = [key for key in old if key not in new]
+    return upserts, removed
+
+
+def rows_to_outages(rows):
+    outages = {}
+    for date, line in rows:
+        outages.setdefault(date, []).append(OutageLine(line))
+    return outages
+
+
+def load_latest(cur):
+    """Return (snapshot_id, fingerprint, outages) or None if none stored."""
+    cur.execute(LATEST_SNAPSHOT_QUERY)
+    snapshot = cur.fetchone()
+    if snapshot is None:
+        return None
+    return snapshot[0], snapshot[1], load_current(cur)
+
+
+def load_current(cur):
+    cur.execute(CURRENT_OUTAGES_QUERY)
+    return rows_to_outages(cur.fetchall())
+
+
+def save_snapshot(cur, stored, outages, fingerprint):
+    """
+    Record a new snapshot version, writing only the rows that differ
+    from the stored one. Returns the snapshot id. Without stored outages
+    the current rows are read first, so lines removed while the bot was
+    down still get closed.
+    """
+    if stored is None:
+        stored = load_current(cur)
+    upserts, removed = snapshot_changes(stored, outages)
+    cur.execute(
+        """INSERT INTO light_bot.outage_snapshots (fingerprint)
+        VALUES (%s) RETURNING id;""",
+        (fingerprint,)
+    )
+    snapshot_id = cur.fetchone()[0]
+
+    if removed:
+        execute_values(
+            cur,
+            """UPDATE light_bot.outages AS o
+            SET removed_snapshot_id = v.snapshot_id
+            FROM (VALUES %s) AS v (outage_date, line, snapshot_id)
+            WHERE o.outage_date = v.outage_date AND o.line = v.line
+            AND o.removed_snapshot_id IS NULL;""",
+            [(date, line, snapshot_id) for date, line in removed],
+            template="(%s, %s, %s::integer)"
+        )
+    if upserts:
+        execute_values(
+            cur,
+            """INSERT INTO light_bot.outages
+            (outage_date, line, position, first_snapshot_id)
+            VALUES %s
+            ON CONFLICT (outage_date, line)
+            WHERE removed_snapshot_id IS NULL
+            DO UPDATE SET position = EXCLUDED.position;""",
+            [(date, line, position, snapshot_id)
+             for date, line, position in upserts]
+        )
+    logging.info(
+        f"Stored outages snapshot {snapshot_id}: "
+        f"{len(upserts)} rows upserted, {len(removed)} removed"
+    )
+    return snapshot_id
+
+
+def diff_snapshots(cur, old_id, new_id):
+    """
+    Lines added and removed between two stored snapshots, in the
+    format of snapshot.diff_outages.
+    """
+    cur.execute(SNAPSHOT_DIFF_QUERY, {"old": old_id, "new": new_id})
+    diff = {}
+    for date, line, added in cur.fetchall():
+        section = diff.setdefault(date, {"added": [], "removed": []})
+        section["added" if added else "removed"].append(line)
+    return diff
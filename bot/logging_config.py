@@ -1,6 +1,65 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+SAMPLED = {"sampled": True}
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through every record except those logged with extra=SAMPLED,
+    of which only one in `every` is kept. Warnings and errors are never
+    dropped.
+    """
+
+    def __init__(self, every=1):
+        super().__init__()
+        self.every = max(1, every)
+        self.seen = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+        if record.levelno >= logging.WARNING:
+            return True
+        with self.lock:
+            self.seen += 1
+            keep = self.seen % self.every == 1 or self.every == 1
+            if not keep:
+                self.dropped += 1
+        return keep
+
+
+def parse_level(name):
+    """Numeric level of a level name in any case: "debug" -> 10."""
+    level = logging.getLevelName(name.strip().upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level: {name!r}")
+    return level
 
 
 def setup_logging():
@@ -14,11 +73,24 @@ def setup_logging():
     MAX_FILE_SIZE = 10 * 1024 * 1024
     BACKUP_COUNT = 5
 
+    LOG_JSON = os.getenv("LOG_JSON", "").lower() in ("1", "true", "yes")
+    LOG_STDOUT_LEVEL = parse_level(os.getenv("LOG_STDOUT_LEVEL") or "INFO")
+    LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY") or 100)
+
     os.makedirs(LOG_DIR, exist_ok=True)
 
     root_logger = logging.getLogger()
+    if any(isinstance(handler, QueueHandler)
+           for handler in root_logger.handlers):
+        return root_logger
+
     root_logger.setLevel(logging.DEBUG)
     root_logger.propagate = False
+
+    formatter = (
+        JsonFormatter() if LOG_JSON else logging.Formatter(LOG_FORMAT)
+    )
+
     file_handler = RotatingFileHandler(
         LOG_FILE_PATH,
         maxBytes=MAX_FILE_SIZE,
@@ -26,10 +98,22 @@ def setup_logging():
         encoding="utf-8"
     )
     file_handler.setLevel(logging.INFO)
-    file_format = logging.Formatter(
-        "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+    file_handler.setFormatter(formatter)
+
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.setLevel(LOG_STDOUT_LEVEL)
+    stdout_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setLevel(min(logging.INFO, LOG_STDOUT_LEVEL))
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_EVERY))
+    root_logger.addHandler(queue_handler)
+
+    listener = QueueListener(
+        log_queue, file_handler, stdout_handler, respect_handler_level=True
     )
-    file_handler.setFormatter(file_format)
-    root_logger.addHandler(file_handler)
+    listener.start()
+    atexit.register(listener.stop)
 
     return root_logger
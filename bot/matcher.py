@@ -0,0 +1,215 @@
+from collections import deque
+from functools import lru_cache
+
+from normalization import normalize_address, normalized_form
+from records import RecordIndex, build_records, parse_line
+from snapshot import outages_fingerprint
+
+NO_OUTAGES_MESSAGE = (
+    "Нет информации об отключениях электроэнергии "
+    "по вашим адресам в ближайшие дни"
+)
+
+
+@lru_cache(maxsize=65536)
+def house_address(address):
+    """(street or settlement, houses) of an address with a house number."""
+    if any(char.isdigit() for char in address):
+        settlement, street, houses = parse_line(address)
+        if (street or settlement) and houses:
+            return street or settlement, houses
+    return None
+
+
+@lru_cache(maxsize=65536)
+def address_key(address):
+    """
+    Key shared by addresses that always match the same lines: the street
+    and houses of an address with a house number, else its normalized form.
+    """
+    return house_address(address) or normalize_address(address)
+
+
+def address_signature(addresses):
+    """Canonical form of an address list, independent of order and spelling."""
+    return frozenset(map(address_key, addresses))
+
+
+class AddressAutomaton:
+    """Aho-Corasick automaton over normalized subscribed addresses."""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern):
+        node = 0
+        for char in pattern:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][char] = child
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(set())
+            node = child
+        self.output[node].add(pattern)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                self.output[child] |= self.output[self.fail[child]]
+
+    def search(self, text):
+        """Return the set of patterns occurring in text."""
+        found = set(self.output[0])
+        node = 0
+        for char in text:
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            if self.output[node]:
+                found |= self.output[node]
+        return found
+
+
+class OutageIndex:
+    """
+    Outage lines of a single parse, indexed for address matching.
+    Entries keep the page order: [(date, line), ...]
+    version identifies the parse, its fingerprint unless given.
+    """
+
+    def __init__(self, outages, version=None):
+        self.outages = outages
+        self._version = version
+        self.entries = [
+            (date, line)
+            for date, lines in outages.items()
+            for line in lines
+        ]
+        self._normalized = [normalized_form(line) for _, line in self.entries]
+        self._matches = {}
+        self._records = None
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = outages_fingerprint(self.outages)
+        return self._version
+
+    @property
+    def records(self):
+        """RecordIndex over the structured form of the entries."""
+        if self._records is None:
+            self._records = RecordIndex(build_records(self.outages))
+        return self._records
+
+    def _house_positions(self, address):
+        """
+        Positions for addresses with a house number, else None. A street
+        missing from the records, e.g. written in a form the parser does
+        not know, is looked up as a substring of the lines instead.
+        """
+        parsed = house_address(address)
+        if parsed is None:
+            return None
+        positions = self.records.positions_for_houses(*parsed)
+        if positions is None:
+            key = parsed[0]
+            positions = {
+                position for position, text in enumerate(self._normalized)
+                if key in text
+            }
+        return positions
+
+    def find(self, address):
+        """Return positions of entries mentioning the address."""
+        positions = self._house_positions(address)
+        if positions is not None:
+            return tuple(sorted(positions))
+        pattern = normalize_address(address)
+        positions = self._matches.get(pattern)
+        if positions is None:
+            positions = tuple(
+                position for position, text in enumerate(self._normalized)
+                if pattern in text
+            )
+        return positions
+
+    def match_subscribers(self, user_addresses):
+        """
+        Resolves every subscription in one pass over the page and returns
+        dict: { user_id: (position 1, position 2), ...}
+        """
+        houses = {
+            address: positions
+            for addresses in user_addresses.values()
+            for address in addresses
+            if (positions := self._house_positions(address)) is not None
+        }
+        patterns = {
+            normalize_address(address)
+            for addresses in user_addresses.values()
+            for address in addresses
+            if address not in houses
+        }
+        automaton = AddressAutomaton(patterns)
+
+        hits = {pattern: [] for pattern in patterns}
+        for position, text in enumerate(self._normalized):
+            for pattern in automaton.search(text):
+                hits[pattern].append(position)
+
+        self._matches.update(
+            (pattern, tuple(positions)) for pattern, positions in hits.items()
+        )
+
+        return {
+            user_id: tuple(sorted({
+                position
+                for address in addresses
+                for position in (
+                    houses[address] if address in houses
+                    else hits[normalize_address(address)]
+                )
+            }))
+            for user_id, addresses in user_addresses.items()
+        }
+
+    def positions_for(self, addresses):
+        return tuple(sorted({
+            position
+            for address in addresses
+            for position in self.find(address)
+        }))
+
+    def messages(self, positions):
+        """Return unique "date\\n\\nline" messages in page order."""
+        messages = []
+        seen = set()
+        for position in positions:
+            date, line = self.entries[position]
+            key = (date, self._normalized[position])
+            if key not in seen:
+                seen.add(key)
+                messages.append(f"{date}\n\n{line}")
+        return messages
+
+    def render(self, positions):
+        messages = self.messages(positions)
+        if not messages:
+            return NO_OUTAGES_MESSAGE
+        return "\n\n".join(messages)
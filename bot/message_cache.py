@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+from matcher import address_signature
+from metrics import MESSAGE_CACHE
+from utils import generate_last_message_hash
+
+load_dotenv()
+
+
+@dataclass(frozen=True, slots=True)
+class RenderedMessage:
+    positions: tuple
+    message: str
+    message_hash: str
+
+
+class MessageCache:
+    """
+    LRU of rendered messages keyed by (parse version, address keys).
+    Users subscribed to the same addresses share one entry per parse, and
+    /my and /check between parses are answered from memory. Entries of an
+    older parse simply age out; ttl additionally bounds an entry's age.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            maxsize=int(os.getenv("MESSAGE_CACHE_SIZE") or 10000),
+            ttl=float(os.getenv("MESSAGE_CACHE_TTL") or 0) or None,
+        )
+
+    def get(self, index, addresses):
+        """RenderedMessage of an address list against the index."""
+        key = (index.version, address_signature(addresses))
+        with self.lock:
+            rendered = self._lookup(key)
+        if rendered is not None:
+            self._count(hits=1)
+            return rendered
+
+        self._count(misses=1)
+        rendered = self._render(index, index.positions_for(addresses))
+        with self.lock:
+            self._store(key, rendered)
+        return rendered
+
+    def get_groups(self, index, groups):
+        """
+        { signature: RenderedMessage } for { signature: [address, ...] },
+        matching the address sets missing from the cache in one pass.
+        """
+        found = {}
+        missing = {}
+        with self.lock:
+            for signature, addresses in groups.items():
+                rendered = self._lookup((index.version, signature))
+                if rendered is None:
+                    missing[signature] = addresses
+                else:
+                    found[signature] = rendered
+
+        if missing:
+            matches = index.match_subscribers(missing)
+            computed = {
+                signature: self._render(index, matches[signature])
+                for signature in missing
+            }
+            with self.lock:
+                for signature, rendered in computed.items():
+                    self._store((index.version, signature), rendered)
+            found.update(computed)
+
+        self._count(hits=len(groups) - len(missing), misses=len(missing))
+        return {signature: found[signature] for signature in groups}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stored_at, rendered = entry
+        if self.ttl is not None and self.clock() - stored_at > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return rendered
+
+    def _store(self, key, rendered):
+        self.entries[key] = (self.clock(), rendered)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def _count(self, hits=0, misses=0):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+        if hits:
+            MESSAGE_CACHE.inc(hits, result="hit")
+        if misses:
+            MESSAGE_CACHE.inc(misses, result="miss")
+
+    @staticmethod
+    def _render(index, positions):
+        message = index.render(positions)
+        return RenderedMessage(
+            positions, message, generate_last_message_hash(message)
+        )
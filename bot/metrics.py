@@ -0,0 +1,364 @@
+import json
+import logging
+import signal
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30
+)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        labels = _format_labels(self.labelnames, key)
+        return [f"{self.name}{labels} {value}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, callback):
+        """Read the value from callback() at scrape time."""
+        self.callback = callback
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+    def render(self):
+        if self.callback is not None:
+            try:
+                self.set(self.callback())
+            except Exception as error:
+                logging.error(f"Error reading gauge {self.name}: {error}")
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total, observed = self.values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+            self.values[key] = (counts, total + value, observed + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        with self.lock:
+            value = self.values.get(self._key(labels))
+        return value[2] if value else 0
+
+    def _render_value(self, key, value):
+        counts, total, observed = value
+        lines = []
+        for bound, count in zip(self.buckets, counts):
+            labels = _format_labels(self.labelnames, key, [("le", bound)])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+        lines.append(f"{self.name}_bucket{labels} {observed}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {observed}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=()):
+        return self.register(Histogram(name, documentation, labelnames))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class CycleProfiler:
+    """Collects per-stage timings of the last background cycles."""
+
+    def __init__(self, histogram, keep=20):
+        self.histogram = histogram
+        self.cycles = deque(maxlen=keep)
+        self.current = None
+        self.lock = threading.Lock()
+
+    def begin(self):
+        self.current = {"started_at": time.time(), "stages": {}}
+
+    def end(self):
+        if self.current is None:
+            return
+        stages = self.current["stages"]
+        self.current["total"] = sum(stages.values())
+        with self.lock:
+            self.cycles.append(self.current)
+        self.current = None
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.histogram.observe(elapsed, stage=name)
+            if self.current is not None:
+                stages = self.current["stages"]
+                stages[name] = stages.get(name, 0.0) + elapsed
+
+    def report(self):
+        with self.lock:
+            return list(self.cycles)
+
+    def dump(self, *args):
+        """Log the recorded cycles, usable as a signal handler."""
+        logging.info(f"Cycle timings: {json.dumps(self.report())}")
+
+    def install_signal_handler(self, signum=getattr(signal, "SIGUSR1", None)):
+        if signum is not None:
+            signal.signal(signum, self.dump)
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "bot_stage_seconds",
+    "Duration of background cycle stages",
+    ("stage",)
+)
+FETCH_SECONDS = REGISTRY.histogram(
+    "bot_fetch_seconds", "Duration of outages page requests"
+)
+PARSE_SECONDS = REGISTRY.histogram(
+    "bot_parse_seconds", "Duration of outages page parsing"
+)
+DB_SECONDS = REGISTRY.histogram(
+    "bot_db_seconds", "Duration of database transactions"
+)
+SEND_SECONDS = REGISTRY.histogram(
+    "bot_send_seconds", "Duration of Telegram send_message calls"
+)
+NOTIFICATIONS = REGISTRY.counter(
+    "bot_notifications_total",
+    "Broadcast notifications by result (sent, failed, blocked, skipped)",
+    ("result",)
+)
+OUTAGE_DATES = REGISTRY.gauge(
+    "bot_outage_dates", "Date sections in the cached outages"
+)
+OUTAGE_LINES = REGISTRY.gauge(
+    "bot_outage_lines", "Address lines in the cached outages"
+)
+SUBSCRIBERS = REGISTRY.gauge(
+    "bot_subscribers", "Users with addresses who have not blocked the bot"
+)
+DB_POOL_IN_USE = REGISTRY.gauge(
+    "bot_db_pool_in_use", "Database connections checked out of the pool"
+)
+DB_POOL_SIZE = REGISTRY.gauge(
+    "bot_db_pool_size", "Maximum number of database connections"
+)
+DB_POOL_OPEN = REGISTRY.gauge(
+    "bot_db_pool_open", "Database connections currently open"
+)
+DB_POOL_WAIT = REGISTRY.histogram(
+    "bot_db_pool_wait_seconds", "Time spent waiting for a free connection"
+)
+SEND_QUEUE_DEPTH = REGISTRY.gauge(
+    "bot_send_queue_depth", "Messages waiting in the send queue"
+)
+HANDLER_QUEUE_DEPTH = REGISTRY.gauge(
+    "bot_handler_queue_depth", "Updates waiting for a handler worker"
+)
+CYCLE_INTERVAL = REGISTRY.histogram(
+    "bot_cycle_interval_seconds",
+    "Time between the starts of consecutive background cycles"
+)
+FETCH_INTERVAL = REGISTRY.gauge(
+    "bot_fetch_interval_seconds",
+    "Delay chosen before the next fetch of a source",
+    ("source",)
+)
+FETCH_OUTCOMES = REGISTRY.counter(
+    "bot_fetch_outcomes_total",
+    "Source fetches by outcome (changed, unchanged, error)",
+    ("source", "outcome")
+)
+BROADCAST_GROUPS = REGISTRY.gauge(
+    "bot_broadcast_groups",
+    "Distinct address sets among the users checked in the last cycle"
+)
+MESSAGE_CACHE = REGISTRY.counter(
+    "bot_message_cache_total",
+    "Rendered message cache lookups by result (hit, miss)",
+    ("result",)
+)
+READY = REGISTRY.gauge(
+    "bot_ready", "1 once subscriptions and outages are loaded"
+)
+STARTUP_SECONDS = REGISTRY.gauge(
+    "bot_startup_seconds", "Time from process start to readiness"
+)
+
+profiler = CycleProfiler(STAGE_SECONDS)
+
+
+class MetricsServer:
+    """
+    Local HTTP endpoint: /metrics in Prometheus text format, /profile
+    with the timings of the last background cycles as JSON and /ready
+    answering 200 once the ready event is set, 503 before.
+    """
+
+    def __init__(self, host="127.0.0.1", port=9100, registry=REGISTRY,
+                 ready=None):
+        self.registry = registry
+        self.ready = ready
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                status = 200
+                if self.path == "/metrics":
+                    body = server.registry.render()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/profile":
+                    body = json.dumps(profiler.report())
+                    content_type = "application/json"
+                elif self.path == "/ready":
+                    is_ready = server.ready is None or server.ready.is_set()
+                    body = "ready\n" if is_ready else "starting\n"
+                    content_type = "text/plain"
+                    status = 200 if is_ready else 503
+                else:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                payload = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Metrics: {format % args}")
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="metrics-http", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        if self.thread:
+            self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,49 @@
+import re
+from functools import lru_cache
+
+STREET_TYPES = frozenset((
+    # Russian
+    "ул", "улица", "улице", "улицы", "улицу", "улицей",
+    "пр", "пр-т", "просп", "проспект", "проспекте", "проспекта",
+    "проспекту",
+    "пер", "переулок", "переулке", "переулка", "переулку",
+    "пл", "площадь", "площади",
+    "б-р", "бульвар", "бульваре", "бульвара", "бульвару",
+    "ш", "шоссе", "туп", "тупик", "тупике", "тупику",
+    "кв-л", "квартал", "квартале", "кварталу",
+    "мкр", "микрорайон", "микрорайоне", "микрорайону",
+    "г", "город", "городе", "с", "село", "селе", "села",
+    # Armenian
+    "փ", "փողոց", "փողոցում", "պող", "պողոտա", "պողոտայում",
+    "նրբ", "նրբանցք", "նրբանցքում", "հր", "հրապարակ",
+    "թաղ", "թաղամաս", "գ", "գյուղ", "գյուղում", "ք", "քաղաք",
+))
+
+TOKEN_RE = re.compile(r"[\w-]+")
+
+
+@lru_cache(maxsize=65536)
+def normalize_address(text):
+    """
+    Canonical matching key of an address or outage line: case-folded,
+    ё folded into е, punctuation dropped and street types removed.
+    "ул. Бабаяна" and "Бабаяна" both become "бабаяна".
+    """
+    tokens = TOKEN_RE.findall(text.casefold().replace("ё", "е"))
+    stripped = [token for token in tokens if token not in STREET_TYPES]
+    return " ".join(stripped or tokens)
+
+
+class OutageLine(str):
+    """Raw outage line text carrying its normalized form."""
+
+    def __new__(cls, text):
+        line = super().__new__(cls, text)
+        line.normalized = normalize_address(text)
+        return line
+
+
+def normalized_form(text):
+    if isinstance(text, OutageLine):
+        return text.normalized
+    return normalize_address(text)
@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+from functools import partial
+
+from db import block_users, update_message_hashes
+from psycopg2.extras import execute_values
+from sender import SendQueue, is_permanent
+
+MAX_ATTEMPTS = 5
+
+CLAIM_QUERY = """SELECT id, user_id, message, message_hash
+FROM light_bot.outbox
+WHERE delivered_at IS NULL AND next_attempt_at <= now() AND attempts < %s
+ORDER BY id
+LIMIT %s
+FOR UPDATE SKIP LOCKED;"""
+
+
+def enqueue_messages(cur, checked, messages, page_size=500):
+    """
+    Queue messages [(user_id, message, message_hash), ...] whose hash
+    differs from the user's last_message_hash in the database, replacing
+    their undelivered message. Undelivered messages of checked users
+    whose stored hash is current again, or who have no entry in
+    messages, are dropped. Returns the number of queued messages.
+    """
+    messages = list(messages)
+    listed = {user_id for user_id, _, _ in messages}
+    current = [user_id for user_id in checked if user_id not in listed]
+    dropped = 0
+    if current:
+        cur.execute(
+            """DELETE FROM light_bot.outbox
+            WHERE delivered_at IS NULL AND user_id = ANY(%s);""",
+            (current,)
+        )
+        dropped = cur.rowcount
+    queued = []
+    if messages:
+        dropped += len(execute_values(
+            cur,
+            """DELETE FROM light_bot.outbox o
+            USING (VALUES %s) AS v (user_id, message_hash), light_bot.users u
+            WHERE o.user_id = v.user_id AND u.user_id = v.user_id
+            AND o.delivered_at IS NULL
+            AND u.last_message_hash IS NOT DISTINCT FROM v.message_hash
+            RETURNING o.id;""",
+            [(user_id, message_hash) for user_id, _, message_hash in messages],
+            template="(%s::bigint, %s::char(32))",
+            page_size=page_size,
+            fetch=True
+        ))
+        queued = execute_values(
+            cur,
+            """INSERT INTO light_bot.outbox (user_id, message, message_hash)
+            SELECT v.user_id, v.message, v.message_hash
+            FROM (VALUES %s) AS v (user_id, message, message_hash)
+            JOIN light_bot.users u ON u.user_id = v.user_id
+            WHERE u.last_message_hash IS DISTINCT FROM v.message_hash
+            ON CONFLICT (user_id) WHERE delivered_at IS NULL
+            DO UPDATE SET message = EXCLUDED.message,
+            message_hash = EXCLUDED.message_hash,
+            attempts = 0, next_attempt_at = now(), created_at = now()
+            RETURNING user_id;""",
+            messages,
+            template="(%s::bigint, %s::text, %s::char(32))",
+            page_size=page_size,
+            fetch=True
+        )
+    logging.info(
+        f"Queued {len(queued)} messages, dropped {dropped} outdated"
+    )
+    return len(queued)
+
+
+class OutboxSender:
+    """
+    Drains light_bot.outbox: claims a batch with FOR UPDATE SKIP LOCKED,
+    sends it through a SendQueue and, in the same transaction, marks the
+    delivered rows and stores their hashes. Failed rows are retried with
+    a growing delay; rows of users who blocked the bot are dropped and
+    the users marked blocked. Senders in one or several processes drain
+    in parallel; a crash before the commit releases the batch, so at most
+    that batch is sent again. Delivered rows are purged after a day,
+    rows out of attempts at the same time, their users handed to
+    on_exhausted.
+    """
+
+    def __init__(self, get_cursor, send, on_delivered=None, on_blocked=None,
+                 on_exhausted=None, send_workers=4, rate=30, batch_size=100,
+                 idle_sleep=1, purge_every=3600):
+        self.get_cursor = get_cursor
+        self.on_delivered = on_delivered
+        self.on_blocked = on_blocked
+        self.on_exhausted = on_exhausted
+        self.batch_size = batch_size
+        self.idle_sleep = idle_sleep
+        self.purge_every = purge_every
+        self.last_purge = None
+        self.send_queue = SendQueue(send, workers=send_workers, rate=rate)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name="outbox", daemon=True
+        )
+        self.thread.start()
+
+    def run(self):
+        logging.info("Starting outbox sender")
+        self.send_queue.start()
+        while True:
+            try:
+                if self.run_once():
+                    continue
+                if (self.last_purge is None or time.monotonic()
+                        - self.last_purge >= self.purge_every):
+                    self.purge()
+            except Exception as error:
+                logging.error(f"Outbox sender error: {error}")
+            time.sleep(self.idle_sleep)
+
+    def purge(self):
+        """
+        Delete rows delivered over a day ago and rows that ran out of
+        attempts, handing the users of the latter to on_exhausted.
+        """
+        with self.get_cursor() as cur:
+            cur.execute(
+                """DELETE FROM light_bot.outbox
+                WHERE delivered_at < now() - interval '1 day';"""
+            )
+            purged = cur.rowcount
+            cur.execute(
+                """DELETE FROM light_bot.outbox
+                WHERE delivered_at IS NULL AND attempts >= %s
+                RETURNING user_id;""",
+                (MAX_ATTEMPTS,)
+            )
+            exhausted = [user_id for user_id, in cur.fetchall()]
+        self.last_purge = time.monotonic()
+        if purged:
+            logging.info(f"Purged {purged} delivered outbox rows")
+        if exhausted:
+            logging.warning(
+                f"Dropped {len(exhausted)} outbox messages after "
+                f"{MAX_ATTEMPTS} attempts, users {exhausted}"
+            )
+            if self.on_exhausted:
+                for user_id in exhausted:
+                    self.on_exhausted(user_id)
+
+    def run_once(self):
+        """Deliver one batch, return False when there was none to claim."""
+        with self.get_cursor() as cur:
+            cur.execute(CLAIM_QUERY, (MAX_ATTEMPTS, self.batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                return False
+
+            delivered, failed, blocked = self.send_batch(rows)
+            if delivered:
+                cur.execute(
+                    """UPDATE light_bot.outbox
+                    SET delivered_at = now(), attempts = attempts + 1
+                    WHERE id = ANY(%s);""",
+                    ([row_id for row_id, _, _ in delivered],)
+                )
+                update_message_hashes(cur, [
+                    (user_id, message_hash)
+                    for _, user_id, message_hash in delivered
+                ])
+            if failed:
+                cur.execute(
+                    """UPDATE light_bot.outbox
+                    SET attempts = attempts + 1,
+                    next_attempt_at = now()
+                        + interval '1 minute' * (attempts + 1)
+                    WHERE id = ANY(%s);""",
+                    (failed,)
+                )
+            if blocked:
+                cur.execute(
+                    "DELETE FROM light_bot.outbox WHERE id = ANY(%s);",
+                    ([row_id for row_id, _ in blocked],)
+                )
+                block_users(cur, [user_id for _, user_id in blocked])
+
+        if self.on_delivered:
+            for _, user_id, message_hash in delivered:
+                self.on_delivered(user_id, message_hash)
+        if self.on_blocked:
+            for _, user_id in blocked:
+                self.on_blocked(user_id)
+        logging.info(
+            f"Outbox batch: {len(delivered)} delivered, {len(failed)} failed, "
+            f"{len(blocked)} blocked"
+        )
+        return True
+
+    def send_batch(self, rows):
+        """
+        Send claimed rows, return ([(id, user_id, hash)], [failed id],
+        [(id, user_id)] of users who blocked the bot).
+        """
+        delivered = []
+        failed = []
+        blocked = []
+        lock = threading.Lock()
+
+        def sent(user_id, row_id, message_hash):
+            with lock:
+                delivered.append((row_id, user_id, message_hash))
+
+        def not_sent(user_id, error, row_id):
+            with lock:
+                if is_permanent(error):
+                    blocked.append((row_id, user_id))
+                else:
+                    failed.append(row_id)
+
+        for row_id, user_id, message, message_hash in rows:
+            self.send_queue.submit(
+                user_id,
+                message,
+                on_delivered=partial(
+                    sent, row_id=row_id, message_hash=message_hash
+                ),
+                on_failed=partial(not_sent, row_id=row_id)
+            )
+        self.send_queue.join()
+        return delivered, failed, blocked
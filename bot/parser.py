@@ -1,21 +1,91 @@
+import asyncio
 import logging
 import os
+import re
+import time
 
+import aiohttp
 import requests
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+from lxml import etree
+from metrics import FETCH_SECONDS, PARSE_SECONDS
+from normalization import OutageLine
+from requests.adapters import HTTPAdapter
 
 load_dotenv()
 
 
-class Parser:
+class FetchStats:
+    """Counters of the page fetches done by a Parser."""
 
     def __init__(self):
-        self.url = os.getenv("URL")
-        self.headers = {
+        self.requests = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.total_latency = 0.0
+        self.last_latency = 0.0
+
+    def record(self, status_code, size, latency):
+        self.requests += 1
+        if status_code == 304:
+            self.not_modified += 1
+        self.bytes_received += size
+        self.total_latency += latency
+        self.last_latency = latency
+        FETCH_SECONDS.observe(latency)
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "not_modified": self.not_modified,
+            "not_modified_rate": (
+                self.not_modified / self.requests if self.requests else 0.0
+            ),
+            "errors": self.errors,
+            "bytes_received": self.bytes_received,
+            "avg_latency": (
+                self.total_latency / self.requests if self.requests else 0.0
+            ),
+            "last_latency": self.last_latency,
+        }
+
+
+def pooled_session(pool_maxsize=4):
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=pool_maxsize))
+    session.mount("http://", HTTPAdapter(pool_maxsize=pool_maxsize))
+    return session
+
+
+class Parser:
+
+    ENGINES = ("html.parser", "lxml")
+
+    def __init__(self, engine=None, url=None, headers=None, session=None):
+        self.url = url or os.getenv("URL")
+        self.engine = engine or os.getenv("PARSER_ENGINE") or "html.parser"
+        if self.engine not in self.ENGINES:
+            raise ValueError(f"Unknown parser engine: {self.engine}")
+        self.headers = headers or {
             "Accept": os.getenv("ACCEPT"),
             "User-Agent": os.getenv("USER_AGENT")
         }
+        self.session = session or pooled_session()
+        self.stats = FetchStats()
+        self.etag = None
+        self.last_modified = None
+        self.last_outages = None
+
+    def _conditional_headers(self):
+        headers = dict(self.headers)
+        if self.last_outages is not None:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+        return headers
 
     def parse_website(self):
         """
@@ -23,34 +93,27 @@ class Parser:
         { "Date 1": ["Addresses 1", "Addresses 2"], ...}
         """
         try:
-            response = requests.get(self.url, headers=self.headers, timeout=10)
-            response.raise_for_status()
-
-            page = BeautifulSoup(response.text, "html.parser")
-            ps = [p.get_text() for p in page.find_all("p")]
-
-            outages = {}
-            current_date = None
-            current_places = []
+            started = time.monotonic()
+            response = self.session.get(
+                self.url, headers=self._conditional_headers(), timeout=10
+            )
+            self.stats.record(
+                response.status_code,
+                len(response.content),
+                time.monotonic() - started
+            )
 
-            for text in ps:
-                if not text:
-                    continue
+            if response.status_code == 304:
+                logging.info("Page not modified since last fetch")
+                return self.last_outages
 
-                if "текущего года" in text:
-                    if current_date:
-                        outages[current_date] = current_places
-
-                    current_date = text
-                    current_places = []
-
-                else:
-                    if current_date:
-                        current_places.append(text.removesuffix(","))
+            response.raise_for_status()
 
-            if current_date:
-                outages[current_date] = current_places
+            outages = self.parse_page(response.text)
 
+            self.etag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+            self.last_outages = outages
             return outages
 
         except requests.exceptions.HTTPError as error:
@@ -62,3 +125,170 @@ class Parser:
             logging.error(f"Timeout Error: {error}")
         except requests.exceptions.RequestException as error:
             logging.error(f"An unexpected error occurred: {error}")
+        self.stats.errors += 1
+
+    async def parse_website_async(self, session):
+        """
+        Same as parse_website, fetching through an aiohttp session and
+        parsing the page in a worker thread.
+        """
+        try:
+            started = time.monotonic()
+            async with session.get(
+                self.url,
+                headers=self._conditional_headers(),
+                timeout=aiohttp.ClientTimeout(total=10)
+            ) as response:
+                body = await response.read()
+                self.stats.record(
+                    response.status, len(body), time.monotonic() - started
+                )
+
+                if response.status == 304:
+                    logging.info("Page not modified since last fetch")
+                    return self.last_outages
+
+                response.raise_for_status()
+                html = body.decode(response.get_encoding())
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+
+            outages = await asyncio.to_thread(self.parse_page, html)
+
+            self.etag = etag
+            self.last_modified = last_modified
+            self.last_outages = outages
+            return outages
+
+        except aiohttp.ClientResponseError as error:
+            logging.error(f"HTTP Error: {error}")
+        except asyncio.TimeoutError as error:
+            logging.error(f"Timeout Error: {error}")
+        except aiohttp.ClientError as error:
+            logging.error(f"Connection Error: {error}")
+        self.stats.errors += 1
+
+    def parse_page(self, html):
+        with PARSE_SECONDS.time():
+            if self.engine == "lxml":
+                texts = iter_paragraphs_lxml(html)
+            else:
+                texts = iter_paragraphs_bs4(html)
+            return group_by_date(texts)
+
+
+# Tags before which libxml2 implicitly closes an open <p>.
+P_CLOSING_TAGS = frozenset((
+    "address", "blockquote", "center", "dd", "dir", "div", "dl", "dt",
+    "fieldset", "form", "frameset", "h1", "h2", "h3", "h4", "h5", "h6", "hr",
+    "li", "listing", "menu", "ol", "p", "pre", "table", "tbody", "td", "th",
+    "tr", "ul", "xmp",
+))
+RAW_TEXT_TAGS = frozenset(("script", "style"))
+TAG_RE = re.compile(r"<!--.*?-->|<(/?)([a-zA-Z][a-zA-Z0-9]*)", re.S)
+
+
+class ParagraphTarget:
+    """lxml parser target collecting the text of every <p> element."""
+
+    def __init__(self):
+        self.depth = 0
+        self.skip = 0
+        self.chunks = []
+        self.paragraphs = []
+
+    def start(self, tag, attrib):
+        if tag == "p":
+            self.depth += 1
+        elif tag in RAW_TEXT_TAGS:
+            self.skip += 1
+
+    def end(self, tag):
+        if tag == "p" and self.depth:
+            self.depth -= 1
+            if not self.depth:
+                self.paragraphs.append("".join(self.chunks))
+                self.chunks = []
+        elif tag in RAW_TEXT_TAGS and self.skip:
+            self.skip -= 1
+
+    def data(self, data):
+        if self.depth and not self.skip:
+            self.chunks.append(data)
+
+    def close(self):
+        return self.paragraphs
+
+
+def has_irregular_paragraphs(html):
+    """Whether libxml2 would split or invent <p> elements of the page.
+
+    html.parser keeps nested and unclosed paragraphs as written, while
+    libxml2 closes them before block tags and turns a stray </p> into an
+    empty paragraph.
+    """
+    open_paragraphs = 0
+    raw_text_end = None
+    for match in TAG_RE.finditer(html):
+        closing, tag = match.groups()
+        if tag is None:
+            continue
+        tag = tag.lower()
+        if raw_text_end is not None:
+            if closing and tag == raw_text_end:
+                raw_text_end = None
+            continue
+        if closing:
+            if tag == "p":
+                if not open_paragraphs:
+                    return True
+                open_paragraphs -= 1
+        elif open_paragraphs and tag in P_CLOSING_TAGS:
+            return True
+        elif tag == "p":
+            open_paragraphs += 1
+        elif tag in RAW_TEXT_TAGS:
+            raw_text_end = tag
+    return False
+
+
+def iter_paragraphs_bs4(html):
+    page = BeautifulSoup(html, "html.parser")
+    return (p.get_text() for p in page.find_all("p"))
+
+
+def iter_paragraphs_lxml(html):
+    """Stream <p> texts out of the page without building a tree."""
+    if has_irregular_paragraphs(html):
+        logging.debug("Irregular <p> nesting, parsing page with html.parser")
+        return iter_paragraphs_bs4(html)
+    target = ParagraphTarget()
+    html_parser = etree.HTMLParser(target=target)
+    html_parser.feed(html)
+    return html_parser.close()
+
+
+def group_by_date(texts):
+    outages = {}
+    current_date = None
+    current_places = []
+
+    for text in texts:
+        if not text:
+            continue
+
+        if "текущего года" in text:
+            if current_date:
+                outages[current_date] = current_places
+
+            current_date = text
+            current_places = []
+
+        else:
+            if current_date:
+                current_places.append(OutageLine(text.removesuffix(",")))
+
+    if current_date:
+        outages[current_date] = current_places
+
+    return outages
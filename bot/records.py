@@ -0,0 +1,207 @@
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+
+from normalization import STREET_TYPES, TOKEN_RE
+
+SETTLEMENT_TYPES = frozenset((
+    "г", "город", "городе", "с", "село", "селе", "села",
+    "գ", "գյուղ", "գյուղում", "ք", "քաղաք",
+))
+
+FILLER_WORDS = frozenset((
+    "дом", "дома", "домов", "д", "по", "в", "на", "и", "частные",
+    "частный", "многоквартирные", "здания", "здание",
+    "տուն", "տներ", "շենք", "շենքեր", "և",
+))
+
+SEPARATOR_RE = re.compile(r"[,;]|\b(?:и|և)\b")
+# A house number keeps at most a letter or corpus suffix ("5а", "7к2"),
+# so ordinals like "2-й переулок" are not read as houses.
+HOUSE_SUFFIX = r"(?:к\d+|[a-zа-яա-ֆ])?"
+HOUSE_RE = re.compile(rf"^(\d+){HOUSE_SUFFIX}(?:-(\d+){HOUSE_SUFFIX})?$")
+BUILDING_RE = re.compile(r"(\d)/\d+")
+
+
+@dataclass(frozen=True, slots=True)
+class OutageRecord:
+    """
+    One street of an outage line broken into parts. houses holds
+    inclusive (first, last) intervals, an empty tuple means the whole
+    street. Records of one line share its position.
+    """
+    position: int
+    date: str
+    line: str
+    settlement: str | None
+    street: str | None
+    houses: tuple
+
+    @property
+    def key(self):
+        return self.street or self.settlement
+
+
+def fold(text):
+    return BUILDING_RE.sub(r"\1", text.casefold().replace("ё", "е"))
+
+
+def parse_tokens(tokens):
+    settlement = None
+    street_words = []
+    houses = []
+    expect_settlement = False
+
+    for token in tokens:
+        house = HOUSE_RE.match(token)
+        if house:
+            first = int(house.group(1))
+            last = int(house.group(2) or first)
+            houses.append((min(first, last), max(first, last)))
+            continue
+        if token in SETTLEMENT_TYPES:
+            expect_settlement = True
+            continue
+        if token in STREET_TYPES or token in FILLER_WORDS:
+            continue
+        if expect_settlement and settlement is None:
+            settlement = token
+            expect_settlement = False
+            continue
+        street_words.append(token)
+
+    street = " ".join(street_words) or None
+    return settlement, street, tuple(houses)
+
+
+def parse_line(text):
+    """
+    Split an address into (settlement, street, houses):
+    "дома 2-22 по ул. Бабаяна" -> (None, "бабаяна", ((2, 22),))
+    """
+    return parse_tokens(TOKEN_RE.findall(fold(text)))
+
+
+def parse_segments(text):
+    """
+    Split an outage line into (settlement, street, houses) per street,
+    on commas and "и": "дома 2-22 по ул. Бабаяна, Тиграняна" ->
+    [(None, "бабаяна", ((2, 22),)), (None, "тиграняна", ())]
+    Parts with only houses belong to the street before them, or to the
+    next one at the start of the line.
+    """
+    segments = []
+    settlement = None
+    pending = ()
+    for part in SEPARATOR_RE.split(fold(text)):
+        part_settlement, street, houses = parse_tokens(TOKEN_RE.findall(part))
+        if part_settlement is None and street is None:
+            if segments:
+                segments[-1][2] += houses
+            else:
+                pending += houses
+            continue
+        if part_settlement is None and segments and segments[-1][1] is None:
+            segments[-1][1] = street
+            segments[-1][2] += houses
+            continue
+        settlement = part_settlement or settlement
+        segments.append([settlement, street, pending + houses])
+        pending = ()
+    if not segments:
+        return [(None, None, pending)]
+    return [tuple(segment) for segment in segments]
+
+
+def build_records(outages):
+    """Return OutageRecords of {date: [line, ...]} in page order."""
+    records = []
+    position = 0
+    for date, lines in outages.items():
+        for line in lines:
+            for settlement, street, houses in parse_segments(line):
+                records.append(OutageRecord(
+                    position, date, line, settlement, street, houses
+                ))
+            position += 1
+    return records
+
+
+class StreetIntervals:
+    """House intervals of one street, sorted by their first house."""
+
+    def __init__(self):
+        self.whole = []
+        self.intervals = []
+        self.starts = []
+        self.max_ends = []
+
+    def add(self, record):
+        if not record.houses:
+            self.whole.append(record)
+            return
+        for first, last in record.houses:
+            self.intervals.append((first, last, record))
+
+    def freeze(self):
+        self.intervals.sort(key=lambda interval: interval[:2])
+        self.starts = [first for first, _, _ in self.intervals]
+        self.max_ends = []
+        max_end = 0
+        for _, last, _ in self.intervals:
+            max_end = max(max_end, last)
+            self.max_ends.append(max_end)
+
+    def overlapping(self, first, last):
+        """Records with an interval overlapping houses first..last."""
+        found = []
+        position = bisect_right(self.starts, last) - 1
+        while position >= 0 and self.max_ends[position] >= first:
+            _, end, record = self.intervals[position]
+            if end >= first:
+                found.append(record)
+            position -= 1
+        return found
+
+
+class RecordIndex:
+    """Outage records indexed by street (or settlement) and house number."""
+
+    def __init__(self, records):
+        self.records = records
+        self.streets = {}
+        for record in records:
+            if record.key is None:
+                continue
+            self.streets.setdefault(record.key, StreetIntervals()).add(record)
+        for intervals in self.streets.values():
+            intervals.freeze()
+
+    def lookup(self, street, first=None, last=None):
+        """
+        Records affecting the street, or only its houses first..last.
+        Records without house numbers affect every house of the street.
+        """
+        intervals = self.streets.get(street)
+        if intervals is None:
+            return []
+        if first is None:
+            found = [record for _, _, record in intervals.intervals]
+        else:
+            found = intervals.overlapping(first, last or first)
+        unique = {record.position: record for record in intervals.whole}
+        unique.update((record.position, record) for record in found)
+        return [unique[position] for position in sorted(unique)]
+
+    def positions_for_houses(self, key, houses):
+        """
+        Positions of records affecting houses [(first, last), ...] of a
+        street (or settlement), None if it is not among the records.
+        """
+        if key not in self.streets:
+            return None
+        return {
+            record.position
+            for first, last in houses
+            for record in self.lookup(key, first, last)
+        }
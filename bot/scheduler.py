@@ -0,0 +1,106 @@
+import logging
+import os
+import random
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+ERROR = "error"
+
+
+def parse_windows(spec):
+    """
+    Parse "09:00-18:00=0.5,23:00-07:00=4" into
+    [(start minute, end minute, factor), ...]. A window may wrap
+    around midnight.
+    """
+    windows = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            hours, factor = item.split("=")
+            start, end = (
+                int(hour) * 60 + int(minute)
+                for hour, minute in (
+                    moment.split(":") for moment in hours.split("-")
+                )
+            )
+            windows.append((start, end, float(factor)))
+        except ValueError:
+            raise ValueError(f"Invalid polling window: {item!r}")
+    return windows
+
+
+def window_factor(windows, moment):
+    minute = moment.hour * 60 + moment.minute
+    for start, end, factor in windows:
+        inside = (
+            start <= minute < end if start <= end
+            else minute >= start or minute < end
+        )
+        if inside:
+            return factor
+    return 1.0
+
+
+class AdaptiveSchedule:
+    """
+    Delay before the next fetch of a page. Right after a change the page
+    is polled every min_interval, each unchanged fetch or error in a row
+    multiplies the base interval by backoff up to max_interval, and the
+    result is scaled by the time-of-day window it falls in and jittered.
+    """
+
+    def __init__(self, base, min_interval=None, max_interval=None,
+                 backoff=1.5, jitter=0.1, windows=(),
+                 rng=random.random, now=datetime.now):
+        self.base = base
+        self.min_interval = min_interval or base / 2
+        self.max_interval = max(max_interval or base * 4, self.min_interval)
+        self.backoff = backoff
+        self.jitter = jitter
+        self.windows = list(windows)
+        self.rng = rng
+        self.now = now
+        self.unchanged = 0
+        self.errors = 0
+        self.last_delay = None
+
+    @classmethod
+    def from_env(cls, base, min_interval=None, max_interval=None):
+        return cls(
+            base,
+            min_interval=min_interval or float(
+                os.getenv("POLL_MIN_INTERVAL") or 0
+            ),
+            max_interval=max_interval or float(
+                os.getenv("POLL_MAX_INTERVAL") or 0
+            ),
+            backoff=float(os.getenv("POLL_BACKOFF") or 1.5),
+            jitter=float(os.getenv("POLL_JITTER") or 0.1),
+            windows=parse_windows(os.getenv("POLL_WINDOWS") or ""),
+        )
+
+    def next_delay(self, outcome):
+        if outcome == CHANGED:
+            self.unchanged = 0
+            self.errors = 0
+            delay = self.min_interval
+        elif outcome == ERROR:
+            self.errors += 1
+            delay = self.base * self.backoff ** self.errors
+        else:
+            self.errors = 0
+            self.unchanged += 1
+            delay = self.base * self.backoff ** (self.unchanged - 1)
+
+        delay = min(max(delay, self.min_interval), self.max_interval)
+        delay *= window_factor(self.windows, self.now())
+        if self.jitter:
+            delay *= 1 + self.jitter * (2 * self.rng() - 1)
+        self.last_delay = delay
+        logging.debug(f"Next fetch in {delay:.1f}s after {outcome} page")
+        return delay
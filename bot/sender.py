@@ -0,0 +1,185 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from metrics import NOTIFICATIONS, SEND_SECONDS
+from requests.exceptions import RequestException
+from telebot.apihelper import ApiTelegramException
+
+
+def is_permanent(error):
+    """
+    Whether a failed send can never succeed: the user blocked the bot
+    (403) or the chat no longer exists (400 "chat not found").
+    """
+    code = getattr(error, "error_code", None)
+    description = str(getattr(error, "description", "")).lower()
+    return code == 403 or (code == 400 and "chat not found" in description)
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting the global send rate."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Stop handing out tokens, e.g. after a 429 with retry_after."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    def reserve(self):
+        """Take a token and return how long the caller has to wait first."""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class SendQueue:
+    """
+    Outbound message dispatcher: a pool of workers draining one queue under
+    a global rate limit and a minimal interval between messages to a chat.
+    on_delivered(chat_id) runs only after Telegram accepted the message,
+    on_failed(chat_id, error) after the retries are exhausted. Only rate
+    limits, network errors and server errors are retried.
+    """
+
+    def __init__(self, send, workers=4, rate=30, per_chat_interval=1.0,
+                 max_retries=3):
+        self.send = send
+        self.workers = workers
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.queue = queue.Queue()
+        self.chat_last_sent = {}
+        self.chat_lock = threading.Lock()
+        self.threads = []
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.sent_times = deque()
+        self.stats_lock = threading.Lock()
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"sender-{number}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, chat_id, text, on_delivered=None, on_failed=None):
+        self.queue.put((chat_id, text, on_delivered, on_failed))
+
+    def join(self):
+        """Block until every submitted message is delivered or failed."""
+        self.queue.join()
+
+    def stats(self):
+        with self.stats_lock:
+            horizon = time.monotonic() - 60
+            while self.sent_times and self.sent_times[0] < horizon:
+                self.sent_times.popleft()
+            return {
+                "queue_depth": self.queue.qsize(),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "throughput_per_minute": len(self.sent_times),
+            }
+
+    def _wait_for_chat(self, chat_id):
+        with self.chat_lock:
+            now = time.monotonic()
+            ready_at = max(
+                now, self.chat_last_sent.get(chat_id, 0.0)
+                + self.per_chat_interval
+            )
+            self.chat_last_sent[chat_id] = ready_at
+        if ready_at > now:
+            time.sleep(ready_at - now)
+
+    def _work(self):
+        while True:
+            chat_id, text, on_delivered, on_failed = self.queue.get()
+            try:
+                self._deliver(chat_id, text, on_delivered, on_failed)
+            except Exception as error:
+                logging.error(f"Sender callback error for {chat_id}: {error}")
+            finally:
+                self.queue.task_done()
+
+    def _deliver(self, chat_id, text, on_delivered, on_failed):
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_chat(chat_id)
+            self.bucket.acquire()
+            try:
+                with SEND_SECONDS.time():
+                    self.send(chat_id, text)
+            except ApiTelegramException as error:
+                if attempt == self.max_retries:
+                    return self._failed(chat_id, error, on_failed)
+                if error.error_code == 429:
+                    retry_after = error.result_json.get(
+                        "parameters", {}
+                    ).get("retry_after", 1)
+                    logging.warning(
+                        f"Rate limited sending to {chat_id}, "
+                        f"retrying after {retry_after}s"
+                    )
+                    self.bucket.pause(retry_after)
+                elif error.error_code >= 500:
+                    self.bucket.pause(2 ** attempt)
+                else:
+                    return self._failed(chat_id, error, on_failed)
+            except RequestException as error:
+                if attempt == self.max_retries:
+                    return self._failed(chat_id, error, on_failed)
+                self.bucket.pause(2 ** attempt)
+            except Exception as error:
+                return self._failed(chat_id, error, on_failed)
+            else:
+                with self.stats_lock:
+                    self.sent += 1
+                    self.sent_times.append(time.monotonic())
+                NOTIFICATIONS.inc(result="sent")
+                if on_delivered:
+                    on_delivered(chat_id)
+                return
+            with self.stats_lock:
+                self.retried += 1
+
+    def _failed(self, chat_id, error, on_failed):
+        if is_permanent(error):
+            logging.warning(f"User {chat_id} is unreachable: {error}")
+            NOTIFICATIONS.inc(result="blocked")
+        else:
+            logging.error(
+                f"Error sending message to user {chat_id}: {error}"
+            )
+            NOTIFICATIONS.inc(result="failed")
+        with self.stats_lock:
+            self.failed += 1
+        if on_failed:
+            on_failed(chat_id, error)
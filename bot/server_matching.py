@@ -0,0 +1,151 @@
+import csv
+import io
+import logging
+
+from matcher import NO_OUTAGES_MESSAGE
+
+MIGRATIONS = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+)
+
+CREATE_TABLES = (
+    """CREATE TEMP TABLE outage_lines (
+    position integer PRIMARY KEY,
+    first_position integer NOT NULL,
+    normalized text NOT NULL,
+    message text NOT NULL) ON COMMIT DROP;""",
+    """CREATE TEMP TABLE resolved_addresses (
+    address varchar(255) NOT NULL,
+    position integer) ON COMMIT DROP;""",
+)
+
+INDEX_LINES = (
+    """CREATE INDEX ON outage_lines
+    USING gin (normalized gin_trgm_ops);""",
+    "CREATE INDEX ON resolved_addresses(address);",
+    "ANALYZE outage_lines;",
+    "ANALYZE resolved_addresses;",
+)
+
+HOUSE_ADDRESSES_QUERY = """SELECT DISTINCT address
+FROM light_bot.addresses
+WHERE address ~ '[0-9]';"""
+
+CHANGED_MESSAGES_QUERY = """WITH matched AS (
+    SELECT a.user_id, l.first_position AS position
+    FROM light_bot.addresses a
+    JOIN outage_lines l
+        ON l.normalized LIKE
+            '%%' || replace(a.address_normalized, '_', '\\_') || '%%'
+    WHERE NOT EXISTS (
+        SELECT 1 FROM resolved_addresses r WHERE r.address = a.address
+    )
+    UNION
+    SELECT a.user_id, l.first_position
+    FROM light_bot.addresses a
+    JOIN resolved_addresses r ON r.address = a.address
+    JOIN outage_lines l ON l.position = r.position
+), rendered AS (
+    SELECT u.user_id, u.last_message_hash, coalesce(
+        string_agg(l.message, E'\\n\\n' ORDER BY l.position), %(empty)s
+    ) AS message
+    FROM light_bot.users u
+    LEFT JOIN matched m ON m.user_id = u.user_id
+    LEFT JOIN outage_lines l ON l.position = m.position
+    WHERE u.blocked_at IS NULL
+    AND (%(user_ids)s::bigint[] IS NULL OR u.user_id = ANY(%(user_ids)s))
+    AND EXISTS (
+        SELECT 1 FROM light_bot.addresses a WHERE a.user_id = u.user_id
+    )
+    GROUP BY u.user_id, u.last_message_hash
+)
+SELECT user_id, message, md5(message)
+FROM rendered
+WHERE last_message_hash IS DISTINCT FROM md5(message);"""
+
+
+def migrate(cur):
+    for statement in MIGRATIONS:
+        cur.execute(statement)
+
+
+def copy_rows(cur, table, columns, rows, nullable=()):
+    """COPY rows into table as CSV, None becoming NULL in nullable columns."""
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+    buffer.seek(0)
+    options = "FORMAT csv"
+    if nullable:
+        options += f", FORCE_NULL ({', '.join(nullable)})"
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH ({options})",
+        buffer
+    )
+
+
+def line_rows(index):
+    """
+    (position, first_position, normalized, message) of every line, where
+    first_position is the first line rendering the same message.
+    """
+    first = {}
+    rows = []
+    for position, (date, line) in enumerate(index.entries):
+        normalized = index._normalized[position]
+        first_position = first.setdefault((date, normalized), position)
+        rows.append(
+            (position, first_position, normalized, f"{date}\n\n{line}")
+        )
+    return rows
+
+
+def resolved_rows(index, addresses):
+    """
+    (address, position) of addresses resolved by house number, position
+    None when such an address matches no line.
+    """
+    rows = []
+    for address in addresses:
+        positions = index._house_positions(address)
+        if positions is None:
+            continue
+        rows.extend((address, position) for position in sorted(positions))
+        if not positions:
+            rows.append((address, None))
+    return rows
+
+
+def changed_messages_in_db(cur, index, user_ids=None):
+    """
+    changed_messages() computed by Postgres: loads the index's lines into
+    temporary tables and returns [(user_id, message, message_hash), ...]
+    for the users (all when user_ids is None) whose message changed.
+    Addresses with a house number are resolved by the index beforehand,
+    the others are matched as substrings using a trigram index.
+    """
+    for statement in CREATE_TABLES:
+        cur.execute(statement)
+    copy_rows(
+        cur, "outage_lines",
+        ("position", "first_position", "normalized", "message"),
+        line_rows(index)
+    )
+    cur.execute(HOUSE_ADDRESSES_QUERY)
+    copy_rows(
+        cur, "resolved_addresses", ("address", "position"),
+        resolved_rows(index, [address for address, in cur.fetchall()]),
+        nullable=("position",)
+    )
+    for statement in INDEX_LINES:
+        cur.execute(statement)
+
+    cur.execute(CHANGED_MESSAGES_QUERY, {
+        "empty": NO_OUTAGES_MESSAGE,
+        "user_ids": None if user_ids is None else list(user_ids),
+    })
+    changed = [
+        (user_id, message, message_hash)
+        for user_id, message, message_hash in cur.fetchall()
+    ]
+    logging.info(f"Database matching found {len(changed)} changed messages")
+    return changed
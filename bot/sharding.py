@@ -0,0 +1,183 @@
+import logging
+import os
+import socket
+import threading
+import time
+from functools import partial
+
+from broadcast import (changed_messages, group_by_signature, grouping_stats,
+                       users_affected_by)
+from db import HashBatchWriter, block_users
+from history import diff_snapshots, load_latest
+from matcher import OutageIndex
+from message_cache import MessageCache
+from metrics import NOTIFICATIONS
+from psycopg2.extras import execute_values
+from sender import SendQueue, is_permanent
+from subscriptions import SHARD_SUBSCRIPTIONS_QUERY, SubscriptionStore
+
+MAX_ATTEMPTS = 5
+
+CLAIM_JOB_QUERY = """SELECT id, snapshot_id, previous_snapshot_id,
+shard, shards
+FROM light_bot.broadcast_jobs
+WHERE finished_at IS NULL AND run_after <= now() AND attempts < %s
+ORDER BY id
+LIMIT 1
+FOR UPDATE SKIP LOCKED;"""
+
+
+def shard_of(user_id, shards):
+    """Shard of a user, the same partition SHARD_SUBSCRIPTIONS_QUERY uses."""
+    return abs(user_id) % shards
+
+
+def enqueue_broadcast(cur, snapshot_id, previous_snapshot_id, shards):
+    """
+    Publish a snapshot to the workers: one job per shard. Without a
+    previous snapshot every user of the shard is checked, otherwise only
+    users of lines that changed since it.
+    """
+    execute_values(
+        cur,
+        """INSERT INTO light_bot.broadcast_jobs
+        (snapshot_id, previous_snapshot_id, shard, shards)
+        VALUES %s;""",
+        [
+            (snapshot_id, previous_snapshot_id, shard, shards)
+            for shard in range(shards)
+        ]
+    )
+    logging.info(f"Published snapshot {snapshot_id} to {shards} shards")
+
+
+class ShardWorker:
+    """
+    Claims broadcast jobs with FOR UPDATE SKIP LOCKED and does matching,
+    sending and hash updates for the job's shard. The claiming
+    transaction stays open while the job runs, so the job of a crashed
+    worker becomes claimable again. A job with failed sends is retried
+    later; users already notified are skipped by their stored hash, and
+    users who blocked the bot are marked blocked instead of retried.
+    Messages are always rendered from the latest snapshot, so a retried
+    job never sends lines that a newer snapshot already replaced.
+    """
+
+    def __init__(self, get_cursor, send, name=None, send_workers=4,
+                 rate=30, batch_size=500, idle_sleep=5):
+        self.get_cursor = get_cursor
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.idle_sleep = idle_sleep
+        self.send_queue = SendQueue(send, workers=send_workers, rate=rate)
+        self.hash_writer = HashBatchWriter(get_cursor, batch_size=batch_size)
+        self.message_cache = MessageCache.from_env()
+        self.processed = 0
+
+    def run(self):
+        logging.info(f"Starting shard worker {self.name}")
+        self.send_queue.start()
+        while True:
+            try:
+                if self.run_once():
+                    continue
+            except Exception as error:
+                logging.error(f"Shard worker error: {error}")
+            time.sleep(self.idle_sleep)
+
+    def run_once(self):
+        """Process one job, return False when there was none to claim."""
+        with self.get_cursor() as cur:
+            cur.execute(CLAIM_JOB_QUERY, (MAX_ATTEMPTS,))
+            job = cur.fetchone()
+            if job is None:
+                return False
+
+            job_id, snapshot_id, previous_id, shard, shards = job
+            sent, failed = self.process(
+                cur, snapshot_id, previous_id, shard, shards
+            )
+            if failed:
+                cur.execute(
+                    """UPDATE light_bot.broadcast_jobs
+                    SET attempts = attempts + 1,
+                    run_after = now() + interval '1 minute' * (attempts + 1),
+                    worker = %s
+                    WHERE id = %s;""",
+                    (self.name, job_id)
+                )
+            else:
+                cur.execute(
+                    """UPDATE light_bot.broadcast_jobs
+                    SET finished_at = now(), worker = %s, messages = %s
+                    WHERE id = %s;""",
+                    (self.name, sent, job_id)
+                )
+        self.processed += 1
+        logging.info(
+            f"Job {job_id}: shard {shard}/{shards} of snapshot "
+            f"{snapshot_id}, {sent} sent, {failed} failed"
+        )
+        return True
+
+    def process(self, cur, snapshot_id, previous_id, shard, shards):
+        """
+        Notify the shard's users about a snapshot, return (sent, failed).
+        When newer snapshots were stored since, the users affected by any
+        change up to the latest one are checked against the latest one.
+        """
+        latest_id, fingerprint, outages = load_latest(cur)
+        if latest_id != snapshot_id:
+            logging.info(
+                f"Snapshot {snapshot_id} was superseded, "
+                f"rendering snapshot {latest_id}"
+            )
+        subscriptions = SubscriptionStore()
+        subscriptions.load(
+            cur, SHARD_SUBSCRIPTIONS_QUERY, {"shard": shard, "shards": shards}
+        )
+        user_data = subscriptions.active()
+        if previous_id is not None:
+            affected = users_affected_by(
+                user_data, diff_snapshots(cur, previous_id, latest_id)
+            )
+            user_data = {
+                user_id: data for user_id, data in user_data.items()
+                if user_id in affected
+            }
+
+        index = OutageIndex(outages, version=fingerprint)
+        groups = group_by_signature(user_data)
+        changed = list(
+            changed_messages(index, user_data, self.message_cache, groups)
+        )
+        logging.info(f"Shard {shard}/{shards} groups {grouping_stats(groups)}")
+        NOTIFICATIONS.inc(len(user_data) - len(changed), result="skipped")
+
+        result = {"sent": 0, "failed": 0}
+        blocked = []
+        lock = threading.Lock()
+
+        def delivered(user_id, message_hash):
+            with lock:
+                result["sent"] += 1
+            self.hash_writer.add(user_id, message_hash)
+
+        def failed(user_id, error):
+            with lock:
+                if is_permanent(error):
+                    blocked.append(user_id)
+                else:
+                    result["failed"] += 1
+
+        for user_id, message, message_hash in changed:
+            self.send_queue.submit(
+                user_id,
+                message,
+                on_delivered=partial(delivered, message_hash=message_hash),
+                on_failed=failed
+            )
+        self.send_queue.join()
+        self.hash_writer.flush()
+        if blocked:
+            block_users(cur, blocked)
+        return result["sent"], result["failed"]
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import logging
+import os
+
+from normalization import OutageLine
+
+
+def outages_fingerprint(outages):
+    """Return a stable hash of the parsed page."""
+    payload = json.dumps(outages, ensure_ascii=False)
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def diff_outages(old, new):
+    """
+    Compares two parses date section by date section and returns dict:
+    { "Date 1": {"added": [...], "removed": [...]}, ...}
+    Only sections with changes are included.
+    """
+    diff = {}
+    for date in {**old, **new}:
+        old_lines = old.get(date, [])
+        new_lines = new.get(date, [])
+        if old_lines == new_lines:
+            continue
+
+        old_set = set(old_lines)
+        new_set = set(new_lines)
+        added = [line for line in new_lines if line not in old_set]
+        removed = [line for line in old_lines if line not in new_set]
+        if added or removed:
+            diff[date] = {"added": added, "removed": removed}
+    return diff
+
+
+def changed_lines(diff):
+    """
+    Flattens a diff into an outages-like dict of every added or removed line:
+    { "Date 1": ["Addresses 1", ...], ...}
+    """
+    return {
+        date: section["added"] + section["removed"]
+        for date, section in diff.items()
+    }
+
+
+def write_snapshot_file(path, outages, fingerprint):
+    """Atomically replace the on-disk copy of the latest parse."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(
+            {"fingerprint": fingerprint, "outages": outages},
+            file,
+            ensure_ascii=False
+        )
+    os.replace(temp_path, path)
+
+
+def read_snapshot_file(path):
+    """Return (fingerprint, outages) from disk, None if unavailable."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        outages = {
+            date: [OutageLine(line) for line in lines]
+            for date, lines in data["outages"].items()
+        }
+        return data["fingerprint"], outages
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, AttributeError) as error:
+        logging.error(f"Error reading outages snapshot {path}: {error}")
+        return None
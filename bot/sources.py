@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from parser import Parser, pooled_session
+
+from dotenv import load_dotenv
+from metrics import FETCH_INTERVAL, FETCH_OUTCOMES
+from scheduler import CHANGED, ERROR, UNCHANGED, AdaptiveSchedule
+from snapshot import outages_fingerprint
+
+load_dotenv()
+
+
+@dataclass
+class Source:
+    """
+    One outages page. title prefixes its date sections once several
+    sources are merged, engine is the Parser engine used for it and
+    interval the base of its AdaptiveSchedule.
+    """
+    name: str
+    url: str
+    title: str = ""
+    engine: str | None = None
+    interval: float = 60
+    min_interval: float | None = None
+    max_interval: float | None = None
+    headers: dict | None = field(default=None, repr=False)
+
+
+def load_sources():
+    """
+    Sources from the SOURCES variable, a JSON list of Source fields:
+    [{"name": "water", "url": "https://...", "title": "Вода",
+      "interval": 300}, ...]
+    Without it the single URL page is the only source, as before.
+    """
+    interval = int(os.getenv("RETRY_PERIOD") or 60)
+    raw = os.getenv("SOURCES")
+    if not raw:
+        return [Source("power", os.getenv("URL"), interval=interval)]
+
+    sources = []
+    for entry in json.loads(raw):
+        entry.setdefault("interval", interval)
+        sources.append(Source(**entry))
+    names = [source.name for source in sources]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate source names in SOURCES: {names}")
+    return sources
+
+
+def merge_outages(results, sources):
+    """
+    Combine {source name: outages} into one outages dict in source order,
+    prefixing date sections with the source title when it has one.
+    """
+    merged = {}
+    for source in sources:
+        outages = results.get(source.name)
+        if not outages:
+            continue
+        for date, lines in outages.items():
+            key = f"{source.title}. {date}" if source.title else date
+            merged.setdefault(key, []).extend(lines)
+    return merged
+
+
+class SourceRegistry:
+    """
+    Fetches every source on its own AdaptiveSchedule. Fetches run
+    concurrently on a thread pool sharing one HTTP connection pool; a
+    fetch still running when poll() gives up is collected by a later
+    poll, so a slow source never holds back the others. The last good
+    result of each source is kept until it fetches successfully again.
+    """
+
+    def __init__(self, sources, workers=None, clock=time.monotonic):
+        self.sources = list(sources)
+        self.clock = clock
+        workers = workers or len(self.sources)
+        session = pooled_session(pool_maxsize=max(4, workers))
+        self.parsers = {
+            source.name: Parser(
+                engine=source.engine,
+                url=source.url,
+                headers=source.headers,
+                session=session
+            )
+            for source in self.sources
+        }
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="fetch"
+        )
+        self.schedules = {
+            source.name: AdaptiveSchedule.from_env(
+                source.interval, source.min_interval, source.max_interval
+            )
+            for source in self.sources
+        }
+        self.next_run = {source.name: 0.0 for source in self.sources}
+        self.fingerprints = {}
+        self.running = {}
+        self.tasks = {}
+        self.results = {}
+
+    def due(self):
+        now = self.clock()
+        return [
+            source for source in self.sources
+            if self.next_run[source.name] <= now
+            and source.name not in self.running
+            and source.name not in self.tasks
+        ]
+
+    def seconds_until_due(self):
+        """Seconds until a source that is not being fetched becomes due."""
+        now = self.clock()
+        waiting = [
+            self.next_run[source.name] - now for source in self.sources
+            if source.name not in self.running
+            and source.name not in self.tasks
+        ]
+        return max(0.0, min(waiting, default=0.0))
+
+    def _collect(self, name, outages):
+        if outages is None:
+            outcome = ERROR
+            logging.warning(f"Source {name} failed, keeping its last result")
+        else:
+            fingerprint = outages_fingerprint(outages)
+            previous = self.fingerprints.get(name)
+            outcome = (
+                CHANGED if previous is not None and fingerprint != previous
+                else UNCHANGED
+            )
+            self.fingerprints[name] = fingerprint
+            if outages:
+                self.results[name] = outages
+
+        delay = self.schedules[name].next_delay(outcome)
+        self.next_run[name] = self.clock() + delay
+        FETCH_OUTCOMES.inc(source=name, outcome=outcome)
+        FETCH_INTERVAL.set(delay, source=name)
+        logging.info(f"Source {name} {outcome}, next fetch in {delay:.1f}s")
+
+    def poll(self, timeout=None):
+        """
+        Start fetches of the due sources, wait up to timeout for running
+        ones and return the merged outages of every source.
+        """
+        for source in self.due():
+            self.running[source.name] = self.executor.submit(
+                self.parsers[source.name].parse_website
+            )
+
+        done, _ = wait(self.running.values(), timeout=timeout)
+        for name, future in list(self.running.items()):
+            if future not in done:
+                continue
+            del self.running[name]
+            try:
+                outages = future.result()
+            except Exception as error:
+                logging.error(f"Error fetching source {name}: {error}")
+                outages = None
+            self._collect(name, outages)
+        return self.outages()
+
+    async def poll_async(self, session, timeout=None):
+        """poll() for the asyncio runtime, fetching through aiohttp."""
+        for source in self.due():
+            self.tasks[source.name] = asyncio.create_task(
+                self.parsers[source.name].parse_website_async(session)
+            )
+
+        if self.tasks:
+            await asyncio.wait(self.tasks.values(), timeout=timeout)
+        for name, task in list(self.tasks.items()):
+            if not task.done():
+                continue
+            del self.tasks[name]
+            try:
+                outages = task.result()
+            except Exception as error:
+                logging.error(f"Error fetching source {name}: {error}")
+                outages = None
+            self._collect(name, outages)
+        return self.outages()
+
+    def outages(self):
+        return merge_outages(self.results, self.sources)
+
+    def stats(self):
+        return {
+            name: parser.stats.as_dict()
+            for name, parser in self.parsers.items()
+        }
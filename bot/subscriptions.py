@@ -0,0 +1,138 @@
+import logging
+import threading
+
+SUBSCRIPTIONS_QUERY = """SELECT u.user_id, u.last_message_hash,
+u.blocked_at IS NOT NULL, a.address
+FROM light_bot.users u
+LEFT JOIN light_bot.addresses a ON u.user_id = a.user_id
+ORDER BY a.id;"""
+
+SHARD_SUBSCRIPTIONS_QUERY = """SELECT u.user_id, u.last_message_hash,
+u.blocked_at IS NOT NULL, a.address
+FROM light_bot.users u
+LEFT JOIN light_bot.addresses a ON u.user_id = a.user_id
+WHERE mod(abs(u.user_id), %(shards)s) = %(shard)s
+ORDER BY a.id;"""
+
+
+class SubscriptionStore:
+    """
+    Process-local copy of light_bot.users and light_bot.addresses.
+    Handlers update it in place after their writes are committed, and
+    load() periodically reloads it from the database. Changes made
+    while a reload is running are replayed on top of the loaded state.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.addresses = {}
+        self.hashes = {}
+        self.blocked = set()
+        self.journal = None
+
+    def load(self, cur, query=SUBSCRIPTIONS_QUERY, params=None):
+        self.begin_load()
+        try:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        except Exception:
+            self.abort_load()
+            raise
+        self.finish_load(rows)
+
+    def begin_load(self):
+        """Start journaling changes made while the rows are fetched."""
+        with self.lock:
+            self.journal = []
+
+    def abort_load(self):
+        with self.lock:
+            self.journal = None
+
+    def finish_load(self, rows):
+        addresses = {}
+        hashes = {}
+        blocked = set()
+        for user_id, last_msg_hash, is_blocked, address in rows:
+            user_addresses = addresses.setdefault(user_id, [])
+            hashes[user_id] = last_msg_hash
+            if is_blocked:
+                blocked.add(user_id)
+            if address is not None:
+                user_addresses.append(address)
+
+        with self.lock:
+            journal, self.journal = self.journal or [], None
+            changed = (
+                addresses != self.addresses or blocked != self.blocked
+            )
+            self.addresses = addresses
+            self.hashes = hashes
+            self.blocked = blocked
+            for method, args in journal:
+                method(*args)
+        logging.info(
+            f"Loaded {len(rows)} subscription rows"
+            f"{' with changes' if changed else ''}"
+        )
+
+    def _record(self, method, *args):
+        if self.journal is not None:
+            self.journal.append((method, args))
+
+    def add_user(self, user_id):
+        with self.lock:
+            self._record(self.add_user, user_id)
+            self.addresses.setdefault(user_id, [])
+            self.hashes.setdefault(user_id, None)
+
+    def add(self, user_id, address):
+        with self.lock:
+            self._record(self.add, user_id, address)
+            user_addresses = self.addresses.setdefault(user_id, [])
+            self.hashes.setdefault(user_id, None)
+            if address not in user_addresses:
+                user_addresses.append(address)
+
+    def remove(self, user_id, address):
+        with self.lock:
+            self._record(self.remove, user_id, address)
+            user_addresses = self.addresses.get(user_id, [])
+            if address in user_addresses:
+                user_addresses.remove(address)
+
+    def set_blocked(self, user_id, blocked):
+        with self.lock:
+            self._record(self.set_blocked, user_id, blocked)
+            if blocked:
+                self.blocked.add(user_id)
+            else:
+                self.blocked.discard(user_id)
+
+    def set_hash(self, user_id, message_hash):
+        with self.lock:
+            self._record(self.set_hash, user_id, message_hash)
+            self.hashes[user_id] = message_hash
+
+    def get_addresses(self, user_id):
+        with self.lock:
+            return list(self.addresses.get(user_id, []))
+
+    def get_hash(self, user_id):
+        with self.lock:
+            return self.hashes.get(user_id)
+
+    def active(self):
+        """
+        Returns subscriptions of users who have not blocked the bot:
+        { user_id: {"last_msg_hash": "...", "addresses": [...]}, ...}
+        """
+        with self.lock:
+            return {
+                user_id: {
+                    "last_msg_hash": self.hashes.get(user_id),
+                    "addresses": list(addresses),
+                }
+                for user_id, addresses in self.addresses.items()
+                if addresses and user_id not in self.blocked
+            }
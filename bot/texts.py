@@ -0,0 +1,48 @@
+INFO_MESSAGE = (
+    "После добавления адреса бот будет работать в фоновом режиме "
+    "и отправит вам сообщение, если по вашему адресу будет "
+    "запланировано отключение.\n\n"
+
+    "Рекомендации:\n"
+    "- при добавлении или проверке адреса указывайте его "
+    "без дополнительных слов и номера дома. "
+    "Например: /add Тиграняна\n"
+    "- при добавлении села или другого "
+    "небольшого населенного пункта указывайте "
+    "только название этого населенного пункта. "
+    "Например: /add Шенаван\n\n"
+
+    "Доступные команды:\n"
+    "/add - добавить адрес. В формате: /add Тиграняна\n"
+    "/delete - удалить адрес.  В формате: /delete Тиграняна\n"
+    "/check - проверить адрес. В формате: /check Тиграняна\n"
+    "/show - показать ваши добавленные адреса\n"
+    "/my - проверить отключения по вашим адресам\n"
+    "/info - информация об этом боте"
+)
+ERROR_MESSAGE = "Ошибка. Попробуйте снова"
+NO_DATA_MESSAGE = "Данные об отключениях недоступны, попробуйте позже"
+ADD_USAGE_MESSAGE = "Укажите адрес, например: /add Бабаяна"
+DELETE_USAGE_MESSAGE = "Укажите адрес, например: /delete Бабаяна"
+CHECK_USAGE_MESSAGE = "Добавьте адрес вместе с командой"
+NOT_ADDED_MESSAGE = "Этот адрес не был вами добавлен"
+NO_ADDRESSES_MESSAGE = "Вы не добавили ни один адрес"
+HELP_MESSAGE = "Список доступных команд: /info"
+
+
+def address_exists_message(address):
+    return f"Адрес {address} уже добавлен"
+
+
+def address_added_message(address):
+    return f"Добавлен адрес: {address}"
+
+
+def address_deleted_message(address):
+    return f"Удален адрес: {address}"
+
+
+def addresses_message(addresses):
+    if not addresses:
+        return NO_ADDRESSES_MESSAGE
+    return "Добавленные адреса:\n\n" + "\n".join(addresses)
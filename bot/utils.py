@@ -1,13 +1,12 @@
 import hashlib
 import logging
 import os
-import sys
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-RETRY_PERIOD = int(os.getenv("RETRY_PERIOD"))
+RETRY_PERIOD = int(os.getenv("RETRY_PERIOD") or 0)
 
 DB_NAME = os.getenv("POSTGRES_DB")
 DB_HOST = os.getenv("DB_HOST")
@@ -15,12 +14,6 @@ DB_USER = os.getenv("POSTGRES_USER")
 DB_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 TOKEN = os.getenv("TOKEN_PROD")
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
-    stream=sys.stdout
-)
-
 
 def check_env_vars():
     """Check environment variables existence."""
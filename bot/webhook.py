@@ -0,0 +1,96 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot.types import Update
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class WebhookServer:
+    """
+    HTTP endpoint receiving Telegram updates. Each update is handed to
+    process_update(update) in the request thread, which only queues it
+    for the handlers; when it raises queue.Full the server answers 503
+    and Telegram retries the delivery later.
+    """
+
+    def __init__(self, process_update, host="0.0.0.0", port=8443, path="/",
+                 secret_token=None):
+        self.process_update = process_update
+        self.path = path
+        self.secret_token = secret_token
+        self.threads = []
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                self.send_response(server.accept(
+                    self.path, self.headers, self._read_body()
+                ))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > MAX_BODY_SIZE:
+                    return None
+                return self.rfile.read(length)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Webhook: {format % args}")
+
+        return Handler
+
+    def accept(self, path, headers, body):
+        """Validate one request and queue its update, return HTTP status."""
+        if path != self.path:
+            return 404
+        if self.secret_token and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, "").encode(),
+            self.secret_token.encode()
+        ):
+            logging.warning("Webhook request with invalid secret token")
+            return 403
+        if body is None:
+            return 413
+        try:
+            update = Update.de_json(json.loads(body))
+        except (ValueError, KeyError, TypeError) as error:
+            logging.warning(f"Invalid webhook update: {error}")
+            return 400
+        try:
+            self.process_update(update)
+        except queue.Full:
+            logging.warning("Handler queue is full, rejecting update")
+            return 503
+        except Exception as error:
+            logging.error(f"Error processing update: {error}")
+            return 500
+        return 200
+
+    def start(self):
+        """Serve requests in a background thread."""
+        thread = threading.Thread(
+            target=self.httpd.serve_forever, name="webhook-http", daemon=True
+        )
+        thread.start()
+        self.threads.append(thread)
+
+    def stop(self):
+        if self.threads:
+            self.httpd.shutdown()
+        self.httpd.server_close()
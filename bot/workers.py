@@ -0,0 +1,96 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+
+class KeyedDispatcher:
+    """
+    Fixed-size thread pool that runs tasks of different keys concurrently
+    and tasks of the same key one at a time, in submission order. With
+    max_depth, submit() waits while that many tasks are queued, or raises
+    queue.Full when called with block=False.
+    """
+
+    def __init__(self, workers=8, name="handler", max_depth=None):
+        self.workers = workers
+        self.name = name
+        self.max_depth = max_depth
+        self.ready = queue.Queue()
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        self.threads = []
+
+        self.queued = 0
+        self.processed = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_wait = 0.0
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"{self.name}-{number}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, key, func, *args, block=True):
+        with self.not_full:
+            while self.max_depth and self.queued >= self.max_depth:
+                if not block:
+                    raise queue.Full
+                self.not_full.wait()
+            self.queued += 1
+            tasks = self.tasks.get(key)
+            if tasks is not None:
+                tasks.append((func, args, time.monotonic()))
+                return
+            self.tasks[key] = deque([(func, args, time.monotonic())])
+        self.ready.put(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queue_depth": self.queued,
+                "busy_keys": len(self.tasks),
+                "processed": self.processed,
+                "avg_wait": (
+                    self.total_wait / self.processed if self.processed else 0.0
+                ),
+                "max_wait": self.max_wait,
+                "avg_run": (
+                    self.total_run / self.processed if self.processed else 0.0
+                ),
+            }
+
+    def _work(self):
+        while True:
+            key = self.ready.get()
+            with self.lock:
+                func, args, submitted = self.tasks[key][0]
+                self.queued -= 1
+                self.not_full.notify()
+
+            started = time.monotonic()
+            try:
+                func(*args)
+            except Exception as error:
+                logging.error(f"Error in {self.name} task for {key}: {error}")
+            finished = time.monotonic()
+
+            with self.lock:
+                tasks = self.tasks[key]
+                tasks.popleft()
+                has_more = bool(tasks)
+                if not has_more:
+                    del self.tasks[key]
+                wait = started - submitted
+                self.processed += 1
+                self.total_wait += wait
+                self.total_run += finished - started
+                self.max_wait = max(self.max_wait, wait)
+            if has_more:
+                self.ready.put(key)
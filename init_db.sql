@@ -1,5 +1,7 @@
 CREATE SCHEMA IF NOT EXISTS light_bot;
 
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 CREATE TABLE light_bot.users (
     id integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
     user_id bigint NOT NULL CONSTRAINT user_id_unique UNIQUE,
@@ -13,8 +15,76 @@ CREATE TABLE light_bot.addresses (
     id integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
     user_id bigint NOT NULL REFERENCES light_bot.users(user_id) ON DELETE CASCADE,
     address varchar(255) NOT NULL,
+    address_normalized varchar(255),
     created_at timestamptz DEFAULT now() NOT NULL,
     UNIQUE (user_id, address)
 );
 
-CREATE INDEX IF NOT EXISTS idx_addresses_user_id ON light_bot.addresses(user_id);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_addresses_user_id ON light_bot.addresses(user_id);
+
+CREATE INDEX IF NOT EXISTS idx_addresses_normalized
+    ON light_bot.addresses(user_id, address_normalized);
+
+CREATE TABLE light_bot.outage_snapshots (
+    id integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    fingerprint char(32) NOT NULL,
+    created_at timestamptz DEFAULT now() NOT NULL
+);
+
+CREATE TABLE light_bot.outages (
+    id integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    outage_date varchar(255) NOT NULL,
+    line text NOT NULL,
+    position integer NOT NULL,
+    first_snapshot_id integer NOT NULL
+        REFERENCES light_bot.outage_snapshots(id) ON DELETE CASCADE,
+    removed_snapshot_id integer
+        REFERENCES light_bot.outage_snapshots(id) ON DELETE SET NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_outages_current
+    ON light_bot.outages(outage_date, line)
+    WHERE removed_snapshot_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_outages_snapshots
+    ON light_bot.outages(first_snapshot_id, removed_snapshot_id);
+
+CREATE TABLE light_bot.broadcast_jobs (
+    id integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    snapshot_id integer NOT NULL
+        REFERENCES light_bot.outage_snapshots(id) ON DELETE CASCADE,
+    previous_snapshot_id integer
+        REFERENCES light_bot.outage_snapshots(id) ON DELETE SET NULL,
+    shard integer NOT NULL,
+    shards integer NOT NULL,
+    attempts integer DEFAULT 0 NOT NULL,
+    run_after timestamptz DEFAULT now() NOT NULL,
+    created_at timestamptz DEFAULT now() NOT NULL,
+    finished_at timestamptz,
+    worker varchar(255),
+    messages integer
+);
+
+CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_pending
+    ON light_bot.broadcast_jobs(id)
+    WHERE finished_at IS NULL;
+
+CREATE TABLE light_bot.outbox (
+    id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    user_id bigint NOT NULL
+        REFERENCES light_bot.users(user_id) ON DELETE CASCADE,
+    message text NOT NULL,
+    message_hash char(32) NOT NULL,
+    attempts integer DEFAULT 0 NOT NULL,
+    next_attempt_at timestamptz DEFAULT now() NOT NULL,
+    created_at timestamptz DEFAULT now() NOT NULL,
+    delivered_at timestamptz
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_pending_user
+    ON light_bot.outbox(user_id)
+    WHERE delivered_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_outbox_pending
+    ON light_bot.outbox(id)
+    WHERE delivered_at IS NULL;
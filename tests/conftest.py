@@ -1,8 +1,79 @@
+import os
+import sys
+from contextlib import nullcontext
+
 import pytest
 
+BOT_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot"
+)
+sys.path.insert(0, BOT_DIR)
+os.environ.setdefault("RETRY_PERIOD", "60")
+
 MOCK_URL = "https://test.com/"
 
 
 @pytest.fixture(autouse=True)
 def set_test_env_vars(monkeypatch):
     monkeypatch.setenv("URL", MOCK_URL)
+
+
+class FakeCursor:
+    """
+    Cursor recording executed queries and COPY input; fetchone() and
+    fetchall() return the queued results in order.
+    """
+
+    def __init__(self, results=(), on_execute=None):
+        self.results = list(results)
+        self.on_execute = on_execute
+        self.queries = []
+        self.copies = []
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+        if self.on_execute:
+            self.on_execute()
+
+    def copy_expert(self, sql, file):
+        self.copies.append((sql, file.read()))
+
+    def fetchone(self):
+        return self.results.pop(0)
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def fake_cursor():
+    return FakeCursor
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def start_sender():
+    """
+    Build an outbox sender or shard worker reading from cur, with its
+    SendQueue started without the per-chat delay between messages.
+    """
+    def start(sender_class, cur, send, **kwargs):
+        sender = sender_class(lambda: nullcontext(cur), send, **kwargs)
+        sender.send_queue.per_chat_interval = 0
+        sender.send_queue.start()
+        return sender
+    return start
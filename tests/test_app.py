@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+
+import pytest
+
+from bot import bot as app
+from bot.snapshot import outages_fingerprint, write_snapshot_file
+
+OUTAGES = {"27 декабря текущего года:": ["дома 2-22 по ул. Бабаяна"]}
+
+
+@pytest.fixture(autouse=True)
+def reset_cache():
+    yield
+    app.set_cached_outages({})
+    app.ready.clear()
+
+
+def test_import_does_not_connect():
+    assert not app.db_pool.opened
+    assert app.bot is None
+
+
+@contextmanager
+def broken_cursor():
+    raise Exception("database is down")
+    yield
+
+
+def test_warm_outages_falls_back_to_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "outages.json")
+    write_snapshot_file(path, OUTAGES, outages_fingerprint(OUTAGES))
+    monkeypatch.setattr(app, "SNAPSHOT_PATH", path)
+    monkeypatch.setattr(app, "get_db_cursor", broken_cursor)
+
+    assert app.warm_outages() is None
+    assert app.ready.is_set()
+    assert app.cached_outages == OUTAGES
+    assert app.cached_index.find("Бабаяна") == (0,)
+
+
+def test_warm_outages_without_snapshot(monkeypatch):
+    monkeypatch.setattr(app, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(app, "get_db_cursor", broken_cursor)
+
+    assert app.warm_outages() is None
+    assert not app.ready.is_set()
+
+
+def test_async_runtime_refuses_unsupported_modes(monkeypatch):
+    assert app.async_unsupported() == []
+
+    monkeypatch.setattr(app, "DELIVERY", "outbox")
+    monkeypatch.setattr(app, "METRICS_PORT", 9100)
+
+    assert app.async_unsupported() == ["DELIVERY", "METRICS_PORT"]
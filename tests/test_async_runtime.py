@@ -0,0 +1,198 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telebot.asyncio_helper import ApiTelegramException, RequestTimeout
+
+from bot import async_runtime
+from bot.async_runtime import AsyncRuntime, statement
+
+DATE = "27 декабря текущего года:"
+OUTAGES = {DATE: ["улице Тиграняна"]}
+
+
+class FakeBot:
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        error = self.errors.get(chat_id)
+        if error is not None:
+            raise error
+        self.sent.append((chat_id, text))
+
+
+class FakeConnection:
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def transaction(self):
+        return self.pool
+
+    async def fetchval(self, query, *args):
+        self.pool.queries.append((query, args))
+        return self.pool.results.pop(0)
+
+    async def execute(self, query, *args):
+        self.pool.queries.append((query, args))
+
+
+class FakePool:
+    """asyncpg pool recording queries, answering fetches from results."""
+
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.queries = []
+
+    async def __aenter__(self):
+        return FakeConnection(self)
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def acquire(self):
+        return self
+
+    async def execute(self, query, *args):
+        self.queries.append((query, args))
+
+    async def fetch(self, query, *args):
+        self.queries.append((query, args))
+        return self.results.pop(0)
+
+
+def message(text, chat_id=1):
+    return SimpleNamespace(
+        chat=SimpleNamespace(id=chat_id),
+        from_user=SimpleNamespace(username="user"),
+        text=text
+    )
+
+
+@pytest.fixture
+def runtime(mocker):
+    runtime = AsyncRuntime("1:token", None)
+    runtime.bot = FakeBot()
+    runtime.db_pool = FakePool()
+    runtime.bucket.pause = lambda seconds: None
+    runtime.in_transaction = mocker.AsyncMock()
+    return runtime
+
+
+def test_deliver_gives_up_after_request_timeouts(runtime):
+    runtime.bot.errors[1] = RequestTimeout("Request timeout")
+
+    assert asyncio.run(runtime.deliver(1, "text")) is False
+
+
+def test_broadcast_saves_hashes_of_sent_messages_despite_failures(runtime):
+    runtime.bot.errors[2] = RequestTimeout("Request timeout")
+    runtime.bot.errors[3] = ApiTelegramException("sendMessage", None, {
+        "error_code": 403, "description": "Forbidden: bot was blocked",
+    })
+
+    delivered = asyncio.run(runtime.broadcast([
+        (1, "first", "a" * 32),
+        (2, "second", "b" * 32),
+        (3, "third", "c" * 32),
+    ]))
+
+    assert delivered == [(1, "a" * 32)]
+    assert runtime.subscriptions.get_hash(1) == "a" * 32
+    assert runtime.pending_users == {2}
+    assert 3 in runtime.subscriptions.blocked
+
+
+def test_add_stores_a_new_address(runtime):
+    runtime.db_pool.results = [False]
+
+    asyncio.run(runtime.add(message("/add Бабаяна 10")))
+
+    assert runtime.db_pool.queries[-1] == (
+        statement("add_address"), (1, "Бабаяна 10", "бабаяна 10")
+    )
+    assert runtime.subscriptions.get_addresses(1) == ["Бабаяна 10"]
+    assert runtime.pending_users == {1}
+    assert runtime.bot.sent == [(1, "Добавлен адрес: Бабаяна 10")]
+
+
+def test_add_reports_an_existing_address(runtime):
+    runtime.db_pool.results = [True]
+
+    asyncio.run(runtime.add(message("/add Бабаяна 10")))
+
+    assert len(runtime.db_pool.queries) == 1
+    assert runtime.pending_users == set()
+    assert runtime.bot.sent == [(1, "Адрес Бабаяна 10 уже добавлен")]
+
+
+def test_delete_removes_stored_addresses(runtime):
+    runtime.subscriptions.add(1, "ул. Бабаяна")
+    runtime.db_pool.results = [[{"address": "ул. Бабаяна"}]]
+
+    asyncio.run(runtime.delete(message("/delete Бабаяна")))
+
+    assert runtime.db_pool.queries[0][1] == (1, "бабаяна")
+    assert runtime.subscriptions.get_addresses(1) == []
+    assert runtime.pending_users == {1}
+
+
+def test_handlers_of_one_chat_run_in_order(runtime):
+    order = []
+
+    async def handler(update):
+        order.append(("start", update.text))
+        await asyncio.sleep(0)
+        order.append(("end", update.text))
+
+    async def run():
+        ordered = runtime.in_order(handler)
+        await asyncio.gather(ordered(message("a")), ordered(message("b")))
+
+    asyncio.run(run())
+
+    assert order == [("start", "a"), ("end", "a"), ("start", "b"),
+                     ("end", "b")]
+
+
+def test_save_hashes_uses_shared_helper(runtime):
+    asyncio.run(runtime.save_hashes([(1, "a" * 32)]))
+
+    runtime.in_transaction.assert_awaited_once_with(
+        async_runtime.update_message_hashes, [(1, "a" * 32)],
+        async_runtime.HASH_BATCH_SIZE
+    )
+    assert runtime.subscriptions.get_hash(1) == "a" * 32
+
+
+def test_background_job_notifies_and_stores_hashes(runtime, mocker):
+    class Sources:
+
+        async def poll_async(self, session, timeout=None):
+            return OUTAGES
+
+        def stats(self):
+            return {}
+
+        def seconds_until_due(self):
+            return 0
+
+    mocker.patch.object(async_runtime, "load_sources")
+    mocker.patch.object(
+        async_runtime, "SourceRegistry", return_value=Sources()
+    )
+    mocker.patch.object(
+        async_runtime.asyncio, "sleep", side_effect=asyncio.CancelledError
+    )
+    runtime.subscriptions.add(1, "Тиграняна")
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(runtime.background_job())
+
+    assert runtime.bot.sent == [(1, f"{DATE}\n\nулице Тиграняна")]
+    saved = runtime.in_transaction.await_args_list[-1].args
+    assert saved[0] is async_runtime.update_message_hashes
+    assert [user_id for user_id, _ in saved[1]] == [1]
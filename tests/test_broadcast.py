@@ -0,0 +1,52 @@
+from bot.broadcast import (changed_messages, group_by_signature, grouping_stats,
+                           rendered_messages)
+from bot.matcher import OutageIndex
+from bot.utils import generate_last_message_hash
+
+DATE = "27 декабря текущего года:"
+OUTAGES = {DATE: ["дома 2-22 по ул. Бабаяна", "улице Тиграняна"]}
+
+
+def user(*addresses, last_msg_hash=None):
+    return {"addresses": list(addresses), "last_msg_hash": last_msg_hash}
+
+
+def test_group_by_signature_ignores_order_and_spelling():
+    groups = group_by_signature({
+        1: user("Бабаяна 10", "Тиграняна"),
+        2: user("ул. Тиграняна", "бабаяна, д. 10"),
+        3: user("Шенаван"),
+    })
+
+    assert sorted(groups.values()) == [[1, 2], [3]]
+    assert grouping_stats(groups) == {
+        "users": 3, "groups": 2, "collapsed": 1, "largest": 2
+    }
+
+
+def test_changed_messages_renders_group_once_and_skips_current_users(mocker):
+    index = OutageIndex(OUTAGES)
+    render = mocker.spy(index, "render")
+    message = f"{DATE}\n\nулице Тиграняна"
+    current = generate_last_message_hash(message)
+
+    changed = list(changed_messages(index, {
+        1: user("Тиграняна"),
+        2: user("улица Тиграняна", last_msg_hash=current),
+        3: user("Тиграняна"),
+    }))
+
+    assert changed == [(1, message, current), (3, message, current)]
+    assert render.call_count == 1
+
+
+def test_rendered_messages_ignore_stored_hashes():
+    index = OutageIndex(OUTAGES)
+    message = f"{DATE}\n\nулице Тиграняна"
+    current = generate_last_message_hash(message)
+
+    rendered = list(rendered_messages(index, {
+        1: user("Тиграняна", last_msg_hash=current),
+    }))
+
+    assert rendered == [(1, message, current)]
@@ -0,0 +1,155 @@
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+
+from bot.db import HashBatchWriter, LazyPool, PoolTimeout, execute_prepared
+
+
+@contextmanager
+def null_cursor():
+    yield object()
+
+
+def test_hash_writer_flushes_full_batches(mocker):
+    update = mocker.patch("bot.db.update_message_hashes")
+    writer = HashBatchWriter(null_cursor, batch_size=2)
+
+    writer.add(1, "a" * 32)
+    assert not update.called
+
+    writer.add(2, "b" * 32)
+    update.assert_called_once()
+    assert update.call_args.args[1] == [(1, "a" * 32), (2, "b" * 32)]
+    assert writer.flushed == 2
+
+
+def test_hash_writer_keeps_rows_of_failed_flush(mocker):
+    update = mocker.patch(
+        "bot.db.update_message_hashes", side_effect=[Exception("down"), None]
+    )
+    writer = HashBatchWriter(null_cursor, batch_size=10)
+
+    writer.add(1, "a" * 32)
+    writer.flush()
+    assert writer.flushed == 0
+
+    writer.add(2, "b" * 32)
+    writer.flush()
+    assert update.call_args.args[1] == [(1, "a" * 32), (2, "b" * 32)]
+    assert writer.flushed == 2
+
+
+class FakeConnection:
+
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.closed = 0
+        self.executed = []
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, query, params=None):
+                if not connection.alive:
+                    raise psycopg2.OperationalError("server closed")
+                connection.executed.append((query, params))
+
+        return Cursor()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def test_pool_reuses_idle_connections():
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    pool = LazyPool(maxconn=2, connect=connect)
+
+    conn = pool.getconn()
+    pool.putconn(conn)
+
+    assert pool.getconn() is conn
+    assert len(opened) == 1
+    assert pool.stats()["in_use"] == 1
+
+
+def test_pool_waits_for_a_free_connection_then_times_out():
+    pool = LazyPool(maxconn=1, timeout=0.05, connect=FakeConnection)
+    conn = pool.getconn()
+
+    releaser = threading.Timer(0.01, pool.putconn, (conn,))
+    releaser.start()
+    assert pool.getconn(timeout=1) is conn
+
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_pool_closeall_closes_idle_connections():
+    pool = LazyPool(connect=FakeConnection)
+    busy, idle = pool.getconn(), pool.getconn()
+    pool.putconn(idle)
+
+    pool.closeall()
+
+    assert idle.closed and not busy.closed
+    assert pool.stats()["size"] == 1
+
+
+def test_pool_replaces_dead_idle_connection(clock):
+    pool = LazyPool(check_after=30, connect=FakeConnection, clock=clock)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.alive = False
+
+    clock.now = 60
+    replacement = pool.getconn()
+
+    assert replacement is not conn
+    assert conn.closed
+    assert pool.stats() == {
+        "size": 1, "in_use": 1, "idle": 0,
+        "waiting": 0, "timeouts": 0, "reconnects": 1,
+    }
+
+
+def test_pool_discards_broken_connections_on_return():
+    pool = LazyPool(connect=FakeConnection)
+    conn = pool.getconn()
+    conn.closed = 2
+
+    pool.putconn(conn)
+
+    assert pool.stats()["size"] == 0
+    assert pool.getconn() is not conn
+
+
+def test_execute_prepared_prepares_once_per_connection():
+    conn = FakeConnection()
+    cur = conn.cursor()
+    cur.connection = conn
+
+    execute_prepared(cur, "set_message_hash", ("a" * 32, 1))
+    execute_prepared(cur, "set_message_hash", ("b" * 32, 2))
+
+    queries = [query for query, _ in conn.executed]
+    assert queries[0].startswith("PREPARE set_message_hash (char(32), bigint)")
+    assert queries[1:] == ["EXECUTE set_message_hash (%s, %s);"] * 2
+    assert conn.executed[2][1] == ("b" * 32, 2)
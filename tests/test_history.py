@@ -0,0 +1,81 @@
+from bot.history import (diff_snapshots, load_latest, rows_to_outages,
+                         save_snapshot, snapshot_changes)
+
+OLD = {
+    "27 декабря текущего года:": ["дома 2-22 по ул. Бабаяна", "село Шенаван"],
+}
+NEW = {
+    "27 декабря текущего года:": ["улице Тиграняна", "село Шенаван"],
+    "28 декабря текущего года:": ["село Шенаван"],
+}
+
+
+def test_snapshot_changes_only_touches_changed_rows():
+    upserts, removed = snapshot_changes(OLD, NEW)
+
+    assert upserts == [
+        ("27 декабря текущего года:", "улице Тиграняна", 0),
+        ("28 декабря текущего года:", "село Шенаван", 2),
+    ]
+    assert removed == [("27 декабря текущего года:", "дома 2-22 по ул. Бабаяна")]
+    assert snapshot_changes(NEW, NEW) == ([], [])
+
+
+def test_snapshot_changes_without_stored_snapshot():
+    upserts, removed = snapshot_changes(None, OLD)
+
+    assert [position for _, _, position in upserts] == [0, 1]
+    assert removed == []
+
+
+def test_save_snapshot_writes_changes(mocker, fake_cursor):
+    execute_values = mocker.patch("bot.history.execute_values")
+    cur = fake_cursor([(7,)])
+
+    assert save_snapshot(cur, OLD, NEW, "f" * 32) == 7
+    removed_rows = execute_values.call_args_list[0].args[2]
+    upsert_rows = execute_values.call_args_list[1].args[2]
+    assert removed_rows == [
+        ("27 декабря текущего года:", "дома 2-22 по ул. Бабаяна", 7)
+    ]
+    assert [row[-1] for row in upsert_rows] == [7, 7]
+
+
+def test_save_snapshot_reads_current_rows_without_stored(
+        mocker, fake_cursor):
+    execute_values = mocker.patch("bot.history.execute_values")
+    rows = [(date, line) for date, lines in OLD.items() for line in lines]
+    cur = fake_cursor([rows, (8,)])
+
+    assert save_snapshot(cur, None, NEW, "f" * 32) == 8
+    assert execute_values.call_args_list[0].args[2] == [
+        ("27 декабря текущего года:", "дома 2-22 по ул. Бабаяна", 8)
+    ]
+
+
+def test_load_latest_restores_page_order(fake_cursor):
+    rows = [(date, line) for date, lines in NEW.items() for line in lines]
+    cur = fake_cursor([(3, "f" * 32), rows])
+
+    snapshot_id, fingerprint, outages = load_latest(cur)
+
+    assert (snapshot_id, fingerprint) == (3, "f" * 32)
+    assert outages == NEW
+    assert list(outages) == list(NEW)
+    assert load_latest(fake_cursor([None])) is None
+    assert rows_to_outages([]) == {}
+
+
+def test_diff_snapshots_groups_lines(fake_cursor):
+    cur = fake_cursor([[
+        ("27 декабря текущего года:", "улице Тиграняна", True),
+        ("27 декабря текущего года:", "дома 2-22 по ул. Бабаяна", False),
+    ]])
+
+    assert diff_snapshots(cur, 1, 2) == {
+        "27 декабря текущего года:": {
+            "added": ["улице Тиграняна"],
+            "removed": ["дома 2-22 по ул. Бабаяна"],
+        }
+    }
+    assert cur.queries[0][1] == {"old": 1, "new": 2}
@@ -0,0 +1,41 @@
+import json
+import logging
+
+import pytest
+
+from bot.logging_config import (SAMPLED, JsonFormatter, SamplingFilter,
+                                parse_level)
+
+
+def make_record(level=logging.INFO, extra=None):
+    record = logging.LogRecord(
+        "root", level, __file__, 1, "User %s checked", (42,), None
+    )
+    for key, value in (extra or {}).items():
+        setattr(record, key, value)
+    return record
+
+
+def test_sampling_filter_keeps_one_in_n_sampled_records():
+    sampling = SamplingFilter(every=10)
+
+    kept = [sampling.filter(make_record(extra=SAMPLED)) for _ in range(30)]
+
+    assert kept.count(True) == 3
+    assert sampling.dropped == 27
+    assert sampling.filter(make_record())
+    assert sampling.filter(make_record(logging.ERROR, extra=SAMPLED))
+
+
+def test_json_formatter():
+    entry = json.loads(JsonFormatter().format(make_record()))
+
+    assert entry["level"] == "INFO"
+    assert entry["message"] == "User 42 checked"
+
+
+def test_parse_level_ignores_case():
+    assert parse_level("debug") == logging.DEBUG
+    assert parse_level("WARNING") == logging.WARNING
+    with pytest.raises(ValueError):
+        parse_level("verbose")
@@ -0,0 +1,63 @@
+from bot.matcher import NO_OUTAGES_MESSAGE, AddressAutomaton, OutageIndex
+from bot.normalization import normalize_address
+
+OUTAGES = {
+    "27 декабря текущего года:": [
+        "дома 2-22 по ул. Бабаяна",
+        "улице Тиграняна",
+        "село Шенаван",
+    ],
+    "28 декабря текущего года:": [
+        "дом 5 по ул. Азатутяна",
+        "частные дома в селе Ахпрадзор",
+        "село Шенаван",
+    ],
+}
+
+
+def naive_messages(outages, addresses):
+    messages = []
+    for date, lines in outages.items():
+        for line in lines:
+            for address in addresses:
+                if normalize_address(address) in normalize_address(line):
+                    msg = f"{date}\n\n{line}"
+                    if msg not in messages:
+                        messages.append(msg)
+    return messages
+
+
+def test_automaton_finds_overlapping_patterns():
+    automaton = AddressAutomaton(["бабаяна", "баба", "аян", "шенаван"])
+
+    assert automaton.search("дома 2-22 по ул. бабаяна") == {
+        "бабаяна", "баба", "аян"
+    }
+    assert automaton.search("улице тиграняна") == set()
+
+
+def test_match_subscribers_equals_naive_matching():
+    subscriptions = {
+        1: ["Бабаяна"],
+        2: ["шенаван", "ТИГРАНЯНА"],
+        3: ["Ереван"],
+        4: ["с. Шенаван", "Ахпрадзор"],
+        5: ["улица Бабаяна", "Азатутяна"],
+    }
+    index = OutageIndex(OUTAGES)
+    matches = index.match_subscribers(subscriptions)
+
+    for user_id, addresses in subscriptions.items():
+        assert (index.messages(matches[user_id])
+                == naive_messages(OUTAGES, addresses))
+        assert (index.messages(index.positions_for(addresses))
+                == naive_messages(OUTAGES, addresses))
+
+
+def test_render_without_matches():
+    index = OutageIndex(OUTAGES)
+
+    assert index.render(index.find("Ереван")) == NO_OUTAGES_MESSAGE
+    assert index.render(index.find("Азатутяна")) == (
+        "28 декабря текущего года:\n\nдом 5 по ул. Азатутяна"
+    )
@@ -0,0 +1,67 @@
+from bot.matcher import OutageIndex, address_key, address_signature
+from bot.message_cache import MessageCache
+
+DATE = "27 декабря текущего года:"
+OUTAGES = {DATE: ["дома 2-22 по ул. Бабаяна", "улице Тиграняна"]}
+
+
+def test_address_key_groups_equivalent_addresses():
+    assert address_key("ул. Бабаяна") == address_key("бабаяна")
+    assert address_key("Бабаяна 10") == address_key("ул. Бабаяна, д. 10")
+    assert address_key("Бабаяна 10") != address_key("Бабаяна 30")
+
+
+def test_get_serves_repeated_requests_from_memory():
+    cache = MessageCache()
+    index = OutageIndex(OUTAGES)
+
+    first = cache.get(index, ["Тиграняна"])
+    second = cache.get(index, ["улица Тиграняна"])
+
+    assert first is second
+    assert first.message == f"{DATE}\n\nулице Тиграняна"
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+
+def test_new_parse_version_misses():
+    cache = MessageCache()
+    cache.get(OutageIndex(OUTAGES), ["Тиграняна"])
+
+    rendered = cache.get(OutageIndex({DATE: ["село Шенаван"]}), ["Тиграняна"])
+
+    assert rendered.positions == ()
+    assert cache.misses == 2
+
+
+def test_get_groups_matches_only_missing_sets(mocker):
+    cache = MessageCache()
+    index = OutageIndex(OUTAGES)
+    match = mocker.spy(index, "match_subscribers")
+    cache.get(index, ["Шенаван"])
+    groups = {
+        address_signature(addresses): addresses
+        for addresses in (["Бабаяна 10", "Тиграняна"], ["Шенаван"])
+    }
+
+    rendered = cache.get_groups(index, groups)
+
+    assert [message.positions for message in rendered.values()] == [
+        (0, 1), ()
+    ]
+    assert len(match.call_args.args[0]) == 1
+    assert cache.stats() == {"entries": 2, "hits": 1, "misses": 2}
+
+
+def test_lru_and_ttl_evict_entries(clock):
+    cache = MessageCache(maxsize=2, ttl=60, clock=clock)
+    index = OutageIndex(OUTAGES)
+    for address in ("Бабаяна", "Тиграняна", "Шенаван"):
+        cache.get(index, [address])
+
+    assert len(cache.entries) == 2
+    cache.get(index, ["Бабаяна"])
+    assert cache.misses == 4
+
+    clock.now = 61
+    cache.get(index, ["Шенаван"])
+    assert cache.misses == 5
@@ -0,0 +1,79 @@
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from bot.metrics import CycleProfiler, MetricsServer, Registry
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    sent = registry.counter("sent_total", "Sent", ("result",))
+    depth = registry.gauge("depth", "Depth")
+    latency = registry.histogram("latency_seconds", "Latency")
+
+    sent.inc(result="sent")
+    sent.inc(2, result="failed")
+    depth.set_function(lambda: 7)
+    latency.observe(0.02)
+    latency.observe(3)
+
+    text = registry.render()
+    assert 'sent_total{result="failed"} 2' in text
+    assert 'sent_total{result="sent"} 1' in text
+    assert "depth 7" in text
+    assert 'latency_seconds_bucket{le="0.025"} 1' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in text
+    assert "latency_seconds_count 2" in text
+
+
+def test_profiler_records_cycle_stages():
+    registry = Registry()
+    stages = registry.histogram("stage_seconds", "Stages", ("stage",))
+    profiler = CycleProfiler(stages)
+
+    profiler.begin()
+    with profiler.stage("fetch"):
+        pass
+    with profiler.stage("match"):
+        pass
+    profiler.end()
+
+    cycle = profiler.report()[0]
+    assert set(cycle["stages"]) == {"fetch", "match"}
+    assert stages.count(stage="fetch") == 1
+
+
+def test_metrics_endpoint():
+    registry = Registry()
+    registry.counter("requests_total", "Requests").inc()
+    server = MetricsServer(port=0, registry=registry)
+    server.start()
+    host, port = server.address
+    try:
+        with urllib.request.urlopen(
+            f"http://{host}:{port}/metrics", timeout=5
+        ) as response:
+            assert "requests_total 1" in response.read().decode()
+    finally:
+        server.stop()
+
+
+def test_ready_endpoint():
+    ready = threading.Event()
+    server = MetricsServer(port=0, registry=Registry(), ready=ready)
+    server.start()
+    host, port = server.address
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://{host}:{port}/ready", timeout=5)
+        assert error.value.code == 503
+
+        ready.set()
+        with urllib.request.urlopen(
+            f"http://{host}:{port}/ready", timeout=5
+        ) as response:
+            assert response.status == 200
+    finally:
+        server.stop()
@@ -0,0 +1,39 @@
+from bot.normalization import OutageLine, normalize_address, normalized_form
+from bot.parser import group_by_date
+
+
+def test_street_types_and_case_are_ignored():
+    assert normalize_address("ул. Бабаяна") == "бабаяна"
+    assert normalize_address("БАБАЯНА") == "бабаяна"
+    assert normalize_address("Бабаяна улица") == "бабаяна"
+
+
+def test_yo_is_folded_into_ye():
+    assert normalize_address("Озёрная") == normalize_address("озерная")
+
+
+def test_armenian_street_types_are_stripped():
+    assert normalize_address("Բաբայան փողոց") == "բաբայան"
+    assert normalize_address("Բաբայան փ.") == "բաբայան"
+
+
+def test_only_street_type_is_kept():
+    assert normalize_address("село") == "село"
+
+
+def test_outage_line_keeps_raw_text():
+    line = OutageLine("дома 2-22 по ул. Бабаяна")
+
+    assert line == "дома 2-22 по ул. Бабаяна"
+    assert normalized_form(line) == "дома 2-22 по бабаяна"
+    assert normalized_form("дома 2-22 по ул. Бабаяна") == line.normalized
+
+
+def test_group_by_date_returns_outage_lines():
+    outages = group_by_date(
+        ["27 декабря текущего года:", "ул. Бабаяна,", "село Шенаван"]
+    )
+
+    lines = outages["27 декабря текущего года:"]
+    assert lines == ["ул. Бабаяна", "село Шенаван"]
+    assert [line.normalized for line in lines] == ["бабаяна", "шенаван"]
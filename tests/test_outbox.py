@@ -0,0 +1,109 @@
+from functools import partial
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from bot.outbox import MAX_ATTEMPTS, OutboxSender, enqueue_messages
+
+
+@pytest.fixture
+def make_sender(start_sender):
+    return partial(start_sender, OutboxSender)
+
+
+def test_enqueue_compares_messages_with_stored_hashes(mocker, fake_cursor):
+    execute_values = mocker.patch(
+        "bot.outbox.execute_values", side_effect=[[(9,)], [(1,)]]
+    )
+    cur = fake_cursor([])
+    messages = [(1, "new", "a" * 32), (2, "same", "b" * 32)]
+
+    queued = enqueue_messages(cur, {1: {}, 2: {}, 3: {}}, messages)
+
+    assert queued == 1
+    query, params = cur.queries[-1]
+    assert query.startswith("DELETE FROM light_bot.outbox")
+    assert params == ([3],)
+    current, upsert = execute_values.call_args_list
+    assert "IS NOT DISTINCT FROM v.message_hash" in current.args[1]
+    assert current.args[2] == [(1, "a" * 32), (2, "b" * 32)]
+    assert "ON CONFLICT (user_id) WHERE delivered_at IS NULL" in (
+        upsert.args[1]
+    )
+    assert upsert.args[2] == messages
+
+
+def test_run_once_without_rows(fake_cursor, make_sender):
+    cur = fake_cursor([[]])
+    sender = make_sender(cur, lambda *args: None)
+
+    assert sender.run_once() is False
+
+
+def test_run_once_marks_delivered_and_reschedules_failed(
+    mocker, fake_cursor, make_sender
+):
+    hashes = mocker.patch("bot.outbox.update_message_hashes")
+    cur = fake_cursor([[
+        (10, 1, "first", "a" * 32),
+        (11, 2, "second", "b" * 32),
+    ]])
+    stored = {}
+
+    def send(user_id, text):
+        if user_id == 2:
+            raise ValueError("chat not found")
+
+    sender = make_sender(cur, send, on_delivered=stored.__setitem__)
+
+    assert sender.run_once() is True
+
+    delivered_query, delivered_params = cur.queries[1]
+    assert "delivered_at = now()" in delivered_query
+    assert delivered_params == ([10],)
+    assert hashes.call_args.args[1] == [(1, "a" * 32)]
+    failed_query, failed_params = cur.queries[2]
+    assert "next_attempt_at" in failed_query
+    assert failed_params == ([11],)
+    assert stored == {1: "a" * 32}
+
+
+def test_run_once_drops_rows_of_users_who_blocked_the_bot(
+    mocker, fake_cursor, make_sender
+):
+    mocker.patch("bot.outbox.update_message_hashes")
+    cur = fake_cursor([[(10, 1, "first", "a" * 32)]])
+    blocked = []
+
+    def send(user_id, text):
+        raise ApiTelegramException("sendMessage", None, {
+            "error_code": 403,
+            "description": "Forbidden: bot was blocked by the user",
+        })
+
+    sender = make_sender(cur, send, on_blocked=blocked.append)
+
+    assert sender.run_once() is True
+
+    deleted_query, deleted_params = cur.queries[1]
+    assert deleted_query.startswith("DELETE FROM light_bot.outbox")
+    assert deleted_params == ([10],)
+    assert "SET blocked_at = NOW()" in cur.queries[2][0]
+    assert blocked == [1]
+
+
+def test_purge_drops_exhausted_rows_and_reports_users(
+    fake_cursor, make_sender
+):
+    cur = fake_cursor([[(4,), (5,)]])
+    exhausted = []
+    sender = make_sender(
+        cur, lambda *args: None, on_exhausted=exhausted.append
+    )
+
+    sender.purge()
+
+    query, params = cur.queries[1]
+    assert "attempts >= %s" in query
+    assert params == (MAX_ATTEMPTS,)
+    assert exhausted == [4, 5]
@@ -1,3 +1,5 @@
+import pytest
+
 from bot.parser import Parser
 
 MOCK_HTML = """
@@ -25,9 +27,10 @@ MOCK_EMPTY_HTML = """
 MOCK_URL = "https://test.com/"
 
 
-def test_parse_website_success(requests_mock):
+@pytest.mark.parametrize("engine", Parser.ENGINES)
+def test_parse_website_success(requests_mock, engine):
     requests_mock.get(MOCK_URL, text=MOCK_HTML)
-    parser = Parser()
+    parser = Parser(engine)
     result = parser.parse_website()
 
     assert result
@@ -42,9 +45,10 @@ def test_parse_website_success(requests_mock):
             and result["28 декабря текущего года:"])
 
 
-def test_parse_website_empty_response(requests_mock):
+@pytest.mark.parametrize("engine", Parser.ENGINES)
+def test_parse_website_empty_response(requests_mock, engine):
     requests_mock.get(MOCK_URL, text=MOCK_EMPTY_HTML)
-    parser = Parser()
+    parser = Parser(engine)
     result = parser.parse_website()
 
     assert result == {}
@@ -56,3 +60,46 @@ def test_parse_website_http_error(requests_mock):
     result = parser.parse_website()
 
     assert not result
+
+
+def test_parse_website_not_modified(requests_mock):
+    requests_mock.get(MOCK_URL, [
+        {"text": MOCK_HTML, "headers": {"ETag": '"v1"'}},
+        {"status_code": 304},
+    ])
+    parser = Parser()
+    first = parser.parse_website()
+    second = parser.parse_website()
+
+    assert second == first
+    assert requests_mock.last_request.headers["If-None-Match"] == '"v1"'
+    stats = parser.stats.as_dict()
+    assert stats["requests"] == 2
+    assert stats["not_modified"] == 1
+    assert stats["not_modified_rate"] == 0.5
+
+
+def test_parse_page_engines_agree():
+    html = MOCK_HTML.replace(
+        "<p>улице Тиграняна,</p>",
+        "<p>улице <b>Тиграняна</b> &amp; окрестности,</p><p></p>"
+    )
+
+    assert (Parser("lxml").parse_page(html)
+            == Parser("html.parser").parse_page(html))
+
+
+@pytest.mark.parametrize("html", [
+    "<p>27 декабря текущего года:</p><p>x<p>ул. Бабаяна</p></p>",
+    "<p>27 декабря текущего года:<p>ул. Бабаяна<p>село Шенаван",
+    "<p>27 декабря текущего года:</p><div><p>ул. <div>Бабаяна</div>,</p>"
+    "</div>",
+    "<p>27 декабря текущего года:</p></p><p>ул. Бабаяна</p>",
+    "<p>27 декабря текущего года:</p><p>ул. <script>var p = '<p>';"
+    "</script><style>p {}</style>Бабаяна</p>",
+])
+def test_parse_page_engines_agree_on_irregular_markup(html):
+    html = MOCK_HTML.replace("<p>улице Тиграняна,</p>", html)
+
+    assert (Parser("lxml").parse_page(html)
+            == Parser("html.parser").parse_page(html))
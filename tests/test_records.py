@@ -0,0 +1,108 @@
+from bot.matcher import OutageIndex
+from bot.records import RecordIndex, build_records, parse_line, parse_segments
+
+OUTAGES = {
+    "27 декабря текущего года:": [
+        "дома 2-22 по ул. Бабаяна",
+        "улице Тиграняна",
+        "село Шенаван",
+    ],
+    "28 декабря текущего года:": [
+        "дома 30, 34-40 по ул. Бабаяна",
+        "дом 5 по ул. Азатутяна",
+        "частные дома в селе Ахпрадзор",
+    ],
+}
+
+
+def test_parse_line():
+    assert parse_line("дома 2-22 по ул. Бабаяна") == (
+        None, "бабаяна", ((2, 22),)
+    )
+    assert parse_line("дома 30, 34-40 по ул. Бабаяна") == (
+        None, "бабаяна", ((30, 30), (34, 40))
+    )
+    assert parse_line("частные дома в селе Ахпрадзор") == (
+        "ахпрадзор", None, ()
+    )
+    assert parse_line("ул. Бабаяна 10/2") == (None, "бабаяна", ((10, 10),))
+
+
+def test_parse_line_keeps_ordinals_in_street():
+    assert parse_line("2-й переулок Бабаяна") == (None, "2-й бабаяна", ())
+    assert parse_line("дом 5 по 3-й улице Ширака") == (
+        None, "3-й ширака", ((5, 5),)
+    )
+    assert parse_line("дома 5а, 7к2 по ул. Бабаяна") == (
+        None, "бабаяна", ((5, 5), (7, 7))
+    )
+
+
+def test_parse_segments_splits_streets():
+    assert parse_segments("дома 2-22 по ул. Бабаяна, Тиграняна") == [
+        (None, "бабаяна", ((2, 22),)), (None, "тиграняна", ())
+    ]
+    assert parse_segments("дома 2 и 4 по проспекту Комитаса") == [
+        (None, "комитаса", ((2, 2), (4, 4)))
+    ]
+    assert parse_segments("село Шенаван, ул. Бабаяна 5") == [
+        ("шенаван", "бабаяна", ((5, 5),))
+    ]
+    assert parse_segments("частные дома в селе Ахпрадзор") == [
+        ("ахпрадзор", None, ())
+    ]
+
+
+def test_lookup_by_house():
+    index = RecordIndex(build_records(OUTAGES))
+
+    assert [r.line for r in index.lookup("бабаяна", 10)] == [
+        "дома 2-22 по ул. Бабаяна"
+    ]
+    assert [r.line for r in index.lookup("бабаяна", 36)] == [
+        "дома 30, 34-40 по ул. Бабаяна"
+    ]
+    assert index.lookup("бабаяна", 25) == []
+    assert len(index.lookup("бабаяна")) == 2
+    assert [r.line for r in index.lookup("тиграняна", 7)] == [
+        "улице Тиграняна"
+    ]
+    assert index.lookup("ереван", 1) == []
+
+
+def test_lookup_overlapping_range():
+    index = RecordIndex(build_records(OUTAGES))
+
+    assert len(index.lookup("бабаяна", 20, 31)) == 2
+
+
+def test_outage_index_matches_houses():
+    index = OutageIndex(OUTAGES)
+    subscriptions = {
+        1: ["Бабаяна 10"],
+        2: ["ул. Бабаяна 25"],
+        3: ["Бабаяна"],
+        4: ["Тиграняна 3", "Шенаван"],
+    }
+    matches = index.match_subscribers(subscriptions)
+
+    assert matches[1] == (0,)
+    assert matches[2] == ()
+    assert matches[3] == (0, 3)
+    assert matches[4] == (1, 2)
+    for user_id, addresses in subscriptions.items():
+        assert index.positions_for(addresses) == matches[user_id]
+
+
+def test_outage_index_matches_every_street_of_a_line():
+    index = OutageIndex({"27 декабря текущего года:": [
+        "дома 2-22 по ул. Бабаяна, Тиграняна",
+        "по проспекту Комитаса",
+        "ул. Вазгена Саргсяна 3",
+    ]})
+
+    assert index.positions_for(["Бабаяна 10"]) == (0,)
+    assert index.positions_for(["Тиграняна 30"]) == (0,)
+    assert index.positions_for(["Комитаса 5"]) == (1,)
+    assert index.positions_for(["Саргсяна 3"]) == (2,)
+    assert index.positions_for(["Бабаяна 30"]) == ()
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+import pytest
+
+from bot.scheduler import (CHANGED, ERROR, UNCHANGED, AdaptiveSchedule,
+                           parse_windows, window_factor)
+
+NOON = datetime(2024, 12, 27, 12, 0)
+
+
+def schedule(**kwargs):
+    kwargs.setdefault("jitter", 0)
+    return AdaptiveSchedule(60, now=lambda: NOON, **kwargs)
+
+
+def test_unchanged_pages_back_off_to_max():
+    backing_off = schedule(backoff=2)
+    delays = [backing_off.next_delay(UNCHANGED) for _ in range(4)]
+
+    assert delays == [60, 120, 240, 240]
+
+
+def test_change_polls_fast_and_resets_backoff():
+    polling = schedule(backoff=2, min_interval=15)
+    polling.next_delay(UNCHANGED)
+    polling.next_delay(UNCHANGED)
+
+    assert polling.next_delay(CHANGED) == 15
+    assert polling.next_delay(UNCHANGED) == 60
+
+
+def test_errors_back_off():
+    polling = schedule(backoff=2, max_interval=300)
+
+    assert [polling.next_delay(ERROR) for _ in range(3)] == [120, 240, 300]
+    assert polling.next_delay(UNCHANGED) == 60
+
+
+def test_jitter_stays_within_bounds():
+    low = schedule(jitter=0.1, rng=lambda: 0.0).next_delay(UNCHANGED)
+    high = schedule(jitter=0.1, rng=lambda: 1.0).next_delay(UNCHANGED)
+
+    assert low == pytest.approx(54)
+    assert high == pytest.approx(66)
+
+
+def test_windows():
+    windows = parse_windows("09:00-18:00=0.5, 23:00-07:00=4")
+
+    assert windows == [(540, 1080, 0.5), (1380, 420, 4.0)]
+    assert window_factor(windows, NOON) == 0.5
+    assert window_factor(windows, datetime(2024, 12, 27, 3, 30)) == 4.0
+    assert window_factor(windows, datetime(2024, 12, 27, 20, 0)) == 1.0
+    assert schedule(windows=windows).next_delay(UNCHANGED) == 30
+
+
+def test_invalid_window():
+    with pytest.raises(ValueError):
+        parse_windows("nine-five")
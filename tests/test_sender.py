@@ -0,0 +1,104 @@
+from telebot.apihelper import ApiTelegramException
+
+from bot.sender import SendQueue, TokenBucket, is_permanent
+
+
+def rate_limited(retry_after):
+    return ApiTelegramException("sendMessage", None, {
+        "error_code": 429,
+        "description": "Too Many Requests",
+        "parameters": {"retry_after": retry_after},
+    })
+
+
+def test_token_bucket_waits_when_empty(clock):
+    bucket = TokenBucket(rate=2, clock=clock)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0.5
+
+    clock.now = 10
+    bucket.pause(3)
+    assert bucket.reserve() == 3
+
+
+def test_send_queue_retries_after_rate_limit():
+    calls = []
+    delivered = []
+
+    def send(chat_id, text):
+        calls.append(chat_id)
+        if len(calls) == 1:
+            raise rate_limited(0)
+
+    send_queue = SendQueue(send, workers=1, rate=1000, per_chat_interval=0)
+    send_queue.start()
+    send_queue.submit(1, "text", on_delivered=delivered.append)
+    send_queue.join()
+
+    assert calls == [1, 1]
+    assert delivered == [1]
+    assert send_queue.stats()["sent"] == 1
+    assert send_queue.stats()["retried"] == 1
+
+
+def test_send_queue_reports_failures():
+    failed = []
+    delivered = []
+
+    def send(chat_id, text):
+        raise ApiTelegramException("sendMessage", None, {
+            "error_code": 403,
+            "description": "Forbidden: bot was blocked by the user",
+        })
+
+    send_queue = SendQueue(send, workers=2, rate=1000, per_chat_interval=0)
+    send_queue.start()
+    for chat_id in (1, 2):
+        send_queue.submit(
+            chat_id, "text",
+            on_delivered=delivered.append,
+            on_failed=lambda chat_id, _: failed.append(chat_id)
+        )
+    send_queue.join()
+
+    assert sorted(failed) == [1, 2]
+    assert delivered == []
+    assert send_queue.stats()["failed"] == 2
+
+
+def api_error(error_code, description):
+    return ApiTelegramException("sendMessage", None, {
+        "error_code": error_code, "description": description,
+    })
+
+
+def test_is_permanent_only_for_blocked_or_missing_chats():
+    assert is_permanent(api_error(403, "Forbidden: bot was blocked"))
+    assert is_permanent(api_error(400, "Bad Request: chat not found"))
+    assert not is_permanent(api_error(400, "Bad Request: message is empty"))
+    assert not is_permanent(api_error(502, "Bad Gateway"))
+    assert not is_permanent(ValueError("chat not found"))
+
+
+def test_send_queue_retries_server_errors_only():
+    calls = []
+
+    def send(chat_id, text):
+        calls.append(chat_id)
+        if chat_id == 1 and len(calls) == 1:
+            raise api_error(502, "Bad Gateway")
+        if chat_id == 2:
+            raise api_error(400, "Bad Request: chat not found")
+
+    send_queue = SendQueue(send, workers=1, rate=1000, per_chat_interval=0)
+    send_queue.bucket.pause = lambda seconds: None
+    send_queue.start()
+    send_queue.submit(1, "text")
+    send_queue.join()
+    send_queue.submit(2, "text")
+    send_queue.join()
+
+    assert calls == [1, 1, 2]
+    assert send_queue.stats()["failed"] == 1
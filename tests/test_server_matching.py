@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from bot.broadcast import changed_messages
+from bot.db import migrate
+from bot.matcher import OutageIndex
+from bot.normalization import normalize_address
+from bot.server_matching import (changed_messages_in_db, line_rows,
+                                 resolved_rows)
+from bot.server_matching import migrate as migrate_server_matching
+
+DSN = os.getenv("TEST_DATABASE_DSN")
+INIT_SQL = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "init_db.sql"
+)
+DATE = "27 декабря текущего года:"
+OUTAGES = {
+    DATE: ["дома 2-22 по ул. Бабаяна", "улице Тиграняна", "улица Тиграняна"],
+    "28 декабря текущего года:": ["село Шенаван"],
+}
+ADDRESSES = {
+    -1: ["Тиграняна"],
+    -2: ["Бабаяна 10", "Шенаван"],
+    -3: ["Бабаяна 30"],
+    -4: ["ул. Бабаяна"],
+}
+
+
+def test_line_rows_point_duplicates_at_first_line():
+    rows = line_rows(OutageIndex(OUTAGES))
+
+    assert [row[:2] for row in rows] == [(0, 0), (1, 1), (2, 1), (3, 3)]
+    assert rows[1][2:] == ("тиграняна", f"{DATE}\n\nулице Тиграняна")
+
+
+def test_resolved_rows_only_cover_house_addresses():
+    rows = resolved_rows(
+        OutageIndex(OUTAGES), ["Бабаяна 10", "Бабаяна 30", "Тиграняна"]
+    )
+
+    assert rows == [("Бабаяна 10", 0), ("Бабаяна 30", None)]
+
+
+def test_changed_messages_in_db_loads_lines_and_filters_users(fake_cursor):
+    cur = fake_cursor([[("Бабаяна 30",)], [(1, "message", "f" * 32)]])
+
+    changed = changed_messages_in_db(cur, OutageIndex(OUTAGES), {1: {}})
+
+    assert changed == [(1, "message", "f" * 32)]
+    lines_sql, lines_csv = cur.copies[0]
+    assert lines_sql.startswith("COPY outage_lines")
+    assert lines_csv.count("\r\n") == 4
+    resolved_sql, resolved_csv = cur.copies[1]
+    assert "FORCE_NULL (position)" in resolved_sql
+    assert resolved_csv == '"Бабаяна 30",""\r\n'
+    assert cur.queries[-1][1]["user_ids"] == [1]
+
+
+@pytest.mark.skipif(not DSN, reason="TEST_DATABASE_DSN is not set")
+def test_database_matching_agrees_with_python_matching():
+    psycopg2 = pytest.importorskip("psycopg2")
+    conn = psycopg2.connect(DSN)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('light_bot.users');")
+            if cur.fetchone()[0] is None:
+                with open(INIT_SQL) as file:
+                    cur.execute(file.read())
+            migrate(cur)
+            migrate_server_matching(cur)
+            for user_id, addresses in ADDRESSES.items():
+                cur.execute(
+                    "INSERT INTO light_bot.users (user_id) VALUES (%s);",
+                    (user_id,)
+                )
+                for address in addresses:
+                    cur.execute(
+                        """INSERT INTO light_bot.addresses
+                        (user_id, address, address_normalized)
+                        VALUES (%s, %s, %s);""",
+                        (user_id, address, normalize_address(address))
+                    )
+            index = OutageIndex(OUTAGES)
+            expected = changed_messages(index, {
+                user_id: {"addresses": addresses, "last_msg_hash": None}
+                for user_id, addresses in ADDRESSES.items()
+            })
+
+            changed = changed_messages_in_db(cur, index, list(ADDRESSES))
+
+            assert sorted(changed) == sorted(expected)
+    finally:
+        conn.rollback()
+        conn.close()
@@ -0,0 +1,146 @@
+from functools import partial
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from bot.sharding import ShardWorker, enqueue_broadcast, shard_of
+
+DATE = "27 декабря текущего года:"
+OUTAGES = {DATE: ["улице Тиграняна", "село Шенаван"]}
+
+
+@pytest.fixture
+def make_worker(start_sender):
+    return partial(start_sender, ShardWorker, name="test", idle_sleep=0)
+
+
+def test_shard_of_matches_query_partition():
+    assert [shard_of(user_id, 4) for user_id in (0, 5, -5, 11)] == [
+        0, 1, 1, 3
+    ]
+
+
+def test_enqueue_broadcast_creates_job_per_shard(mocker):
+    execute_values = mocker.patch("bot.sharding.execute_values")
+
+    enqueue_broadcast(object(), 8, 7, 3)
+
+    assert execute_values.call_args.args[2] == [
+        (8, 7, 0, 3), (8, 7, 1, 3), (8, 7, 2, 3)
+    ]
+
+
+def test_run_once_without_job(fake_cursor, make_worker):
+    cur = fake_cursor([None])
+    worker = make_worker(cur, lambda *args: None)
+
+    assert worker.run_once() is False
+    assert len(cur.queries) == 1
+
+
+def test_run_once_notifies_shard_and_finishes_job(
+    mocker, fake_cursor, make_worker
+):
+    mocker.patch("bot.sharding.load_latest", return_value=(8, "f", OUTAGES))
+    hashes = mocker.patch("db.execute_values")
+    cur = fake_cursor([(3, 8, None, 1, 2), [
+        (1, None, False, "Тиграняна"),
+        (3, None, False, "Бабаяна"),
+    ]])
+    sent = []
+    worker = make_worker(cur, lambda user_id, text: sent.append(user_id))
+
+    assert worker.run_once() is True
+
+    assert sorted(sent) == [1, 3]
+    assert sorted(
+        user_id
+        for _, user_ids in hashes.call_args.args[2]
+        for user_id in user_ids
+    ) == [1, 3]
+    query, params = cur.queries[-1]
+    assert "finished_at = now()" in query
+    assert params == ("test", 2, 3)
+
+
+def test_run_once_only_checks_changed_users(mocker, fake_cursor, make_worker):
+    mocker.patch("bot.sharding.load_latest", return_value=(8, "f", OUTAGES))
+    mocker.patch(
+        "bot.sharding.diff_snapshots",
+        return_value={DATE: {"added": ["улице Тиграняна"], "removed": []}}
+    )
+    mocker.patch("db.execute_values")
+    cur = fake_cursor([(3, 8, 7, 1, 2), [
+        (1, None, False, "Тиграняна"),
+        (3, None, False, "Бабаяна"),
+    ]])
+    sent = []
+    worker = make_worker(cur, lambda user_id, text: sent.append(user_id))
+
+    worker.run_once()
+
+    assert sent == [1]
+
+
+def test_run_once_reschedules_job_with_failed_sends(
+    mocker, fake_cursor, make_worker
+):
+    mocker.patch("bot.sharding.load_latest", return_value=(8, "f", OUTAGES))
+    mocker.patch("db.execute_values")
+    cur = fake_cursor([(3, 8, None, 1, 2), [(1, None, False, "Тиграняна")]])
+
+    def send(user_id, text):
+        raise ValueError("chat not found")
+
+    worker = make_worker(cur, send)
+    worker.run_once()
+
+    query, params = cur.queries[-1]
+    assert "attempts = attempts + 1" in query
+    assert params == ("test", 3)
+
+
+def test_run_once_renders_latest_snapshot_for_superseded_job(
+    mocker, fake_cursor, make_worker
+):
+    mocker.patch(
+        "bot.sharding.load_latest",
+        return_value=(9, "f", {DATE: ["село Шенаван"]})
+    )
+    diff = mocker.patch(
+        "bot.sharding.diff_snapshots",
+        return_value={DATE: {"added": [], "removed": ["улице Тиграняна"]}}
+    )
+    mocker.patch("db.execute_values")
+    cur = fake_cursor([(3, 8, 7, 1, 2), [(1, None, False, "Тиграняна")]])
+    sent = []
+    worker = make_worker(cur, lambda user_id, text: sent.append(text))
+
+    worker.run_once()
+
+    assert diff.call_args.args[1:] == (7, 9)
+    assert len(sent) == 1
+    assert "Тиграняна" not in sent[0]
+
+
+def test_run_once_blocks_unreachable_users_instead_of_retrying(
+    mocker, fake_cursor, make_worker
+):
+    mocker.patch("bot.sharding.load_latest", return_value=(8, "f", OUTAGES))
+    mocker.patch("db.execute_values")
+    cur = fake_cursor([(3, 8, None, 1, 2), [(1, None, False, "Тиграняна")]])
+
+    def send(user_id, text):
+        raise ApiTelegramException("sendMessage", None, {
+            "error_code": 403,
+            "description": "Forbidden: bot was blocked by the user",
+        })
+
+    worker = make_worker(cur, send)
+    worker.run_once()
+
+    blocked_query, blocked_params = cur.queries[-2]
+    assert "SET blocked_at = NOW()" in blocked_query
+    assert blocked_params == ([1],)
+    query, params = cur.queries[-1]
+    assert "finished_at = now()" in query
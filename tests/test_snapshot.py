@@ -0,0 +1,61 @@
+from bot.snapshot import (changed_lines, diff_outages, outages_fingerprint,
+                          read_snapshot_file, write_snapshot_file)
+
+OLD = {
+    "27 декабря текущего года:": ["улице Тиграняна", "село Шенаван"],
+    "28 декабря текущего года:": ["дом 5 по ул. Азатутяна"],
+}
+
+
+def test_fingerprint_is_stable_and_order_sensitive():
+    copy = {date: list(lines) for date, lines in OLD.items()}
+    reordered = dict(reversed(list(OLD.items())))
+
+    assert outages_fingerprint(copy) == outages_fingerprint(OLD)
+    assert outages_fingerprint(reordered) != outages_fingerprint(OLD)
+
+
+def test_diff_reports_only_changed_sections():
+    new = {
+        "27 декабря текущего года:": ["улице Тиграняна", "село Шенаван"],
+        "28 декабря текущего года:": ["частные дома в селе Ахпрадзор"],
+        "29 декабря текущего года:": ["село Шенаван"],
+    }
+    diff = diff_outages(OLD, new)
+
+    assert diff == {
+        "28 декабря текущего года:": {
+            "added": ["частные дома в селе Ахпрадзор"],
+            "removed": ["дом 5 по ул. Азатутяна"],
+        },
+        "29 декабря текущего года:": {
+            "added": ["село Шенаван"],
+            "removed": [],
+        },
+    }
+    assert changed_lines(diff) == {
+        "28 декабря текущего года:": [
+            "частные дома в селе Ахпрадзор", "дом 5 по ул. Азатутяна"
+        ],
+        "29 декабря текущего года:": ["село Шенаван"],
+    }
+    assert diff_outages(OLD, OLD) == {}
+
+
+def test_snapshot_file_round_trip(tmp_path):
+    path = str(tmp_path / "data" / "outages.json")
+
+    assert read_snapshot_file(path) is None
+    write_snapshot_file(path, OLD, outages_fingerprint(OLD))
+
+    fingerprint, outages = read_snapshot_file(path)
+    assert fingerprint == outages_fingerprint(OLD)
+    assert outages == OLD
+    assert list(outages) == list(OLD)
+
+
+def test_broken_snapshot_file_is_ignored(tmp_path):
+    path = tmp_path / "outages.json"
+    path.write_text("{not json", encoding="utf-8")
+
+    assert read_snapshot_file(str(path)) is None
@@ -0,0 +1,117 @@
+import json
+import threading
+
+import pytest
+
+from bot.sources import (Source, SourceRegistry, load_sources,
+                         merge_outages)
+
+POWER = {"27 декабря текущего года:": ["село Шенаван"]}
+WATER = {"27 декабря текущего года:": ["улице Тиграняна"]}
+
+
+class StubParser:
+
+    def __init__(self, results, release=None):
+        self.results = list(results)
+        self.release = release
+        self.calls = 0
+        self.stats = type("Stats", (), {"as_dict": lambda self: {}})()
+
+    def parse_website(self):
+        self.calls += 1
+        if self.release is not None:
+            self.release.wait(5)
+        return self.results.pop(0)
+
+
+def registry(sources, parsers, clock):
+    sources = SourceRegistry(sources, clock=clock)
+    sources.parsers.update(parsers)
+    return sources
+
+
+def test_load_sources_defaults_to_url(monkeypatch):
+    monkeypatch.delenv("SOURCES", raising=False)
+    monkeypatch.setenv("RETRY_PERIOD", "30")
+
+    assert load_sources() == [
+        Source("power", "https://test.com/", interval=30)
+    ]
+
+
+def test_load_sources_from_json(monkeypatch):
+    monkeypatch.setenv("SOURCES", json.dumps([
+        {"name": "power", "url": "https://a.test/"},
+        {"name": "water", "url": "https://b.test/", "title": "Вода",
+         "interval": 300, "engine": "lxml"},
+    ]))
+    monkeypatch.setenv("RETRY_PERIOD", "60")
+
+    power, water = load_sources()
+    assert power.interval == 60
+    assert (water.title, water.interval, water.engine) == (
+        "Вода", 300, "lxml"
+    )
+
+
+def test_load_sources_rejects_duplicates(monkeypatch):
+    monkeypatch.setenv("SOURCES", json.dumps([
+        {"name": "power", "url": "https://a.test/"},
+        {"name": "power", "url": "https://b.test/"},
+    ]))
+
+    with pytest.raises(ValueError):
+        load_sources()
+
+
+def test_merge_prefixes_titled_sources():
+    sources = [Source("power", "a"), Source("water", "b", title="Вода")]
+
+    assert merge_outages({"power": POWER, "water": WATER}, sources) == {
+        "27 декабря текущего года:": ["село Шенаван"],
+        "Вода. 27 декабря текущего года:": ["улице Тиграняна"],
+    }
+
+
+def test_sources_follow_their_schedules(monkeypatch, clock):
+    monkeypatch.setenv("POLL_JITTER", "0")
+    power = StubParser([POWER, POWER])
+    water = StubParser([WATER])
+    sources = registry(
+        [Source("power", "a", interval=60),
+         Source("water", "b", title="Вода", interval=300)],
+        {"power": power, "water": water},
+        clock
+    )
+
+    assert len(sources.poll(timeout=5)) == 2
+    clock.now = 60
+    sources.poll(timeout=5)
+
+    assert (power.calls, water.calls) == (2, 1)
+    assert sources.seconds_until_due() == 90
+
+
+def test_slow_source_does_not_block_others(clock):
+    release = threading.Event()
+    sources = registry(
+        [Source("power", "a"), Source("water", "b", title="Вода")],
+        {"power": StubParser([POWER]),
+         "water": StubParser([WATER], release)},
+        clock
+    )
+
+    assert sources.poll(timeout=0.2) == POWER
+    release.set()
+    assert len(sources.poll(timeout=5)) == 2
+
+
+def test_failed_source_keeps_last_result(clock):
+    sources = registry(
+        [Source("power", "a")], {"power": StubParser([POWER, None])}, clock
+    )
+
+    assert sources.poll(timeout=5) == POWER
+    clock.now = 60
+    assert sources.poll(timeout=5) == POWER
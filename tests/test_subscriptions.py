@@ -0,0 +1,34 @@
+from bot.subscriptions import SubscriptionStore
+
+ROWS = [
+    (1, "a" * 32, False, "Бабаяна"),
+    (1, "a" * 32, False, "Шенаван"),
+    (2, None, True, "Шенаван"),
+    (3, None, False, None),
+]
+
+
+def test_load_and_active_subscriptions(fake_cursor):
+    store = SubscriptionStore()
+    store.load(fake_cursor([ROWS]))
+
+    assert store.active() == {
+        1: {"last_msg_hash": "a" * 32, "addresses": ["Бабаяна", "Шенаван"]}
+    }
+    assert store.get_addresses(3) == []
+
+
+def test_changes_during_reload_are_replayed(fake_cursor):
+    store = SubscriptionStore()
+    store.load(fake_cursor([ROWS]))
+
+    def concurrent_changes():
+        store.add(3, "Тиграняна")
+        store.remove(1, "Бабаяна")
+        store.set_blocked(2, False)
+
+    store.load(fake_cursor([ROWS], on_execute=concurrent_changes))
+
+    assert store.get_addresses(1) == ["Шенаван"]
+    assert store.active()[3]["addresses"] == ["Тиграняна"]
+    assert store.active()[2]["addresses"] == ["Шенаван"]
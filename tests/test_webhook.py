@@ -0,0 +1,89 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from bot.webhook import SECRET_HEADER, WebhookServer
+from bot.workers import KeyedDispatcher
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 10,
+        "date": 1766800000,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        "text": "/check Бабаяна",
+    },
+}
+
+
+def post(server, body, secret="secret"):
+    host, port = server.address
+    request = urllib.request.Request(
+        f"http://{host}:{port}/hook",
+        data=json.dumps(body).encode("utf-8"),
+        headers={SECRET_HEADER: secret, "Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+@pytest.fixture
+def received():
+    return []
+
+
+@pytest.fixture
+def server(received):
+    done = threading.Event()
+
+    def process_update(update):
+        received.append(update)
+        done.set()
+
+    server = WebhookServer(
+        process_update, host="127.0.0.1", port=0, path="/hook",
+        secret_token="secret"
+    )
+    server.done = done
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_webhook_feeds_updates_to_handlers(server, received):
+    assert post(server, UPDATE) == 200
+    assert server.done.wait(5)
+    assert received[0].message.chat.id == 42
+    assert received[0].message.text == "/check Бабаяна"
+
+
+def test_webhook_rejects_invalid_secret(server, received):
+    assert post(server, UPDATE, secret="wrong") == 403
+    assert received == []
+
+
+def test_webhook_rejects_non_ascii_secret(server, received):
+    assert post(server, UPDATE, secret="sécret") == 403
+    assert received == []
+
+
+def test_webhook_backpressure_when_dispatcher_is_full():
+    dispatcher = KeyedDispatcher(workers=1, max_depth=1)
+    server = WebhookServer(
+        lambda update: dispatcher.submit(
+            update.update_id, lambda: None, block=False
+        ),
+        host="127.0.0.1", port=0
+    )
+    body = json.dumps(UPDATE).encode("utf-8")
+
+    assert server.accept("/", {}, body) == 200
+    assert server.accept("/", {}, body) == 503
+    server.stop()
@@ -0,0 +1,64 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from bot.workers import KeyedDispatcher
+
+
+def wait_idle(dispatcher, timeout=5):
+    deadline = time.monotonic() + timeout
+    while dispatcher.stats()["busy_keys"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_tasks_of_one_key_run_in_order():
+    dispatcher = KeyedDispatcher(workers=4)
+    dispatcher.start()
+    results = []
+
+    for number in range(20):
+        dispatcher.submit(1, results.append, number)
+    wait_idle(dispatcher)
+
+    assert results == list(range(20))
+    assert dispatcher.stats()["processed"] == 20
+    assert dispatcher.stats()["queue_depth"] == 0
+
+
+def test_slow_key_does_not_block_other_keys():
+    dispatcher = KeyedDispatcher(workers=2)
+    dispatcher.start()
+    release = threading.Event()
+    done = threading.Event()
+
+    dispatcher.submit(1, release.wait, 5)
+    dispatcher.submit(1, lambda: None)
+    dispatcher.submit(2, done.set)
+
+    assert done.wait(5)
+    assert dispatcher.stats()["busy_keys"] == 1
+    release.set()
+    wait_idle(dispatcher)
+
+
+def test_submit_rejects_or_waits_when_full():
+    dispatcher = KeyedDispatcher(workers=1, max_depth=1)
+    release = threading.Event()
+    dispatcher.submit(1, release.wait, 5)
+
+    with pytest.raises(queue.Full):
+        dispatcher.submit(2, lambda: None, block=False)
+
+    submitted = threading.Event()
+    thread = threading.Thread(target=lambda: (
+        dispatcher.submit(2, lambda: None), submitted.set()
+    ))
+    thread.start()
+    assert not submitted.wait(0.1)
+    dispatcher.start()
+    assert submitted.wait(5)
+    release.set()
+    wait_idle(dispatcher)